@@ -0,0 +1,227 @@
+"""
+Client benchmarks against the fake web UI server in tests/fake_server.py
+
+Measures per-call client overhead, throughput at several concurrency levels and
+latency percentiles for the sync, async and streaming paths. Results are saved to
+benchmarks/results/<version>.json and compared with the last saved run of another
+version, so regressions show up between releases.
+
+Usage: python benchmarks/bench_client.py [--requests N] [--no-save] [--baseline PATH]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+ROOT = Path(__file__).resolve().parents[1]
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+sys.path.insert(0, str(ROOT / "tests"))
+sys.path.insert(0, str(ROOT))
+
+from fake_server import FakeWebUI  # noqa: E402
+
+from ooba_api.async_clients import AsyncOobaApiClient  # noqa: E402
+from ooba_api.clients import OobaApiClient  # noqa: E402
+from ooba_api.prompts import InstructPrompt  # noqa: E402
+from ooba_api.results import InstructResult  # noqa: E402
+from ooba_api.stats import summarize  # noqa: E402
+from ooba_api.transport import RequestsTransport  # noqa: E402
+
+CONCURRENCY_LEVELS = (1, 4, 16)
+
+# simulated generation: 20ms to first token, then 16 tokens at 1000 tokens/s
+SERVER_SETTINGS: dict[str, Any] = {
+    "latency": 0.02,
+    "tokens_per_second": 1000,
+    "output_tokens": 16,
+}
+
+PROMPT = InstructPrompt(prompt="Write a haiku about connection pooling.")
+
+
+def _version() -> str:
+    pyproject = (ROOT / "pyproject.toml").read_text()
+    match = re.search(r'^version = "(.+)"$', pyproject, re.MULTILINE)
+    return match.group(1) if match else "unknown"
+
+
+def _latency(result: InstructResult) -> float:
+    # time spent waiting for a free slot is the benchmark's own queueing, not latency
+    return result.timings.total - result.timings.queue_wait
+
+
+def _result(latencies: list[float], elapsed: float) -> dict:
+    return {
+        "requests_per_second": len(latencies) / elapsed,
+        "latency": summarize(latencies).as_dict(),
+    }
+
+
+def sync_overhead(requests: int) -> dict:
+    with FakeWebUI() as server, OobaApiClient(server.url) as client:
+        client.instruct(PROMPT)
+        start = time.perf_counter()
+        for _ in range(requests):
+            client.instruct(PROMPT)
+        elapsed = time.perf_counter() - start
+    return {"seconds_per_call": elapsed / requests}
+
+
+def async_overhead(requests: int) -> dict:
+    async def run() -> float:
+        with FakeWebUI() as server:
+            async with AsyncOobaApiClient(server.url) as client:
+                await client.instruct(PROMPT)
+                start = time.perf_counter()
+                for _ in range(requests):
+                    await client.instruct(PROMPT)
+                return time.perf_counter() - start
+
+    return {"seconds_per_call": asyncio.run(run()) / requests}
+
+
+def sync_throughput(requests: int, concurrency: int) -> dict:
+    with FakeWebUI(**SERVER_SETTINGS) as server, OobaApiClient(
+        server.url,
+        max_concurrency=concurrency,
+        transport=RequestsTransport(pool_maxsize=concurrency),
+    ) as client, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(lambda _: client.instruct_result(PROMPT), range(requests)))
+        elapsed = time.perf_counter() - start
+    return _result([_latency(result) for result in results], elapsed)
+
+
+def async_throughput(requests: int, concurrency: int) -> dict:
+    async def run() -> dict:
+        with FakeWebUI(**SERVER_SETTINGS) as server:
+            async with AsyncOobaApiClient(server.url, max_concurrency=concurrency) as client:
+                start = time.perf_counter()
+                results = await asyncio.gather(
+                    *(client.instruct_result(PROMPT) for _ in range(requests))
+                )
+                elapsed = time.perf_counter() - start
+        return _result([_latency(result) for result in results], elapsed)
+
+    return asyncio.run(run())
+
+
+def sync_streaming(requests: int, concurrency: int) -> dict:
+    with FakeWebUI(**SERVER_SETTINGS) as server:
+        client = OobaApiClient(
+            server.url, max_concurrency=concurrency, stream_url=server.stream_url
+        )
+
+        def stream(_: int) -> tuple[float, float]:
+            chunks = list(client.instruct_stream(PROMPT))
+            return chunks[0].elapsed, chunks[-1].elapsed
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            start = time.perf_counter()
+            timings = list(pool.map(stream, range(requests)))
+            elapsed = time.perf_counter() - start
+    result = _result([total for _, total in timings], elapsed)
+    result["time_to_first_token"] = summarize([first for first, _ in timings]).as_dict()
+    return result
+
+
+def async_streaming(requests: int, concurrency: int) -> dict:
+    async def run() -> dict:
+        with FakeWebUI(**SERVER_SETTINGS) as server:
+            client = AsyncOobaApiClient(
+                server.url, max_concurrency=concurrency, stream_url=server.stream_url
+            )
+
+            async def stream() -> tuple[float, float]:
+                chunks = [chunk async for chunk in client.instruct_stream(PROMPT)]
+                return chunks[0].elapsed, chunks[-1].elapsed
+
+            start = time.perf_counter()
+            timings = await asyncio.gather(*(stream() for _ in range(requests)))
+            elapsed = time.perf_counter() - start
+        result = _result([total for _, total in timings], elapsed)
+        result["time_to_first_token"] = summarize([first for first, _ in timings]).as_dict()
+        return result
+
+    return asyncio.run(run())
+
+
+def run_all(requests: int) -> dict:
+    benchmarks = {
+        "sync_overhead": sync_overhead(requests),
+        "async_overhead": async_overhead(requests),
+    }
+    for concurrency in CONCURRENCY_LEVELS:
+        # enough requests to keep every slot busy for a while
+        count = max(requests // 4, concurrency * 4)
+        benchmarks[f"sync_throughput_c{concurrency}"] = sync_throughput(count, concurrency)
+        benchmarks[f"async_throughput_c{concurrency}"] = async_throughput(count, concurrency)
+        benchmarks[f"sync_streaming_c{concurrency}"] = sync_streaming(count, concurrency)
+        benchmarks[f"async_streaming_c{concurrency}"] = async_streaming(count, concurrency)
+    return benchmarks
+
+
+def _headline(result: dict) -> tuple[str, float]:
+    if "seconds_per_call" in result:
+        return "us/call", result["seconds_per_call"] * 1e6
+    return "p50 ms", result["latency"]["p50"] * 1e3
+
+
+def report(benchmarks: dict, baseline: dict | None) -> None:
+    print(f"{'benchmark':<28} {'req/s':>10} {'metric':>10} {'value':>10} {'baseline':>10}")
+    for name, result in benchmarks.items():
+        unit, value = _headline(result)
+        rps = result.get("requests_per_second")
+        rps_text = f"{rps:.1f}" if rps is not None else "-"
+        line = f"{name:<28} {rps_text:>10} {unit:>10} {value:>10.2f}"
+        previous = (baseline or {}).get("benchmarks", {}).get(name)
+        if previous is not None:
+            old = _headline(previous)[1]
+            line += f" {old:>10.2f} ({(value - old) / old:+.0%})"
+        print(line)
+
+
+def _latest_baseline(version: str) -> Path | None:
+    candidates = [path for path in RESULTS_DIR.glob("*.json") if path.stem != version]
+    return max(candidates, key=lambda path: path.stat().st_mtime, default=None)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200, help="Requests per benchmark")
+    parser.add_argument("--no-save", action="store_true", help="Do not save the results")
+    parser.add_argument("--baseline", type=Path, help="Results file to compare against")
+    args = parser.parse_args()
+
+    version = _version()
+    baseline_path = args.baseline or _latest_baseline(version)
+    baseline = json.loads(baseline_path.read_text()) if baseline_path else None
+
+    results: dict[str, Any] = {
+        "version": version,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "server": SERVER_SETTINGS,
+        "benchmarks": run_all(args.requests),
+    }
+    if baseline_path:
+        print(f"Comparing against {baseline_path.name}")
+    report(results["benchmarks"], baseline)
+
+    if not args.no_save:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        path = RESULTS_DIR / f"{version}.json"
+        path.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Saved to {path.relative_to(ROOT)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Cost of building prompts and parameters for a large dataset
+
+Compares validating every object with the bulk constructors, which validate the shared
+template once and build the rest without validation.
+
+Usage: python benchmarks/bench_prompts.py [rows]
+"""
+import sys
+import time
+from typing import Callable
+
+from ooba_api.parameters import Parameters
+from ooba_api.prompts import LlamaInstructPrompt
+
+SYSTEM_PROMPT = "You are a helpful assistant."
+
+
+def validated(texts: list[str]) -> None:
+    for seed, text in enumerate(texts):
+        LlamaInstructPrompt(prompt=text, system_prompt=SYSTEM_PROMPT)
+        Parameters(seed=seed, max_new_tokens=64)
+
+
+def bulk(texts: list[str]) -> None:
+    for _ in LlamaInstructPrompt.bulk(texts, system_prompt=SYSTEM_PROMPT):
+        pass
+    for _ in Parameters.bulk(({"seed": seed} for seed in range(len(texts))), max_new_tokens=64):
+        pass
+
+
+def compiled(texts: list[str]) -> None:
+    for _ in LlamaInstructPrompt.compile(SYSTEM_PROMPT).prompts(texts):
+        pass
+    for _ in Parameters.bulk(({"seed": seed} for seed in range(len(texts))), max_new_tokens=64):
+        pass
+
+
+def main() -> None:
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    texts = [f"Summarize record {row}." for row in range(rows)]
+    cases: dict[str, Callable[[list[str]], None]] = {
+        "validated per row": validated,
+        "bulk": bulk,
+        "bulk, compiled template": compiled,
+    }
+    for name, case in cases.items():
+        start = time.perf_counter()
+        case(texts)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<28} {elapsed:6.2f}s  {elapsed / rows * 1e6:6.2f} us/row")
+
+
+if __name__ == "__main__":
+    main()
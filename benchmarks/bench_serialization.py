@@ -0,0 +1,64 @@
+"""
+Per-call client overhead of building a generate request and decoding its response
+
+Compares the old path (model_dump, merged dict, stdlib json, response.json()) with
+the codec path (cached parameter fragment, spliced body, codec.loads).
+
+Usage: python benchmarks/bench_serialization.py [iterations]
+"""
+import functools
+import json
+import sys
+import timeit
+from typing import Callable
+
+from ooba_api.clients import _instruct_body
+from ooba_api.codecs import JsonCodec, OrjsonCodec, StdlibJsonCodec
+from ooba_api.parameters import DEFAULT_PARAMETERS, Parameters, _dump
+from ooba_api.prompts import InstructPrompt
+
+PROMPT = InstructPrompt(prompt="Write a haiku about connection pooling. " * 20)
+RESPONSE = json.dumps({"results": [{"text": "output text " * 100}]}).encode()
+
+
+def old_path(parameters: Parameters) -> str:
+    request = {"prompt": PROMPT.full_prompt(), "negative_prompt": ""} | _dump(parameters)
+    json.dumps(request).encode()
+    return json.loads(RESPONSE)["results"][0]["text"]
+
+
+def codec_path(parameters: Parameters, codec: JsonCodec) -> str:
+    _instruct_body(PROMPT, parameters, False, codec)
+    return codec.loads(RESPONSE)["results"][0]["text"]
+
+
+def fresh_codec_path(codec: JsonCodec) -> str:
+    return codec_path(Parameters(seed=1), codec)
+
+
+def main() -> None:
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    codecs: list[JsonCodec] = [StdlibJsonCodec()]
+    try:
+        codecs.append(OrjsonCodec())
+    except ImportError:
+        print("orjson is not installed, skipping OrjsonCodec")
+
+    cases: dict[str, Callable[[], str]] = {
+        "old path, default parameters": lambda: old_path(DEFAULT_PARAMETERS),
+        "old path, fresh parameters": lambda: old_path(Parameters(seed=1)),
+    }
+    for codec in codecs:
+        name = type(codec).__name__
+        cases[f"{name}, default (frozen) parameters"] = functools.partial(
+            codec_path, DEFAULT_PARAMETERS, codec
+        )
+        cases[f"{name}, fresh parameters"] = functools.partial(fresh_codec_path, codec)
+
+    for name, case in cases.items():
+        seconds = min(timeit.repeat(case, number=iterations, repeat=5))
+        print(f"{name:<48} {seconds / iterations * 1e6:8.2f} us/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,116 @@
-from .clients import OobaApiClient
-from .model_info import OobaModelInfo, OobaModelNotLoaded
-from .parameters import Parameters
-from .prompts import ChatPrompt, InstructPrompt, LlamaInstructPrompt, Prompt
-
-__all__ = [
-    "ChatPrompt",
-    "InstructPrompt",
-    "LlamaInstructPrompt",
-    "OobaApiClient",
-    "OobaModelInfo",
-    "OobaModelNotLoaded",
-    "Parameters",
-    "Prompt",
-]
+"""
+Python client for the text generation web UI
+
+Names are imported from their submodules on first access, so importing the package
+stays cheap for short-lived processes that only need part of it.
+"""
+# the TYPE_CHECKING imports are re-exports, which ruff cannot tell from the computed __all__
+# ruff: noqa: F401
+import importlib
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from .async_clients import AsyncOobaApiClient
+    from .batch import BatchResult
+    from .cache import LRUResponseCache, ResponseCache, SQLiteResponseCache
+    from .chat import AsyncConversation, ChatHistory, Conversation
+    from .clients import OobaApiClient
+    from .codecs import JsonCodec, OrjsonCodec, StdlibJsonCodec
+    from .fanout import NoValidSample, Sample
+    from .limits import AdaptiveLimit, ConcurrencyLimitTimeout, Lane, LaneStats, QueueFull
+    from .model_info import OobaModelInfo, OobaModelNotLoaded
+    from .parameters import FrozenParameters, Parameters
+    from .pool import Backend, NoHealthyBackends, OobaClientPool
+    from .prompts import (
+        ChatPrompt,
+        CompiledPrompt,
+        CompiledTemplate,
+        InstructPrompt,
+        LlamaInstructPrompt,
+        Prompt,
+    )
+    from .results import InstructResult, RequestTimings
+    from .retry import Deadline, DeadlineExceeded, HedgePolicy, RetryPolicy
+    from .scheduler import ModelKey, ModelScheduler
+    from .stopping import CodeFenceStop, JsonObjectStop, RegexStop, StopResult
+    from .streaming import StreamChunk
+    from .tokens import PromptTooLong, TokenCountCache
+    from .transport import (
+        AsyncTransport,
+        HttpxTransport,
+        RequestsTransport,
+        Transport,
+        TransportAborted,
+    )
+
+# public name -> submodule defining it
+_EXPORTS = {
+    "AdaptiveLimit": "limits",
+    "AsyncConversation": "chat",
+    "AsyncOobaApiClient": "async_clients",
+    "AsyncTransport": "transport",
+    "Backend": "pool",
+    "BatchResult": "batch",
+    "ChatHistory": "chat",
+    "ChatPrompt": "prompts",
+    "CompiledPrompt": "prompts",
+    "CompiledTemplate": "prompts",
+    "CodeFenceStop": "stopping",
+    "ConcurrencyLimitTimeout": "limits",
+    "Conversation": "chat",
+    "Deadline": "retry",
+    "DeadlineExceeded": "retry",
+    "FrozenParameters": "parameters",
+    "HedgePolicy": "retry",
+    "HttpxTransport": "transport",
+    "InstructPrompt": "prompts",
+    "InstructResult": "results",
+    "JsonCodec": "codecs",
+    "JsonObjectStop": "stopping",
+    "Lane": "limits",
+    "LaneStats": "limits",
+    "LlamaInstructPrompt": "prompts",
+    "LRUResponseCache": "cache",
+    "ModelKey": "scheduler",
+    "ModelScheduler": "scheduler",
+    "NoHealthyBackends": "pool",
+    "NoValidSample": "fanout",
+    "OobaApiClient": "clients",
+    "OobaClientPool": "pool",
+    "OobaModelInfo": "model_info",
+    "OobaModelNotLoaded": "model_info",
+    "OrjsonCodec": "codecs",
+    "Parameters": "parameters",
+    "Prompt": "prompts",
+    "PromptTooLong": "tokens",
+    "QueueFull": "limits",
+    "RegexStop": "stopping",
+    "RequestTimings": "results",
+    "RequestsTransport": "transport",
+    "ResponseCache": "cache",
+    "RetryPolicy": "retry",
+    "Sample": "fanout",
+    "SQLiteResponseCache": "cache",
+    "StdlibJsonCodec": "codecs",
+    "StopResult": "stopping",
+    "StreamChunk": "streaming",
+    "TokenCountCache": "tokens",
+    "Transport": "transport",
+    "TransportAborted": "transport",
+}
+
+# derived, so it cannot drift from _EXPORTS
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    # cache on the module, later lookups skip __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,901 @@
+import asyncio
+import contextlib
+import functools
+import logging
+import time
+from typing import (
+    AsyncGenerator,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterable,
+    Mapping,
+    Sequence,
+)
+
+import httpx
+
+from ooba_api.batch import BatchResult, arun_as_completed
+from ooba_api.cache import ResponseCache, cache_key
+from ooba_api.clients import (
+    _chat_body,
+    _chat_reply,
+    _default_stream_url,
+    _history_json,
+    _instruct_body,
+    _instruct_text,
+    _is_cacheable,
+    _loaded_model_info,
+    _log_response,
+    _model_info,
+    _output_tokens,
+    _service_time,
+    _token_count,
+    _within_deadline,
+)
+from ooba_api.coalesce import AsyncSingleFlight
+from ooba_api.codecs import JsonCodec, default_codec
+from ooba_api.fanout import (
+    NoValidSample,
+    Sample,
+    accept,
+    arun_fan_out,
+    best_sample,
+    sample_parameters,
+)
+from ooba_api.limits import (
+    DEFAULT_LANES,
+    DEFAULT_PRIORITY,
+    AdaptiveLimit,
+    AsyncConcurrencyLimiter,
+    ConcurrencyLimitTimeout,
+    Lane,
+    LaneStats,
+)
+from ooba_api.model_info import OobaModelInfo
+from ooba_api.parameters import DEFAULT_PARAMETERS, Parameters
+from ooba_api.prompts import ChatPrompt, Prompt
+from ooba_api.results import InstructResult, RequestTimings
+from ooba_api.retry import Deadline, RetryPolicy
+from ooba_api.stopping import StopPredicate, StopResult, find_stop
+from ooba_api.streaming import StreamChunk, astream_generate
+from ooba_api.tokens import TokenCountCache, fit_parameters, max_new_tokens_for
+from ooba_api.transport import AsyncTransport, HttpxTransport
+
+logger = logging.getLogger("ooba_api")
+
+
+class AsyncOobaApiClient:
+    """
+    asyncio client for the Ooba Booga text generation web UI
+
+    Mirrors OobaApiClient, but every call is awaited and many requests can be in
+    flight on one event loop.
+    """
+
+    # base URL of the server
+    url: str
+
+    # full URL to chat endpoint
+    _chat_url: str
+
+    # full URL to generate endpoint
+    _generate_url: str
+
+    # full URL to model endpoint
+    _model_url: str
+
+    # full URL to websocket stream endpoint
+    _stream_url: str
+
+    # full URL to stop generation endpoint
+    _stop_url: str
+
+    # full URL to token count endpoint
+    _token_count_url: str
+
+    # API Key, not yet used
+    api_key: str | None
+
+    # Enforce one request at a time, from this client, to avoid overwhelming the server
+    one_at_a_time: bool
+
+    # limits generate requests in flight from this client
+    _generate_limiter: AsyncConcurrencyLimiter
+
+    # limits model requests in flight from this client
+    _model_limiter: AsyncConcurrencyLimiter
+
+    # max seconds to wait for a free request slot. None waits forever
+    acquire_timeout: float | None
+
+    # sends the HTTP requests, holds the pooled connections
+    transport: AsyncTransport
+
+    # stores responses to deterministic requests. None disables caching
+    cache: ResponseCache | None
+
+    # model info as last seen by this client, None if not fetched yet. Part of the cache key
+    _loaded_model: OobaModelInfo | None
+
+    # time.monotonic() when _loaded_model was fetched
+    _loaded_model_at: float
+
+    # shares one generate request between identical in-flight instructs. None disables it
+    _single_flight: AsyncSingleFlight | None
+
+    # encodes request bodies and decodes responses
+    codec: JsonCodec
+
+    # token counts by model and text
+    token_cache: TokenCountCache
+
+    # retries failed requests. None sends each request once
+    retry: RetryPolicy | None
+
+    # seconds cached_model_info() trusts the last model info for. None trusts it until
+    # it is invalidated
+    model_info_ttl: float | None
+
+    def __init__(
+        self,
+        url: str | None = None,
+        *,
+        host: str = "http://localhost",
+        port: int = 5000,
+        api_key: str | None = None,
+        one_at_a_time: bool = True,
+        max_concurrency: int | None = None,
+        max_model_concurrency: int | None = 1,
+        acquire_timeout: float | None = None,
+        transport: AsyncTransport | None = None,
+        stream_url: str | None = None,
+        cache: ResponseCache | None = None,
+        coalesce: bool = False,
+        codec: JsonCodec | None = None,
+        token_cache: TokenCountCache | None = None,
+        retry: RetryPolicy | None = None,
+        model_info_ttl: float | None = None,
+        lanes: Mapping[str, Lane] = DEFAULT_LANES,
+        adaptive: AdaptiveLimit | None = None,
+    ):
+        """
+        :param url: Base URL of the server. Overrides host and port
+        :param host: Host of the server, including the scheme
+        :param port: Port of the server API
+        :param api_key: API key, not yet used
+        :param one_at_a_time: Enforce one generate request at a time. Ignored if
+            max_concurrency is given
+        :param max_concurrency: Max generate requests in flight from this client.
+            None means unlimited
+        :param max_model_concurrency: Max model requests in flight from this client.
+            None means unlimited
+        :param acquire_timeout: Max seconds to wait for a free request slot. None waits forever
+        :param transport: Transport to send requests with. Defaults to a pooled
+            HttpxTransport owned, and closed, by this client
+        :param stream_url: Base URL of the streaming API. Defaults to the same host on port 5005
+        :param cache: Cache for instruct responses. Only requests with a fixed seed are cached
+        :param coalesce: Identical instructs in flight at the same time share one request.
+            Only requests with a fixed seed are coalesced
+        :param codec: JSON codec. Defaults to orjson if it is installed, otherwise json
+        :param token_cache: Cache for token counts. Defaults to a new in-memory cache
+        :param retry: Retry policy for failed requests. None sends each request once
+        :param model_info_ttl: Seconds cached_model_info() trusts the last model info for.
+            None trusts it until a model is loaded or a generation fails
+        :param lanes: Priority lanes generate requests wait in for a slot, by name
+        :param adaptive: Find the generate concurrency the server handles well from
+            observed latency, 5xx responses and timeouts. Overrides max_concurrency and
+            one_at_a_time
+        """
+        if url:
+            self.url = url
+        else:
+            self.url = f"{host}:{port}"
+        self._chat_url = f"{self.url}/api/v1/chat"
+        self._generate_url = f"{self.url}/api/v1/generate"
+        self._model_url = f"{self.url}/api/v1/model"
+        self._stream_url = f"{stream_url or _default_stream_url(self.url)}/api/v1/stream"
+        self._stop_url = f"{self.url}/api/v1/stop-stream"
+        self._token_count_url = f"{self.url}/api/v1/token-count"
+        self.api_key = api_key
+        self.one_at_a_time = one_at_a_time
+        if max_concurrency is None and one_at_a_time:
+            max_concurrency = 1
+        # asyncio primitives belong to one event loop, so these are not shared between clients
+        self._generate_limiter = AsyncConcurrencyLimiter(max_concurrency, lanes, adaptive)
+        self._model_limiter = AsyncConcurrencyLimiter(max_model_concurrency)
+        self.acquire_timeout = acquire_timeout
+        self._owns_transport = transport is None
+        self.transport = transport or HttpxTransport()
+        self.cache = cache
+        self._loaded_model = None
+        self._loaded_model_at = 0.0
+        self._single_flight = AsyncSingleFlight() if coalesce else None
+        self.codec = codec or default_codec()
+        self.token_cache = token_cache if token_cache is not None else TokenCountCache()
+        self.retry = retry
+        self.model_info_ttl = model_info_ttl
+        self._refresh_task: asyncio.Task | None = None
+
+        if self.api_key:
+            logger.warning("API keys are not yet supported")
+
+    async def __aenter__(self) -> "AsyncOobaApiClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        """
+        Stop refreshing the model info and close the transport's pooled connections, if
+        this client created the transport
+        """
+        await self.stop_model_info_refresh()
+        if self._owns_transport:
+            await self.transport.close()
+
+    @property
+    def concurrency_limit(self) -> int | None:
+        """
+        Max generate requests in flight, the current one with an adaptive limit
+        """
+        return self._generate_limiter.limit
+
+    def lane_stats(self) -> dict[str, LaneStats]:
+        """
+        Queue depth, admissions, rejections and queue wait of each priority lane, for
+        generate requests from this client
+        """
+        return self._generate_limiter.lane_stats()
+
+    def _limiter_for(self, target_url: str) -> AsyncConcurrencyLimiter:
+        # token counts and stops are quick, keep them from queueing behind generations
+        if target_url in (self._model_url, self._token_count_url, self._stop_url):
+            return self._model_limiter
+        return self._generate_limiter
+
+    async def _post(
+        self,
+        target_url: str,
+        timeout: float,
+        data: dict | bytes,
+        timings: RequestTimings | None = None,
+        *,
+        deadline: Deadline | None = None,
+        idempotent: bool = True,
+        priority: str = DEFAULT_PRIORITY,
+    ) -> httpx.Response:
+        content = data if isinstance(data, bytes) else self.codec.dumps(data)
+        if self.retry is None:
+            return await self._post_once(
+                target_url, timeout, content, timings, deadline, priority
+            )
+
+        attempt = 1
+        while True:
+            try:
+                response = await self._post_once(
+                    target_url, timeout, content, timings, deadline, priority
+                )
+            except Exception as exc:
+                delay = self.retry.retry_delay(attempt, error=exc, idempotent=idempotent)
+                if delay is None or not _within_deadline(delay, deadline):
+                    raise
+                reason = repr(exc)
+            else:
+                delay = self.retry.retry_delay(
+                    attempt, status=response.status_code, idempotent=idempotent
+                )
+                if delay is None or not _within_deadline(delay, deadline):
+                    return response
+                reason = f"status {response.status_code}"
+                await response.aclose()
+            logger.info(
+                f"Retrying {target_url} in {delay:.2f}s after attempt {attempt}: {reason}"
+            )
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _post_once(
+        self,
+        target_url: str,
+        timeout: float,
+        content: bytes,
+        timings: RequestTimings | None,
+        deadline: Deadline | None,
+        priority: str = DEFAULT_PRIORITY,
+    ) -> httpx.Response:
+        acquire_timeout = self.acquire_timeout
+        if deadline is not None:
+            acquire_timeout = deadline.cap(acquire_timeout)
+        limiter = self._limiter_for(target_url)
+        start = time.perf_counter()
+        try:
+            async with limiter.slot(acquire_timeout, priority):
+                if timings is not None:
+                    timings.queue_wait += time.perf_counter() - start
+                if deadline is not None:
+                    timeout = deadline.cap(timeout)
+                try:
+                    response = await self.transport.post(
+                        target_url, timeout=timeout, content=content, timings=timings
+                    )
+                except httpx.TimeoutException:
+                    # a timeout the deadline caused says nothing about the server
+                    if deadline is None or not deadline.expired:
+                        limiter.record_overload()
+                    raise
+                if limiter.adaptive is not None and response.status_code >= 500:
+                    limiter.record_overload()
+                return response
+        except (httpx.TimeoutException, ConcurrencyLimitTimeout) as exc:
+            # the deadline shortened the wait, report it as the cause
+            if deadline is not None and deadline.expired:
+                raise deadline.exceeded() from exc
+            raise
+
+    async def instruct(
+        self,
+        prompt: Prompt,
+        parameters: Parameters = DEFAULT_PARAMETERS,
+        timeout: int | float = 500,
+        print_prompt: bool = False,
+        cache_random_seed: bool = False,
+        deadline: float | None = None,
+        priority: str = DEFAULT_PRIORITY,
+    ) -> str:
+        """
+        Provide an instruction, get a response
+
+        :param prompt: Prompt to provide an instruction
+        :param parameters: Generation parameters
+        :param timeout: When to timeout
+        :param print_prompt: Print the prompt being used. Use case is debugging
+        :param cache_random_seed: Use the cache and coalescing even though the seed is
+            random (-1)
+        :param deadline: Max seconds for the whole call, including waiting for a slot,
+            retries and backoff. None means no limit beyond timeout per attempt
+        :param priority: Lane to wait for a request slot in, such as "interactive" or
+            "batch"
+        :raises DeadlineExceeded: The deadline passed before a response arrived
+        :raises QueueFull: The lane already has its max_queue requests waiting
+        """
+        budget = Deadline.after(deadline)
+        prompt_to_use, body = _instruct_body(prompt, parameters, print_prompt, self.codec)
+        if not _is_cacheable(parameters, cache_random_seed) or (
+            self.cache is None and self._single_flight is None
+        ):
+            return await self._generate_text(body, timeout, len(prompt_to_use), budget, priority)
+
+        key = cache_key(body, await self._model_name())
+        if self.cache is not None and (cached := self.cache.get(key)) is not None:
+            return cached
+        if self._single_flight is not None:
+            text = await self._single_flight.do(
+                key,
+                lambda: self._generate_text(body, timeout, len(prompt_to_use), budget, priority),
+                budget,
+            )
+        else:
+            text = await self._generate_text(body, timeout, len(prompt_to_use), budget, priority)
+        if self.cache is not None:
+            self.cache.set(key, text)
+        return text
+
+    async def instruct_result(
+        self,
+        prompt: Prompt,
+        parameters: Parameters = DEFAULT_PARAMETERS,
+        timeout: int | float = 500,
+        print_prompt: bool = False,
+        deadline: float | None = None,
+        priority: str = DEFAULT_PRIORITY,
+    ) -> InstructResult:
+        """
+        Same as instruct, but returns the text along with where the time went
+
+        Always sends a request, the cache and coalescing are not used.
+
+        :param prompt: Prompt to provide an instruction
+        :param parameters: Generation parameters
+        :param timeout: When to timeout
+        :param print_prompt: Print the prompt being used. Use case is debugging
+        :param deadline: Max seconds for the whole call, see instruct
+        :param priority: Lane to wait for a request slot in, see instruct
+        """
+        prompt_to_use, body = _instruct_body(prompt, parameters, print_prompt, self.codec)
+        return await self._generate(
+            body, timeout, len(prompt_to_use), Deadline.after(deadline), priority
+        )
+
+    def encode_instruct(
+        self, prompt: Prompt, parameters: Parameters = DEFAULT_PARAMETERS
+    ) -> bytes:
+        """
+        Encode the body of an instruct request, for use with instruct_encoded
+
+        :param prompt: Prompt to provide an instruction
+        :param parameters: Generation parameters
+        """
+        return _instruct_body(prompt, parameters, False, self.codec)[1]
+
+    async def instruct_encoded(
+        self,
+        body: bytes,
+        timeout: int | float = 500,
+        deadline: float | None = None,
+        priority: str = DEFAULT_PRIORITY,
+    ) -> str:
+        """
+        Send an already encoded instruct request, get a response
+
+        The cache and coalescing are not used.
+
+        :param body: JSON body of a generate request, see encode_instruct
+        :param timeout: When to timeout
+        :param deadline: Max seconds for the whole call, see instruct
+        :param priority: Lane to wait for a request slot in, see instruct
+        """
+        return await self._generate_text(
+            body, timeout, deadline=Deadline.after(deadline), priority=priority
+        )
+
+    async def _generate_text(
+        self,
+        body: bytes,
+        timeout: int | float,
+        prompt_length: int | None = None,
+        deadline: Deadline | None = None,
+        priority: str = DEFAULT_PRIORITY,
+    ) -> str:
+        return (await self._generate(body, timeout, prompt_length, deadline, priority)).text
+
+    async def _generate(
+        self,
+        body: bytes,
+        timeout: int | float,
+        prompt_length: int | None = None,
+        deadline: Deadline | None = None,
+        priority: str = DEFAULT_PRIORITY,
+    ) -> InstructResult:
+        timings = RequestTimings()
+        start = time.perf_counter()
+        response = await self._post(
+            self._generate_url,
+            timeout=timeout,
+            data=body,
+            timings=timings,
+            deadline=deadline,
+            priority=priority,
+        )
+        self._raise_for_status(response)
+        decode_start = time.perf_counter()
+        data = self.codec.loads(response.content)
+        timings.decode = time.perf_counter() - decode_start
+        timings.total = time.perf_counter() - start
+        _log_response(data)
+
+        result = InstructResult(
+            text=_instruct_text(data),
+            url=self.url,
+            prompt_length=prompt_length,
+            output_tokens=_output_tokens(data),
+            timings=timings,
+        )
+        self._generate_limiter.record_latency(_service_time(result))
+        return result
+
+    async def instruct_many(
+        self,
+        prompts: Iterable[Prompt],
+        parameters: Parameters = DEFAULT_PARAMETERS,
+        timeout: int | float = 500,
+        max_concurrency: int = 4,
+        priority: str = "batch",
+    ) -> list[BatchResult]:
+        """
+        Run many independent instructions concurrently
+
+        Requests still respect the client's max_concurrency, so raise that as well to
+        actually send requests in parallel.
+
+        :param prompts: Prompts to provide instructions
+        :param parameters: Generation parameters, used for every prompt
+        :param timeout: When to timeout, per request
+        :param max_concurrency: Max requests in flight from this call
+        :param priority: Lane to wait for request slots in, see instruct. Batches yield to
+            interactive requests by default
+        :return: One result per prompt, in input order. Failed requests carry the error
+        """
+        results = [
+            result
+            async for result in self.instruct_many_as_completed(
+                prompts, parameters, timeout, max_concurrency, priority
+            )
+        ]
+        results.sort(key=lambda result: result.index)
+        return results
+
+    async def instruct_many_as_completed(
+        self,
+        prompts: Iterable[Prompt],
+        parameters: Parameters = DEFAULT_PARAMETERS,
+        timeout: int | float = 500,
+        max_concurrency: int = 4,
+        priority: str = "batch",
+    ) -> AsyncIterator[BatchResult]:
+        """
+        Same as instruct_many, but results are yielded as they finish
+
+        :yield: One result per prompt, in completion order. Failed requests carry the error
+        """
+        instruct = functools.partial(
+            self.instruct, parameters=parameters, timeout=timeout, priority=priority
+        )
+        async for result in arun_as_completed(instruct, prompts, max_concurrency):
+            yield result
+
+    async def instruct_samples(
+        self,
+        prompt: Prompt,
+        parameters: Parameters | Sequence[Parameters] = DEFAULT_PARAMETERS,
+        n: int = 4,
+        timeout: int | float = 500,
+        priority: str = DEFAULT_PRIORITY,
+    ) -> list[Sample]:
+        """
+        Send one prompt with several parameter sets at once, get every sample, see
+        OobaApiClient.instruct_samples
+        """
+        samples = [
+            sample
+            async for sample in arun_fan_out(
+                self._sampler(prompt, timeout, priority), sample_parameters(parameters, n)
+            )
+        ]
+        return sorted(samples, key=lambda sample: sample.index)
+
+    async def instruct_best_of(
+        self,
+        prompt: Prompt,
+        score: Callable[[str], float],
+        parameters: Parameters | Sequence[Parameters] = DEFAULT_PARAMETERS,
+        n: int = 4,
+        timeout: int | float = 500,
+        priority: str = DEFAULT_PRIORITY,
+    ) -> Sample:
+        """
+        Generate every sample and return the highest scoring one, see
+        OobaApiClient.instruct_best_of
+        """
+        samples = await self.instruct_samples(prompt, parameters, n, timeout, priority)
+        return best_sample(samples, score)
+
+    async def instruct_first_valid(
+        self,
+        prompt: Prompt,
+        validator: Callable[[str], bool],
+        parameters: Parameters | Sequence[Parameters] = DEFAULT_PARAMETERS,
+        n: int = 4,
+        timeout: int | float = 500,
+        priority: str = DEFAULT_PRIORITY,
+        stop_server: bool = False,
+    ) -> Sample:
+        """
+        Send samples at once and return the first to pass validator, see
+        OobaApiClient.instruct_first_valid
+
+        The requests still running are cancelled, which frees their concurrency limit
+        slots. The server does not notice and finishes generating them, unless
+        stop_server is set.
+        """
+        parameter_sets = sample_parameters(parameters, n)
+        finished: list[Sample] = []
+        samples = arun_fan_out(self._sampler(prompt, timeout, priority), parameter_sets)
+        async with contextlib.aclosing(samples):
+            async for sample in samples:
+                finished.append(sample)
+                if accept(sample, validator):
+                    break
+            else:
+                raise NoValidSample(sorted(finished, key=lambda sample: sample.index))
+        if stop_server and len(finished) < len(parameter_sets):
+            await self.stop_generation()
+        return sample
+
+    def _sampler(
+        self, prompt: Prompt, timeout: int | float, priority: str
+    ) -> Callable[[Parameters], Awaitable[str]]:
+        # not through instruct, see OobaApiClient._sampler
+        def sample(parameters: Parameters) -> Awaitable[str]:
+            prompt_to_use, body = _instruct_body(prompt, parameters, False, self.codec)
+            return self._generate_text(body, timeout, len(prompt_to_use), priority=priority)
+
+        return sample
+
+    async def instruct_stream(
+        self,
+        prompt: Prompt,
+        parameters: Parameters = DEFAULT_PARAMETERS,
+        timeout: int | float = 500,
+        print_prompt: bool = False,
+        priority: str = DEFAULT_PRIORITY,
+    ) -> AsyncGenerator[StreamChunk, None]:
+        """
+        Provide an instruction, get the response streamed back as it is generated
+
+        :param prompt: Prompt to provide an instruction
+        :param parameters: Generation parameters
+        :param timeout: Max seconds to wait between chunks
+        :param print_prompt: Print the prompt being used. Use case is debugging
+        :param priority: Lane to wait for a request slot in, see instruct
+        :yield: Chunks of generated text, with their arrival times
+        """
+        body = _instruct_body(prompt, parameters, print_prompt, self.codec)[1]
+        async with self._generate_limiter.slot(self.acquire_timeout, priority):
+            async for chunk in astream_generate(self._stream_url, body, timeout):
+                yield chunk
+
+    async def instruct_until(
+        self,
+        prompt: Prompt,
+        stop: Sequence[StopPredicate],
+        parameters: Parameters = DEFAULT_PARAMETERS,
+        timeout: int | float = 500,
+        print_prompt: bool = False,
+        priority: str = DEFAULT_PRIORITY,
+        stop_server: bool = True,
+    ) -> StopResult:
+        """
+        Stream an instruction's response until a stop predicate fires, see
+        OobaApiClient.instruct_until
+        """
+        text = ""
+        stream = self.instruct_stream(prompt, parameters, timeout, print_prompt, priority)
+        async with contextlib.aclosing(stream):
+            async for chunk in stream:
+                text += chunk.text
+                if (result := find_stop(text, stop)) is not None:
+                    break
+            else:
+                return StopResult(text, None)
+        if stop_server:
+            await self.stop_generation()
+        return result
+
+    async def stop_generation(self, timeout: int | float = 5) -> None:
+        """
+        Ask the server to stop generating, see OobaApiClient.stop_generation
+        """
+        try:
+            response = await self._post(self._stop_url, timeout, {})
+            response.raise_for_status()
+        except httpx.HTTPError as exc:
+            logger.warning(f"Could not stop generation: {exc!r}")
+
+    async def chat(
+        self,
+        prompt: ChatPrompt,
+        parameters: Parameters = DEFAULT_PARAMETERS,
+        timeout: int | float = 500,
+        deadline: float | None = None,
+        priority: str = DEFAULT_PRIORITY,
+    ) -> str:
+        """
+        Send a message with the history before it, get the reply
+
+        The server renders the history with the character or instruction template. For
+        a running session, AsyncConversation avoids encoding the whole history every turn.
+
+        :param prompt: New message, history and chat settings
+        :param parameters: Generation parameters
+        :param timeout: When to timeout
+        :param deadline: Max seconds for the whole call, see instruct
+        :param priority: Lane to wait for a request slot in, see instruct
+        """
+        rows = [self.codec.dumps(row) for row in prompt.history()]
+        body = _chat_body(
+            prompt.prompt, _history_json(rows), prompt.chat_settings(), parameters, self.codec
+        )
+        return await self.chat_encoded(body, timeout, deadline, priority)
+
+    async def chat_encoded(
+        self,
+        body: bytes,
+        timeout: int | float = 500,
+        deadline: float | None = None,
+        priority: str = DEFAULT_PRIORITY,
+    ) -> str:
+        """
+        Send an already encoded chat request, get the reply
+
+        :param body: JSON body of a chat request
+        :param timeout: When to timeout
+        :param deadline: Max seconds for the whole call, see instruct
+        :param priority: Lane to wait for a request slot in, see instruct
+        """
+        response = await self._post(
+            self._chat_url,
+            timeout=timeout,
+            data=body,
+            deadline=Deadline.after(deadline),
+            priority=priority,
+        )
+        self._raise_for_status(response)
+        data = self.codec.loads(response.content)
+        _log_response(data)
+        return _chat_reply(data)
+
+    async def count_tokens(self, text: str, timeout: int | float = 30) -> int:
+        """
+        Number of tokens the loaded model encodes the text to, cached per model
+
+        :param text: Text to count, as sent to the model
+        :param timeout: When to timeout
+        """
+        model_name = await self._model_name()
+        count = self.token_cache.get(model_name, text)
+        if count is None:
+            response = await self._post(self._token_count_url, timeout, {"prompt": text})
+            self._raise_for_status(response)
+            count = _token_count(self.codec.loads(response.content))
+            self.token_cache.set(model_name, text, count)
+        return count
+
+    async def count_prompt_tokens(self, prompt: Prompt, timeout: int | float = 30) -> int:
+        """
+        Number of tokens in the rendered prompt
+
+        For prompts from a compiled template, the shared prefix is counted once and
+        cached, and only the rest of each prompt is sent. Counting the two parts
+        separately can come out a token or two higher than counting the whole prompt.
+
+        :param prompt: Prompt to count
+        :param timeout: When to timeout, per request
+        """
+        full_prompt = prompt.full_prompt()
+        prefix = prompt.shared_prefix()
+        if not prefix:
+            return await self.count_tokens(full_prompt, timeout)
+        return await self.count_tokens(prefix, timeout) + await self.count_tokens(
+            full_prompt[len(prefix) :], timeout
+        )
+
+    async def max_new_tokens_for(
+        self,
+        prompt: Prompt,
+        parameters: Parameters = DEFAULT_PARAMETERS,
+        min_new_tokens: int = 1,
+    ) -> int:
+        """
+        Largest max_new_tokens that generates without the server truncating the prompt
+
+        :param prompt: Prompt to provide an instruction
+        :param parameters: Generation parameters. max_new_tokens is kept if it already fits
+        :param min_new_tokens: Fewest new tokens worth generating
+        :raises PromptTooLong: Fewer than min_new_tokens fit
+        """
+        prompt_tokens = await self.count_prompt_tokens(prompt)
+        return max_new_tokens_for(prompt_tokens, parameters, min_new_tokens)
+
+    async def fit_parameters(
+        self,
+        prompt: Prompt,
+        parameters: Parameters = DEFAULT_PARAMETERS,
+        min_new_tokens: int = 1,
+    ) -> Parameters:
+        """
+        Same as max_new_tokens_for, but returns parameters to send with the prompt
+
+        :return: parameters itself if it already fits, otherwise a copy with
+            max_new_tokens lowered
+        :raises PromptTooLong: Fewer than min_new_tokens fit
+        """
+        return fit_parameters(await self.count_prompt_tokens(prompt), parameters, min_new_tokens)
+
+    async def _model_api(
+        self, request: dict, timeout: int | float = 500, idempotent: bool = True
+    ) -> dict:
+        response = await self._post(self._model_url, timeout, request, idempotent=idempotent)
+        response.raise_for_status()
+        data = self.codec.loads(response.content)
+        _log_response(data)
+
+        return data["result"]
+
+    async def _model_name(self) -> str | None:
+        return (await self.cached_model_info()).model_name
+
+    def _set_loaded_model(self, model_info: OobaModelInfo) -> OobaModelInfo:
+        self._loaded_model = model_info
+        self._loaded_model_at = time.monotonic()
+        return model_info
+
+    def _raise_for_status(self, response: httpx.Response) -> None:
+        try:
+            response.raise_for_status()
+        except httpx.HTTPStatusError as exc:
+            # the web UI answers with a 500 when the model was unloaded or is being swapped
+            if exc.response.status_code >= 500:
+                self.invalidate_model_info()
+            raise
+
+    def invalidate_model_info(self) -> None:
+        """
+        Forget the cached model info, the next cached_model_info() asks the server
+        """
+        self._loaded_model = None
+
+    async def model_info(self, timeout: int | float = 5) -> OobaModelInfo:
+        """
+        Ask the server which model is loaded, updating the cached model info
+        """
+        result = await self._model_api({"action": "info"}, timeout=timeout)
+        return self._set_loaded_model(_model_info(result))
+
+    async def cached_model_info(self, timeout: int | float = 5) -> OobaModelInfo:
+        """
+        Model info as last seen, only asking the server if it is missing or older than
+        model_info_ttl
+
+        The cache is invalidated when load_model succeeds and when a generation or token
+        count fails with a server error, which is how an unloaded or swapped model shows up.
+
+        :param timeout: When to timeout, if the server is asked
+        """
+        model_info = self._loaded_model
+        if model_info is not None and (
+            self.model_info_ttl is None
+            or time.monotonic() - self._loaded_model_at < self.model_info_ttl
+        ):
+            return model_info
+        return await self.model_info(timeout)
+
+    def start_model_info_refresh(self, interval: float) -> None:
+        """
+        Refresh the cached model info every interval seconds from a background task
+
+        With interval below model_info_ttl, cached_model_info() never waits on the server.
+        Must be called from a running event loop. close() stops the refresh. Failed
+        refreshes are logged and retried at the next interval.
+        """
+        if self._refresh_task is not None:
+            return
+
+        async def run() -> None:
+            while True:
+                try:
+                    await self.model_info()
+                except httpx.HTTPError as exc:
+                    logger.warning(f"Could not refresh model info from {self.url}: {exc!r}")
+                except Exception:
+                    # keep refreshing, an unexpected response may not last
+                    logger.exception(f"Could not refresh model info from {self.url}")
+                await asyncio.sleep(interval)
+
+        self._refresh_task = asyncio.create_task(run())
+
+    async def stop_model_info_refresh(self) -> None:
+        if self._refresh_task is None:
+            return
+        self._refresh_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._refresh_task
+        self._refresh_task = None
+
+    async def load_model(
+        self, model_name: str, *, args_dict: dict, timeout: int | float = 5000
+    ) -> OobaModelInfo:
+        # loading again after a lost response would load the model twice, so not idempotent
+        try:
+            result = await self._model_api(
+                {"action": "load", "model_name": model_name, "args": args_dict},
+                timeout=timeout,
+                idempotent=False,
+            )
+        except Exception:
+            # a failed load may have unloaded the previous model
+            self.invalidate_model_info()
+            raise
+        return self._set_loaded_model(_loaded_model_info(result))
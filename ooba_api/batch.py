@@ -0,0 +1,96 @@
+import asyncio
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Generator, Iterable
+
+from ooba_api.prompts import Prompt
+
+
+@dataclass
+class BatchResult:
+    # position of the prompt in the input
+    index: int
+
+    prompt: Prompt
+
+    # generated text, None if the request failed
+    text: str | None = None
+
+    # what went wrong, None if the request succeeded
+    error: BaseException | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _run_one(instruct: Callable[[Prompt], str], index: int, prompt: Prompt) -> BatchResult:
+    try:
+        return BatchResult(index=index, prompt=prompt, text=instruct(prompt))
+    except Exception as exc:
+        return BatchResult(index=index, prompt=prompt, error=exc)
+
+
+def run_as_completed(
+    instruct: Callable[[Prompt], str], prompts: Iterable[Prompt], max_concurrency: int
+) -> Generator[BatchResult, None, None]:
+    """
+    Run instruct over every prompt on a thread pool, yielding results as they finish
+
+    Prompts are pulled from the iterable as slots free up, so at most max_concurrency
+    prompts and results are held at once.
+
+    :param instruct: Called with each prompt, returns the generated text
+    :param prompts: Prompts to run
+    :param max_concurrency: Max requests in flight
+    """
+    with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="ooba_api") as pool:
+        pending: set[Future[BatchResult]] = set()
+        try:
+            for index, prompt in enumerate(prompts):
+                if len(pending) >= max_concurrency:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                pending.add(pool.submit(_run_one, instruct, index, prompt))
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            # the caller stopped iterating early
+            for future in pending:
+                future.cancel()
+
+
+async def _arun_one(
+    instruct: Callable[[Prompt], Awaitable[str]], index: int, prompt: Prompt
+) -> BatchResult:
+    try:
+        return BatchResult(index=index, prompt=prompt, text=await instruct(prompt))
+    except Exception as exc:
+        return BatchResult(index=index, prompt=prompt, error=exc)
+
+
+async def arun_as_completed(
+    instruct: Callable[[Prompt], Awaitable[str]], prompts: Iterable[Prompt], max_concurrency: int
+) -> AsyncIterator[BatchResult]:
+    """
+    Async version of run_as_completed, running the requests as tasks on the event loop
+    """
+    pending: set[asyncio.Task[BatchResult]] = set()
+    try:
+        for index, prompt in enumerate(prompts):
+            if len(pending) >= max_concurrency:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+            pending.add(asyncio.create_task(_arun_one(instruct, index, prompt)))
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        # the caller stopped iterating early
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,332 @@
+import argparse
+import datetime
+import itertools
+import json
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+import requests
+
+from ooba_api.clients import OobaApiClient
+from ooba_api.model_info import OobaModelInfo
+from ooba_api.parameters import DEFAULT_PARAMETERS, Parameters, _dump, parse_value
+from ooba_api.prompts import InstructPrompt, Prompt
+from ooba_api.stats import LatencySummary, summarize
+from ooba_api.transport import RequestsTransport
+
+
+@dataclass
+class RunResult:
+    """
+    Results of driving a server at one concurrency with one set of parameters
+    """
+
+    # concurrent workers sending requests
+    concurrency: int
+
+    # parameters that differ from the defaults, from the parameter grid
+    parameters: dict
+
+    # requests that completed
+    requests: int
+
+    # requests that raised
+    errors: int
+
+    # wall clock seconds of the run
+    duration: float
+
+    # output tokens generated by completed requests. None if they could not be counted
+    output_tokens: int | None
+
+    latency: LatencySummary | None
+
+    # streaming only, seconds until the first chunk arrived
+    time_to_first_token: LatencySummary | None = None
+
+    # first few errors, for diagnosing a failing run
+    sample_errors: list[str] = field(default_factory=list)
+
+    @property
+    def requests_per_second(self) -> float:
+        return self.requests / self.duration
+
+    @property
+    def output_tokens_per_second(self) -> float | None:
+        if self.output_tokens is None:
+            return None
+        return self.output_tokens / self.duration
+
+    def as_dict(self) -> dict:
+        return asdict(self) | {
+            "requests_per_second": self.requests_per_second,
+            "output_tokens_per_second": self.output_tokens_per_second,
+        }
+
+
+def model_snapshot(model_info: OobaModelInfo) -> dict:
+    """
+    The parts of the model info that explain performance, to store with results
+    """
+    return {
+        "model_name": model_info.model_name,
+        "loader": model_info.shared_args.get("loader"),
+        "n_ctx": model_info.shared_args.get("n_ctx"),
+        "shared_args": model_info.shared_args,
+    }
+
+
+def load_prompts(path: Path) -> list[Prompt]:
+    """
+    Read a prompt corpus, one prompt per line
+
+    Lines are either plain text, or JSON objects with "prompt" and optionally
+    "negative_prompt". Blank lines are skipped.
+    """
+    prompts: list[Prompt] = []
+    for line in path.read_text().splitlines():
+        if not line.strip():
+            continue
+        if line.lstrip().startswith("{"):
+            prompts.append(InstructPrompt(**json.loads(line)))
+        else:
+            prompts.append(InstructPrompt(prompt=line))
+    if not prompts:
+        raise ValueError(f"No prompts in {path}")
+    return prompts
+
+
+def parameter_grid(specs: list[str]) -> list[dict]:
+    """
+    Every combination of the given parameter values
+
+    :param specs: "name=value1,value2" strings. Values are parsed as JSON where
+        possible, otherwise kept as strings
+    """
+    names: list[str] = []
+    choices: list[list] = []
+    for spec in specs:
+        name, sep, values = spec.partition("=")
+        if not sep or not values:
+            raise ValueError(f"Expected name=value1,value2, got {spec!r}")
+        # pydantic ignores unknown fields, so catch typos here
+        if name.strip() not in _dump(DEFAULT_PARAMETERS):
+            raise ValueError(f"Unknown parameter {name.strip()!r}")
+        names.append(name.strip())
+        choices.append([parse_value(value) for value in values.split(",")])
+    return [dict(zip(names, combination)) for combination in itertools.product(*choices)]
+
+
+def run_load(
+    client: OobaApiClient,
+    prompts: list[Prompt],
+    parameters: dict,
+    concurrency: int,
+    duration: float,
+    stream: bool = False,
+) -> RunResult:
+    """
+    Send requests from concurrency threads until duration seconds have passed
+
+    Requests in flight when time runs out are allowed to finish.
+
+    :param client: Client for the target server. Its own concurrency limit should be at
+        least concurrency
+    :param prompts: Prompts to send, in rotation
+    :param parameters: Parameters that differ from the defaults
+    :param concurrency: Concurrent workers
+    :param duration: Seconds to keep sending requests
+    :param stream: Use the streaming API, which also measures time to first token
+    """
+    generation_parameters = Parameters(**parameters)
+    prompt_cycle = itertools.cycle(prompts)
+    lock = threading.Lock()
+    latencies: list[float] = []
+    first_token_times: list[float] = []
+    # output texts without a token count from the server, counted after the run
+    uncounted: list[str] = []
+    sample_errors: list[str] = []
+    errors = 0
+    output_tokens = 0
+    deadline = time.perf_counter() + duration
+
+    def work() -> None:
+        nonlocal errors, output_tokens
+        while time.perf_counter() < deadline:
+            with lock:
+                prompt = next(prompt_cycle)
+            try:
+                if stream:
+                    chunks = list(client.instruct_stream(prompt, generation_parameters))
+                    text = "".join(chunk.text for chunk in chunks)
+                    tokens = None
+                    first_token = chunks[0].elapsed if chunks else None
+                    latency = chunks[-1].elapsed if chunks else 0.0
+                else:
+                    result = client.instruct_result(prompt, generation_parameters)
+                    text = result.text
+                    tokens = result.output_tokens
+                    first_token = None
+                    latency = result.timings.total - result.timings.queue_wait
+            except Exception as exc:
+                with lock:
+                    errors += 1
+                    if len(sample_errors) < 5:
+                        sample_errors.append(repr(exc))
+                continue
+            with lock:
+                latencies.append(latency)
+                if first_token is not None:
+                    first_token_times.append(first_token)
+                if tokens is not None:
+                    output_tokens += tokens
+                else:
+                    uncounted.append(text)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=work, daemon=True) for _ in range(concurrency)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    # the legacy API does not report output tokens, ask the server to count them
+    counted_tokens: int | None = output_tokens
+    try:
+        for text in uncounted:
+            counted_tokens = (counted_tokens or 0) + (client.count_tokens(text) if text else 0)
+    except requests.RequestException:
+        counted_tokens = None
+
+    return RunResult(
+        concurrency=concurrency,
+        parameters=parameters,
+        requests=len(latencies),
+        errors=errors,
+        duration=elapsed,
+        output_tokens=counted_tokens,
+        latency=summarize(latencies) if latencies else None,
+        time_to_first_token=summarize(first_token_times) if first_token_times else None,
+        sample_errors=sample_errors,
+    )
+
+
+def format_table(runs: list[RunResult]) -> str:
+    """
+    Results as a plain text table, latencies in milliseconds
+    """
+    headers = ["conc", "parameters", "req/s", "tok/s", "p50", "p95", "p99", "ttft p50", "errors"]
+    rows = [headers]
+    for run in runs:
+        latency = run.latency
+        ttft = run.time_to_first_token
+        rows.append(
+            [
+                str(run.concurrency),
+                " ".join(f"{name}={value}" for name, value in run.parameters.items()) or "-",
+                f"{run.requests_per_second:.2f}",
+                (
+                    f"{run.output_tokens_per_second:.1f}"
+                    if run.output_tokens_per_second is not None
+                    else "-"
+                ),
+                f"{latency.p50 * 1000:.0f}" if latency else "-",
+                f"{latency.p95 * 1000:.0f}" if latency else "-",
+                f"{latency.p99 * 1000:.0f}" if latency else "-",
+                f"{ttft.p50 * 1000:.0f}" if ttft else "-",
+                str(run.errors),
+            ]
+        )
+    widths = [max(len(row[column]) for row in rows) for column in range(len(headers))]
+    return "\n".join(
+        "  ".join(cell.rjust(width) for cell, width in zip(row, widths)) for row in rows
+    )
+
+
+DEFAULT_PROMPTS = [
+    "Write a haiku about the ocean.",
+    "Explain what a hash table is in two sentences.",
+    "Generate a Python function that reverses a string.",
+    "List three uses for a paperclip.",
+]
+
+
+def main(argv: list[str] | None = None) -> None:
+    """
+    ooba-bench, drives a server with load and reports throughput and latency
+    """
+    parser = argparse.ArgumentParser(
+        prog="ooba-bench",
+        description="Drive a text generation web UI server and report throughput and latency",
+    )
+    parser.add_argument("--url", default="http://localhost:5000", help="Base URL of the server")
+    parser.add_argument("--stream-url", help="Base URL of the streaming API")
+    parser.add_argument(
+        "--prompts", type=Path, help="Prompt corpus, one prompt or JSON object per line"
+    )
+    parser.add_argument(
+        "--concurrency",
+        default="1",
+        help="Comma separated concurrency levels to run, for example 1,4,16",
+    )
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per run")
+    parser.add_argument(
+        "--param",
+        action="append",
+        default=[],
+        metavar="NAME=V1,V2",
+        help="Parameter values to try, repeatable. Every combination is run",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Use the streaming API, measures time to first token",
+    )
+    parser.add_argument("--json", type=Path, help="Also write the results as JSON, - for stdout")
+    args = parser.parse_args(argv)
+
+    prompts: list[Prompt] = [InstructPrompt(prompt=prompt) for prompt in DEFAULT_PROMPTS]
+    if args.prompts:
+        prompts = load_prompts(args.prompts)
+    try:
+        levels = [int(level) for level in args.concurrency.split(",")]
+        grid = parameter_grid(args.param)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    # concurrency is set by the number of workers, so the client itself is unlimited
+    with OobaApiClient(
+        args.url,
+        one_at_a_time=False,
+        stream_url=args.stream_url,
+        transport=RequestsTransport(pool_maxsize=max(levels)),
+    ) as client:
+        model = model_snapshot(client.model_info())
+        runs = [
+            run_load(client, prompts, parameters, concurrency, args.duration, args.stream)
+            for parameters in grid
+            for concurrency in levels
+        ]
+
+    results = {
+        "url": args.url,
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "model": model,
+        "settings": {
+            "duration": args.duration,
+            "stream": args.stream,
+            "prompts": len(prompts),
+        },
+        "runs": [run.as_dict() for run in runs],
+    }
+
+    if args.json == Path("-"):
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{model['model_name']} (loader: {model['loader']}, n_ctx: {model['n_ctx']})")
+    print(format_table(runs))
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2) + "\n")
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Protocol, runtime_checkable
+
+
+def cache_key(body: bytes, model_name: str | None) -> str:
+    """
+    Stable hash of a generate request and the model that would serve it
+
+    The body is hashed in a canonical form, with sorted keys, so the key does not
+    depend on field order or on the codec that encoded it.
+
+    :param body: Encoded body of the generate request, the rendered prompt plus parameters
+    :param model_name: Name of the loaded model
+    """
+    payload = json.dumps(
+        {"model_name": model_name, "request": json.loads(body)},
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+@runtime_checkable
+class ResponseCache(Protocol):
+    """
+    Stores generated text by cache key. Implementations must be thread-safe
+    """
+
+    def get(self, key: str) -> str | None:
+        ...
+
+    def set(self, key: str, value: str) -> None:
+        ...
+
+
+class LRUResponseCache:
+    """
+    In-memory cache, evicting the least recently used entries
+    """
+
+    # max number of entries
+    maxsize: int
+
+    # seconds an entry lives. None means forever
+    ttl: float | None
+
+    def __init__(self, maxsize: int = 1024, ttl: float | None = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (expires at, value)
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class SQLiteResponseCache:
+    """
+    Cache persisted to a SQLite database, so responses survive restarts
+    """
+
+    # seconds an entry lives. None means forever
+    ttl: float | None
+
+    def __init__(self, path: str | Path, ttl: float | None = None) -> None:
+        self.ttl = ttl
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        value, created_at = row
+        # wall clock, since entries outlive the process
+        if self.ttl is not None and created_at + self.ttl < time.time():
+            with self._lock, self._connection:
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            return None
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at) VALUES (?, ?, ?)",
+                (key, value, time.time()),
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
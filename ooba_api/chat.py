@@ -0,0 +1,202 @@
+from collections import deque
+from typing import Iterable
+
+from ooba_api.async_clients import AsyncOobaApiClient
+from ooba_api.clients import OobaApiClient, _chat_body, _history_json
+from ooba_api.codecs import JsonCodec
+from ooba_api.parameters import DEFAULT_PARAMETERS, Parameters
+from ooba_api.prompts import _chat_settings
+from ooba_api.tokens import PromptTooLong
+
+
+class ChatHistory:
+    """
+    Turns of a conversation, each encoded once, with a running token count
+
+    Appending a turn and dropping the oldest are both O(1), so a request body is built
+    by joining the encoded turns rather than encoding the whole history again.
+    """
+
+    # tokens in the turns held, as counted by the server
+    tokens: int
+
+    def __init__(self, codec: JsonCodec) -> None:
+        self.codec = codec
+        self.tokens = 0
+        # (user message, reply, encoded [user message, reply], tokens), oldest first
+        self._turns: deque[tuple[str, str, bytes, int]] = deque()
+
+    def __len__(self) -> int:
+        return len(self._turns)
+
+    @property
+    def turns(self) -> list[tuple[str, str]]:
+        return [(user_input, reply) for user_input, reply, _, _ in self._turns]
+
+    def append(self, user_input: str, reply: str, tokens: int) -> None:
+        self._turns.append((user_input, reply, self.codec.dumps([user_input, reply]), tokens))
+        self.tokens += tokens
+
+    def drop_oldest(self) -> tuple[str, str]:
+        user_input, reply, _, tokens = self._turns.popleft()
+        self.tokens -= tokens
+        return user_input, reply
+
+    def encoded(self) -> bytes:
+        return _history_json(encoded for _, _, encoded, _ in self._turns)
+
+
+class _ConversationBase:
+    # generation parameters, truncation_length and max_new_tokens set the token budget
+    parameters: Parameters
+
+    # turns sent with each message, oldest first
+    history: ChatHistory
+
+    # turns dropped to stay within the token budget, over the whole session
+    dropped_turns: int
+
+    def __init__(
+        self,
+        codec: JsonCodec,
+        parameters: Parameters,
+        mode: str,
+        character: str | None,
+        instruction_template: str | None,
+        your_name: str,
+    ) -> None:
+        self.parameters = parameters
+        self.history = ChatHistory(codec)
+        self.dropped_turns = 0
+        self._settings = _chat_settings(mode, character, instruction_template, your_name)
+
+    def _fit(self, user_tokens: int) -> None:
+        # leave room for the new message and the reply, dropping the oldest turns
+        budget = self.parameters.truncation_length - self.parameters.max_new_tokens - user_tokens
+        if budget < 0:
+            # the server would cut the message itself
+            raise PromptTooLong(
+                user_tokens, self.parameters.truncation_length, self.parameters.max_new_tokens
+            )
+        while self.history and self.history.tokens > budget:
+            self.history.drop_oldest()
+            self.dropped_turns += 1
+
+    def _body(self, user_input: str) -> bytes:
+        return _chat_body(
+            user_input,
+            self.history.encoded(),
+            self._settings,
+            self.parameters,
+            self.history.codec,
+        )
+
+
+class Conversation(_ConversationBase):
+    """
+    A chat session that keeps its history between messages
+
+    Each turn is encoded and its tokens counted once, when it is added. Before each
+    message, the oldest turns are dropped until the history, the message and
+    max_new_tokens fit within truncation_length, so long sessions neither grow the
+    server's context nor cost more client CPU per message. Template overhead is not
+    counted, so leave some headroom in truncation_length.
+    """
+
+    def __init__(
+        self,
+        client: OobaApiClient,
+        parameters: Parameters = DEFAULT_PARAMETERS,
+        *,
+        mode: str = "chat",
+        character: str | None = None,
+        instruction_template: str | None = None,
+        your_name: str = "You",
+    ) -> None:
+        """
+        :param client: Client to chat through
+        :param parameters: Generation parameters, for every message
+        :param mode: "chat", "chat-instruct" or "instruct"
+        :param character: Character to talk to. None uses the server's default
+        :param instruction_template: Template for the instruct modes. None uses the
+            server's default
+        :param your_name: Name of the user in the rendered history
+        """
+        super().__init__(
+            client.codec, parameters, mode, character, instruction_template, your_name
+        )
+        self.client = client
+
+    def extend(self, turns: Iterable[tuple[str, str]]) -> None:
+        """
+        Add earlier turns, for example to resume a saved session
+
+        :param turns: (user message, reply) pairs, oldest first
+        """
+        for user_input, reply in turns:
+            tokens = self.client.count_tokens(user_input) + self.client.count_tokens(reply)
+            self.history.append(user_input, reply, tokens)
+
+    def say(self, user_input: str, timeout: int | float = 500) -> str:
+        """
+        Send a message, get the reply, and add both to the history
+
+        :param user_input: Message from the user
+        :param timeout: When to timeout
+        :raises PromptTooLong: The message alone leaves no room for max_new_tokens
+        """
+        user_tokens = self.client.count_tokens(user_input)
+        self._fit(user_tokens)
+        reply = self.client.chat_encoded(self._body(user_input), timeout)
+        self.history.append(user_input, reply, user_tokens + self.client.count_tokens(reply))
+        return reply
+
+
+class AsyncConversation(_ConversationBase):
+    """
+    Same as Conversation, for the async client
+    """
+
+    def __init__(
+        self,
+        client: AsyncOobaApiClient,
+        parameters: Parameters = DEFAULT_PARAMETERS,
+        *,
+        mode: str = "chat",
+        character: str | None = None,
+        instruction_template: str | None = None,
+        your_name: str = "You",
+    ) -> None:
+        """
+        See Conversation
+        """
+        super().__init__(
+            client.codec, parameters, mode, character, instruction_template, your_name
+        )
+        self.client = client
+
+    async def extend(self, turns: Iterable[tuple[str, str]]) -> None:
+        """
+        Add earlier turns, for example to resume a saved session
+
+        :param turns: (user message, reply) pairs, oldest first
+        """
+        for user_input, reply in turns:
+            tokens = await self.client.count_tokens(user_input)
+            tokens += await self.client.count_tokens(reply)
+            self.history.append(user_input, reply, tokens)
+
+    async def say(self, user_input: str, timeout: int | float = 500) -> str:
+        """
+        Send a message, get the reply, and add both to the history
+
+        :param user_input: Message from the user
+        :param timeout: When to timeout
+        :raises PromptTooLong: The message alone leaves no room for max_new_tokens
+        """
+        user_tokens = await self.client.count_tokens(user_input)
+        self._fit(user_tokens)
+        reply = await self.client.chat_encoded(self._body(user_input), timeout)
+        reply_tokens = await self.client.count_tokens(reply)
+        self.history.append(user_input, reply, user_tokens + reply_tokens)
+        return reply
@@ -1,18 +1,182 @@
+import contextlib
+import functools
 import json
 import logging
-from multiprocessing import Lock
+import threading
+import time
+from typing import Callable, Generator, Iterable, Iterator, Mapping, Sequence
+from urllib.parse import urlsplit
 
 import requests
 
+from ooba_api.batch import BatchResult, run_as_completed
+from ooba_api.cache import ResponseCache, cache_key
+from ooba_api.coalesce import SingleFlight
+from ooba_api.codecs import JsonCodec, default_codec
+from ooba_api.fanout import (
+    NoValidSample,
+    Sample,
+    accept,
+    best_sample,
+    run_fan_out,
+    sample_parameters,
+)
+from ooba_api.limits import (
+    DEFAULT_LANES,
+    DEFAULT_PRIORITY,
+    AdaptiveLimit,
+    ConcurrencyLimiter,
+    ConcurrencyLimitTimeout,
+    Lane,
+    LaneStats,
+    shared_limiter,
+)
 from ooba_api.model_info import OobaModelInfo, OobaModelNotLoaded
-from ooba_api.parameters import DEFAULT_PARAMETERS, Parameters
-from ooba_api.prompts import Prompt
+from ooba_api.parameters import DEFAULT_PARAMETERS, FrozenParameters, Parameters, _dump
+from ooba_api.prompts import ChatPrompt, Prompt
+from ooba_api.results import InstructResult, RequestTimings
+from ooba_api.retry import Deadline, RetryPolicy
+from ooba_api.stopping import StopPredicate, StopResult, find_stop
+from ooba_api.streaming import StreamChunk, stream_generate
+from ooba_api.tokens import TokenCountCache, fit_parameters, max_new_tokens_for
+from ooba_api.transport import RequestsTransport, Transport
 
 logger = logging.getLogger("ooba_api")
 prompt_logger = logging.getLogger("ooba_api.prompt")
 
-# global lock
-_one_at_a_time_lock = Lock()
+
+# the webui serves the streaming API on a separate port
+DEFAULT_STREAM_PORT = 5005
+
+# rough characters per token of English text, to estimate output tokens when the server
+# does not report them
+CHARS_PER_TOKEN = 4
+
+
+def _default_stream_url(url: str) -> str:
+    parts = urlsplit(url)
+    scheme = "wss" if parts.scheme == "https" else "ws"
+    return f"{scheme}://{parts.hostname}:{DEFAULT_STREAM_PORT}"
+
+
+def _parameters_fragment(parameters: Parameters, codec: JsonCodec) -> bytes:
+    """
+    Encoded parameters without the opening brace, ready to append to a request body
+    """
+    if isinstance(parameters, FrozenParameters):
+        fragment = parameters._encoded.get(type(codec))
+        if fragment is None:
+            fragment = parameters._encoded[type(codec)] = codec.dumps(_dump(parameters))[1:]
+        return fragment
+    return codec.dumps(_dump(parameters))[1:]
+
+
+def _instruct_body(
+    prompt: Prompt, parameters: Parameters, print_prompt: bool, codec: JsonCodec
+) -> tuple[str, bytes]:
+    """
+    Build the body for a generate request
+
+    :return: The rendered prompt, and the encoded body
+    """
+    prompt_to_use = prompt.full_prompt()
+    if print_prompt:
+        print(prompt_to_use)
+    if prompt_logger.isEnabledFor(logging.INFO):
+        prompt_logger.info(prompt_to_use)
+
+    head = codec.dumps({"prompt": prompt_to_use, "negative_prompt": prompt.negative_prompt or ""})
+    # splice the two objects together, '{"prompt":...' + ',' + '"add_bos_token":...}'
+    return prompt_to_use, head[:-1] + b"," + _parameters_fragment(parameters, codec)
+
+
+def _history_json(rows: Iterable[bytes]) -> bytes:
+    """
+    Chat history for the request body, from [user, reply] rows that are already encoded
+    """
+    encoded_rows = b"[" + b",".join(rows) + b"]"
+    return b'{"internal":' + encoded_rows + b',"visible":' + encoded_rows + b"}"
+
+
+def _chat_body(
+    user_input: str,
+    history: bytes,
+    settings: dict,
+    parameters: Parameters,
+    codec: JsonCodec,
+) -> bytes:
+    """
+    Build the body for a chat request
+
+    :param user_input: New message from the user
+    :param history: Encoded history, see _history_json
+    :param settings: Chat mode, character and other chat settings
+    """
+    if prompt_logger.isEnabledFor(logging.INFO):
+        prompt_logger.info(user_input)
+    head = codec.dumps({"user_input": user_input, **settings})
+    # '{"user_input":...' + ',"history":{...},' + '"add_bos_token":...}'
+    return head[:-1] + b',"history":' + history + b"," + _parameters_fragment(parameters, codec)
+
+
+def _chat_reply(data: dict) -> str:
+    # the visible history is HTML escaped for the web UI, the internal one is not
+    return data["results"][0]["history"]["internal"][-1][1]
+
+
+def _is_cacheable(parameters: Parameters, cache_random_seed: bool) -> bool:
+    # a random seed means a different response every time, unless the caller says otherwise
+    return parameters.seed != -1 or cache_random_seed
+
+
+def _log_response(data: dict) -> None:
+    # only pay for the pretty printing if someone is listening
+    if __debug__ and logger.isEnabledFor(logging.DEBUG):
+        logger.debug(json.dumps(data, indent=2))
+
+
+def _instruct_text(data: dict) -> str:
+    return data["results"][0]["text"]
+
+
+def _output_tokens(data: dict) -> int | None:
+    # the OpenAI compatible API reports usage, the legacy API does not
+    return data.get("usage", {}).get("completion_tokens")
+
+
+def _service_time(result: InstructResult) -> float:
+    # seconds the server took per output token, so long and short generations compare.
+    # The legacy API does not report tokens, so they are estimated from the text length
+    timings = result.timings
+    seconds = timings.total - timings.queue_wait - timings.decode
+    tokens = result.output_tokens or -(-result.output_length // CHARS_PER_TOKEN)
+    return seconds / tokens if tokens else seconds
+
+
+def _within_deadline(delay: float, deadline: Deadline | None) -> bool:
+    # no point backing off if the deadline passes before the next attempt starts
+    return deadline is None or deadline.remaining() > delay
+
+
+def _token_count(data: dict) -> int:
+    return data["results"][0]["tokens"]
+
+
+def _model_info(result: dict) -> OobaModelInfo:
+    if result["model_name"] == "None":
+        return OobaModelNotLoaded(
+            shared_settings=result["shared.settings"], shared_args=result["shared.args"]
+        )
+    return _loaded_model_info(result)
+
+
+def _loaded_model_info(result: dict) -> OobaModelInfo:
+    return OobaModelInfo(
+        model_name=result["model_name"],
+        lora_names=result["lora_names"],
+        shared_settings=result["shared.settings"],
+        shared_args=result["shared.args"],
+    )
 
 
 class OobaApiClient:
@@ -20,6 +184,9 @@ class OobaApiClient:
     Client for the Ooba Booga text generation web UI
     """
 
+    # base URL of the server
+    url: str
+
     # full URL to chat endpoint
     _chat_url: str
 
@@ -29,12 +196,58 @@ class OobaApiClient:
     # full URL to model endpoint
     _model_url: str
 
+    # full URL to websocket stream endpoint
+    _stream_url: str
+
+    # full URL to stop generation endpoint
+    _stop_url: str
+
+    # full URL to token count endpoint
+    _token_count_url: str
+
     # API Key, not yet used
     api_key: str | None
 
     # Enforce one request at a time to avoid overwhelming the server
     one_at_a_time: bool
 
+    # limits generate requests in flight to the server, shared with other clients of the same URL
+    _generate_limiter: ConcurrencyLimiter
+
+    # limits model requests in flight to the server, shared with other clients of the same URL
+    _model_limiter: ConcurrencyLimiter
+
+    # max seconds to wait for a free request slot. None waits forever
+    acquire_timeout: float | None
+
+    # sends the HTTP requests, holds the pooled connections
+    transport: Transport
+
+    # stores responses to deterministic requests. None disables caching
+    cache: ResponseCache | None
+
+    # model info as last seen by this client, None if not fetched yet. Part of the cache key
+    _loaded_model: OobaModelInfo | None
+
+    # time.monotonic() when _loaded_model was fetched
+    _loaded_model_at: float
+
+    # shares one generate request between identical in-flight instructs. None disables it
+    _single_flight: SingleFlight | None
+
+    # encodes request bodies and decodes responses
+    codec: JsonCodec
+
+    # token counts by model and text
+    token_cache: TokenCountCache
+
+    # retries failed requests. None sends each request once
+    retry: RetryPolicy | None
+
+    # seconds cached_model_info() trusts the last model info for. None trusts it until
+    # it is invalidated
+    model_info_ttl: float | None
+
     def __init__(
         self,
         url: str | None = None,
@@ -43,7 +256,52 @@ class OobaApiClient:
         port: int = 5000,
         api_key: str | None = None,
         one_at_a_time: bool = True,
+        max_concurrency: int | None = None,
+        max_model_concurrency: int | None = 1,
+        acquire_timeout: float | None = None,
+        transport: Transport | None = None,
+        stream_url: str | None = None,
+        cache: ResponseCache | None = None,
+        coalesce: bool = False,
+        codec: JsonCodec | None = None,
+        token_cache: TokenCountCache | None = None,
+        retry: RetryPolicy | None = None,
+        model_info_ttl: float | None = None,
+        lanes: Mapping[str, Lane] = DEFAULT_LANES,
+        adaptive: AdaptiveLimit | None = None,
     ):
+        """
+        :param url: Base URL of the server. Overrides host and port
+        :param host: Host of the server, including the scheme
+        :param port: Port of the server API
+        :param api_key: API key, not yet used
+        :param one_at_a_time: Enforce one generate request at a time. Ignored if
+            max_concurrency is given
+        :param max_concurrency: Max generate requests in flight to this server, across all
+            clients using the same URL. None means unlimited. Set here, or with
+            one_at_a_time=False, it replaces the limit earlier clients of the URL set.
+            Otherwise the client shares the existing limit
+        :param max_model_concurrency: Max model requests in flight to this server, across all
+            clients using the same URL. None means unlimited. Replaces the existing limit
+            like max_concurrency, unless it is the default
+        :param acquire_timeout: Max seconds to wait for a free request slot. None waits forever
+        :param transport: Transport to send requests with. Defaults to a pooled
+            RequestsTransport owned, and closed, by this client
+        :param stream_url: Base URL of the streaming API. Defaults to the same host on port 5005
+        :param cache: Cache for instruct responses. Only requests with a fixed seed are cached
+        :param coalesce: Identical instructs in flight at the same time share one request.
+            Only requests with a fixed seed are coalesced
+        :param codec: JSON codec. Defaults to orjson if it is installed, otherwise json
+        :param token_cache: Cache for token counts. Defaults to a new in-memory cache
+        :param retry: Retry policy for failed requests. None sends each request once
+        :param model_info_ttl: Seconds cached_model_info() trusts the last model info for.
+            None trusts it until a model is loaded or a generation fails
+        :param lanes: Priority lanes generate requests wait in for a slot, by name. Shared
+            with other clients of the same URL, the first client sets them
+        :param adaptive: Find the generate concurrency the server handles well from
+            observed latency, 5xx responses and timeouts. Overrides max_concurrency and
+            one_at_a_time. Shared and replaced like max_concurrency
+        """
         if url:
             self.url = url
         else:
@@ -51,15 +309,154 @@ class OobaApiClient:
         self._chat_url = f"{self.url}/api/v1/chat"
         self._generate_url = f"{self.url}/api/v1/generate"
         self._model_url = f"{self.url}/api/v1/model"
+        self._stream_url = f"{stream_url or _default_stream_url(self.url)}/api/v1/stream"
+        self._stop_url = f"{self.url}/api/v1/stop-stream"
+        self._token_count_url = f"{self.url}/api/v1/token-count"
         self.api_key = api_key
         self.one_at_a_time = one_at_a_time
+        # a limit left to the defaults shares whatever limit the URL already has
+        explicit_limit = max_concurrency is not None or not one_at_a_time or adaptive is not None
+        if max_concurrency is None and one_at_a_time:
+            max_concurrency = 1
+        self._generate_limiter = shared_limiter(
+            self.url, "generate", max_concurrency, lanes, adaptive, override=explicit_limit
+        )
+        self._model_limiter = shared_limiter(
+            self.url, "model", max_model_concurrency, override=max_model_concurrency != 1
+        )
+        self.acquire_timeout = acquire_timeout
+        self._owns_transport = transport is None
+        self.transport = transport or RequestsTransport()
+        self.cache = cache
+        self._loaded_model = None
+        self._loaded_model_at = 0.0
+        self._single_flight = SingleFlight() if coalesce else None
+        self.codec = codec or default_codec()
+        self.token_cache = token_cache if token_cache is not None else TokenCountCache()
+        self.retry = retry
+        self.model_info_ttl = model_info_ttl
+        self._refresh_stop = threading.Event()
+        self._refresh_thread: threading.Thread | None = None
 
         if self.api_key:
             logger.warning("API keys are not yet supported")
 
-    def _post(self, target_url: str, timeout: float, data: dict) -> requests.Response:
-        with _one_at_a_time_lock:
-            return requests.post(target_url, timeout=timeout, json=data)
+    def __enter__(self) -> "OobaApiClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Stop refreshing the model info and close the transport's pooled connections, if
+        this client created the transport
+        """
+        self.stop_model_info_refresh()
+        if self._owns_transport:
+            self.transport.close()
+
+    @property
+    def concurrency_limit(self) -> int | None:
+        """
+        Max generate requests in flight, the current one with an adaptive limit
+        """
+        return self._generate_limiter.limit
+
+    def lane_stats(self) -> dict[str, LaneStats]:
+        """
+        Queue depth, admissions, rejections and queue wait of each priority lane, for
+        generate requests to this server
+        """
+        return self._generate_limiter.lane_stats()
+
+    def _limiter_for(self, target_url: str) -> ConcurrencyLimiter:
+        # token counts and stops are quick, keep them from queueing behind generations
+        if target_url in (self._model_url, self._token_count_url, self._stop_url):
+            return self._model_limiter
+        return self._generate_limiter
+
+    def _post(
+        self,
+        target_url: str,
+        timeout: float,
+        data: dict | bytes,
+        timings: RequestTimings | None = None,
+        *,
+        deadline: Deadline | None = None,
+        idempotent: bool = True,
+        priority: str = DEFAULT_PRIORITY,
+        transport: Transport | None = None,
+    ) -> requests.Response:
+        content = data if isinstance(data, bytes) else self.codec.dumps(data)
+        if self.retry is None:
+            return self._post_once(
+                target_url, timeout, content, timings, deadline, priority, transport
+            )
+
+        attempt = 1
+        while True:
+            try:
+                response = self._post_once(
+                    target_url, timeout, content, timings, deadline, priority, transport
+                )
+            except Exception as exc:
+                delay = self.retry.retry_delay(attempt, error=exc, idempotent=idempotent)
+                if delay is None or not _within_deadline(delay, deadline):
+                    raise
+                reason = repr(exc)
+            else:
+                delay = self.retry.retry_delay(
+                    attempt, status=response.status_code, idempotent=idempotent
+                )
+                if delay is None or not _within_deadline(delay, deadline):
+                    return response
+                reason = f"status {response.status_code}"
+                response.close()
+            logger.info(
+                f"Retrying {target_url} in {delay:.2f}s after attempt {attempt}: {reason}"
+            )
+            time.sleep(delay)
+            attempt += 1
+
+    def _post_once(
+        self,
+        target_url: str,
+        timeout: float,
+        content: bytes,
+        timings: RequestTimings | None,
+        deadline: Deadline | None,
+        priority: str = DEFAULT_PRIORITY,
+        transport: Transport | None = None,
+    ) -> requests.Response:
+        acquire_timeout = self.acquire_timeout
+        if deadline is not None:
+            acquire_timeout = deadline.cap(acquire_timeout)
+        limiter = self._limiter_for(target_url)
+        start = time.perf_counter()
+        try:
+            with limiter.slot(acquire_timeout, priority):
+                if timings is not None:
+                    timings.queue_wait += time.perf_counter() - start
+                if deadline is not None:
+                    timeout = deadline.cap(timeout)
+                try:
+                    response = (transport or self.transport).post(
+                        target_url, timeout=timeout, content=content, timings=timings
+                    )
+                except requests.Timeout:
+                    # a timeout the deadline caused says nothing about the server
+                    if deadline is None or not deadline.expired:
+                        limiter.record_overload()
+                    raise
+                if limiter.adaptive is not None and response.status_code >= 500:
+                    limiter.record_overload()
+                return response
+        except (requests.Timeout, ConcurrencyLimitTimeout) as exc:
+            # the deadline shortened the wait, report it as the cause
+            if deadline is not None and deadline.expired:
+                raise deadline.exceeded() from exc
+            raise
 
     def instruct(
         self,
@@ -67,6 +464,9 @@ class OobaApiClient:
         parameters: Parameters = DEFAULT_PARAMETERS,
         timeout: int | float = 500,
         print_prompt: bool = False,
+        cache_random_seed: bool = False,
+        deadline: float | None = None,
+        priority: str = DEFAULT_PRIORITY,
     ) -> str:
         """
         Provide an instruction, get a response
@@ -75,61 +475,615 @@ class OobaApiClient:
         :param max_tokens: Maximum tokens to generate
         :param timeout: When to timeout
         :param print_prompt: Print the prompt being used. Use case is debugging
+        :param cache_random_seed: Use the cache and coalescing even though the seed is
+            random (-1)
+        :param deadline: Max seconds for the whole call, including waiting for a slot,
+            retries and backoff. None means no limit beyond timeout per attempt
+        :param priority: Lane to wait for a request slot in, such as "interactive" or
+            "batch"
+        :raises DeadlineExceeded: The deadline passed before a response arrived
+        :raises QueueFull: The lane already has its max_queue requests waiting
         """
-        prompt_to_use = prompt.full_prompt()
-        if print_prompt:
-            print(prompt_to_use)
-        prompt_logger.info(prompt_to_use)
+        budget = Deadline.after(deadline)
+        prompt_to_use, body = _instruct_body(prompt, parameters, print_prompt, self.codec)
+        if not _is_cacheable(parameters, cache_random_seed) or (
+            self.cache is None and self._single_flight is None
+        ):
+            return self._generate(body, timeout, len(prompt_to_use), budget, priority).text
 
-        # pydantic compatibility. dict -> model_dump
-        if hasattr(parameters, "model_dump"):
-            param_dict = parameters.model_dump()
+        key = cache_key(body, self._model_name())
+        if self.cache is not None and (cached := self.cache.get(key)) is not None:
+            return cached
+        if self._single_flight is not None:
+            text = self._single_flight.do(
+                key,
+                lambda: self._generate(body, timeout, len(prompt_to_use), budget, priority).text,
+                budget,
+            )
         else:
-            param_dict = parameters.dict()
+            text = self._generate(body, timeout, len(prompt_to_use), budget, priority).text
+        if self.cache is not None:
+            self.cache.set(key, text)
+        return text
+
+    def instruct_result(
+        self,
+        prompt: Prompt,
+        parameters: Parameters = DEFAULT_PARAMETERS,
+        timeout: int | float = 500,
+        print_prompt: bool = False,
+        deadline: float | None = None,
+        priority: str = DEFAULT_PRIORITY,
+    ) -> InstructResult:
+        """
+        Same as instruct, but returns the text along with where the time went
+
+        Always sends a request, the cache and coalescing are not used.
+
+        :param prompt: Prompt to provide an instruction
+        :param parameters: Generation parameters
+        :param timeout: When to timeout
+        :param print_prompt: Print the prompt being used. Use case is debugging
+        :param deadline: Max seconds for the whole call, see instruct
+        :param priority: Lane to wait for a request slot in, see instruct
+        """
+        prompt_to_use, body = _instruct_body(prompt, parameters, print_prompt, self.codec)
+        return self._generate(
+            body, timeout, len(prompt_to_use), Deadline.after(deadline), priority
+        )
 
+    def encode_instruct(
+        self, prompt: Prompt, parameters: Parameters = DEFAULT_PARAMETERS
+    ) -> bytes:
+        """
+        Encode the body of an instruct request, for use with instruct_encoded
+
+        :param prompt: Prompt to provide an instruction
+        :param parameters: Generation parameters
+        """
+        return _instruct_body(prompt, parameters, False, self.codec)[1]
+
+    def instruct_encoded(
+        self,
+        body: bytes,
+        timeout: int | float = 500,
+        deadline: float | None = None,
+        priority: str = DEFAULT_PRIORITY,
+    ) -> str:
+        """
+        Send an already encoded instruct request, get a response
+
+        The cache and coalescing are not used.
+
+        :param body: JSON body of a generate request, see encode_instruct
+        :param timeout: When to timeout
+        :param deadline: Max seconds for the whole call, see instruct
+        :param priority: Lane to wait for a request slot in, see instruct
+        """
+        return self._generate(
+            body, timeout, deadline=Deadline.after(deadline), priority=priority
+        ).text
+
+    def _generate(
+        self,
+        body: bytes,
+        timeout: int | float,
+        prompt_length: int | None = None,
+        deadline: Deadline | None = None,
+        priority: str = DEFAULT_PRIORITY,
+        transport: Transport | None = None,
+    ) -> InstructResult:
+        timings = RequestTimings()
+        start = time.perf_counter()
         response = self._post(
             self._generate_url,
             timeout=timeout,
-            data=(
-                {"prompt": prompt_to_use, "negative_prompt": prompt.negative_prompt or ""}
-                | param_dict
-            ),
+            data=body,
+            timings=timings,
+            deadline=deadline,
+            priority=priority,
+            transport=transport,
         )
-        response.raise_for_status()
-        data = response.json()
-        if __debug__:
-            logger.debug(json.dumps(data, indent=2))
+        self._raise_for_status(response)
+        decode_start = time.perf_counter()
+        data = self.codec.loads(response.content)
+        timings.decode = time.perf_counter() - decode_start
+        timings.total = time.perf_counter() - start
+        _log_response(data)
 
-        return data["results"][0]["text"]
+        result = InstructResult(
+            text=_instruct_text(data),
+            url=self.url,
+            prompt_length=prompt_length,
+            output_tokens=_output_tokens(data),
+            timings=timings,
+        )
+        self._generate_limiter.record_latency(_service_time(result))
+        return result
 
-    def _model_api(self, request: dict, timeout: int | float = 500) -> dict:
-        response = self._post(self._model_url, timeout, request)
-        response.raise_for_status()
-        data = response.json()
-        if __debug__:
-            logger.debug(json.dumps(data, indent=2))
+    def instruct_many(
+        self,
+        prompts: Iterable[Prompt],
+        parameters: Parameters = DEFAULT_PARAMETERS,
+        timeout: int | float = 500,
+        max_concurrency: int = 4,
+        priority: str = "batch",
+    ) -> list[BatchResult]:
+        """
+        Run many independent instructions in parallel
 
-        return data["result"]
+        Requests still respect the client's max_concurrency, so raise that as well to
+        actually send requests in parallel.
 
-    def model_info(self) -> OobaModelInfo:
-        result = self._model_api({"action": "info"}, timeout=5)
-        model_name = result["model_name"]
-        if model_name == "None":
-            return OobaModelNotLoaded(
-                shared_settings=result["shared.settings"], shared_args=result["shared.args"]
+        :param prompts: Prompts to provide instructions
+        :param parameters: Generation parameters, used for every prompt
+        :param timeout: When to timeout, per request
+        :param max_concurrency: Max requests in flight from this call
+        :param priority: Lane to wait for request slots in, see instruct. Batches yield to
+            interactive requests by default
+        :return: One result per prompt, in input order. Failed requests carry the error
+        """
+        results = list(
+            self.instruct_many_as_completed(
+                prompts, parameters, timeout, max_concurrency, priority
             )
-        return OobaModelInfo(
-            model_name=result["model_name"],
-            lora_names=result["lora_names"],
-            shared_settings=result["shared.settings"],
-            shared_args=result["shared.args"],
         )
+        results.sort(key=lambda result: result.index)
+        return results
+
+    def instruct_many_as_completed(
+        self,
+        prompts: Iterable[Prompt],
+        parameters: Parameters = DEFAULT_PARAMETERS,
+        timeout: int | float = 500,
+        max_concurrency: int = 4,
+        priority: str = "batch",
+    ) -> Iterator[BatchResult]:
+        """
+        Same as instruct_many, but results are yielded as they finish
 
-    def load_model(self, model_name: str, *, args_dict: dict) -> OobaModelInfo:
-        result = self._model_api({"action": "load", "model_name": model_name, "args": args_dict}, timeout=5000)
-        return OobaModelInfo(
-            model_name=result["model_name"],
-            lora_names=result["lora_names"],
-            shared_settings=result["shared.settings"],
-            shared_args=result["shared.args"],
+        :yield: One result per prompt, in completion order. Failed requests carry the error
+        """
+        instruct = functools.partial(
+            self.instruct, parameters=parameters, timeout=timeout, priority=priority
         )
+        yield from run_as_completed(instruct, prompts, max_concurrency)
+
+    def instruct_samples(
+        self,
+        prompt: Prompt,
+        parameters: Parameters | Sequence[Parameters] = DEFAULT_PARAMETERS,
+        n: int = 4,
+        timeout: int | float = 500,
+        priority: str = DEFAULT_PRIORITY,
+    ) -> list[Sample]:
+        """
+        Send one prompt with several parameter sets at once, get every sample
+
+        Every sample is sent, the cache and coalescing are not used. Requests in flight
+        are bounded by the client's concurrency limit, so with the default of one at a
+        time the samples are generated one after another. Every
+        request runs to the end, use instruct_first_valid to stop once one is good enough.
+
+        :param prompt: Prompt to provide an instruction
+        :param parameters: Parameter sets to send, one request each. A single parameter
+            set is sent n times with consecutive seeds, starting at its seed, or a random
+            one if its seed is -1
+        :param n: Samples to generate from a single parameter set
+        :param timeout: When to timeout, per request
+        :param priority: Lane to wait for a request slot in, see instruct
+        :return: One sample per parameter set, in order. Failed requests carry the error
+        """
+        parameter_sets = sample_parameters(parameters, n)
+        samples = list(
+            run_fan_out(
+                self._sampler(prompt, timeout, priority),
+                parameter_sets,
+                self._fan_out_concurrency(len(parameter_sets)),
+            )
+        )
+        return sorted(samples, key=lambda sample: sample.index)
+
+    def instruct_best_of(
+        self,
+        prompt: Prompt,
+        score: Callable[[str], float],
+        parameters: Parameters | Sequence[Parameters] = DEFAULT_PARAMETERS,
+        n: int = 4,
+        timeout: int | float = 500,
+        priority: str = DEFAULT_PRIORITY,
+    ) -> Sample:
+        """
+        Generate every sample, see instruct_samples, and return the highest scoring one
+
+        :param score: Scores a generated text, higher is better. Texts it raises for are
+            skipped
+        :raises NoValidSample: Every request failed or could not be scored
+        """
+        return best_sample(self.instruct_samples(prompt, parameters, n, timeout, priority), score)
+
+    def instruct_first_valid(
+        self,
+        prompt: Prompt,
+        validator: Callable[[str], bool],
+        parameters: Parameters | Sequence[Parameters] = DEFAULT_PARAMETERS,
+        n: int = 4,
+        timeout: int | float = 500,
+        priority: str = DEFAULT_PRIORITY,
+        stop_server: bool = False,
+    ) -> Sample:
+        """
+        Send samples at once, see instruct_samples, and return the first to pass validator
+
+        Once a sample passes, requests not yet sent are dropped and those in flight are
+        aborted, freeing their slots of the client's concurrency limit. The samples use
+        connections of their own for this, unless the client has a custom transport, in
+        which case the requests in flight run to the end. The server does not notice an
+        aborted request and finishes generating it, unless stop_server is set.
+
+        :param validator: Whether a generated text is acceptable, for example whether it
+            parses. Texts it raises for are rejected
+        :param stop_server: Also call the stop endpoint when a sample passes, so the
+            server stops generating the rest. The web UI stops every generation in
+            progress, so only use this if the server is not shared
+        :raises NoValidSample: Every request failed or was rejected
+        """
+        parameter_sets = sample_parameters(parameters, n)
+        finished: list[Sample] = []
+        transport = self._fan_out_transport(len(parameter_sets))
+        samples = run_fan_out(
+            self._sampler(prompt, timeout, priority, transport),
+            parameter_sets,
+            self._fan_out_concurrency(len(parameter_sets)),
+        )
+        try:
+            with contextlib.closing(samples):
+                for sample in samples:
+                    finished.append(sample)
+                    if accept(sample, validator):
+                        break
+                else:
+                    raise NoValidSample(sorted(finished, key=lambda sample: sample.index))
+        finally:
+            # fails the requests still in flight, freeing their concurrency limit slots
+            if transport is not None:
+                transport.abort()
+        if stop_server and len(finished) < len(parameter_sets):
+            self.stop_generation()
+        return sample
+
+    def _sampler(
+        self,
+        prompt: Prompt,
+        timeout: int | float,
+        priority: str,
+        transport: Transport | None = None,
+    ) -> Callable[[Parameters], str]:
+        # not through instruct, a sample cut short once another passes must not be cached
+        # as the full text for its seed
+        def sample(parameters: Parameters) -> str:
+            prompt_to_use, body = _instruct_body(prompt, parameters, False, self.codec)
+            return self._generate(
+                body, timeout, len(prompt_to_use), priority=priority, transport=transport
+            ).text
+
+        return sample
+
+    def _fan_out_transport(self, samples: int) -> RequestsTransport | None:
+        # connections of their own, so the losing requests can be aborted. Requests on a
+        # custom transport cannot be, and run to the end
+        if not isinstance(self.transport, RequestsTransport):
+            return None
+        return RequestsTransport(
+            pool_connections=1,
+            pool_maxsize=samples,
+            connect_timeout=self.transport.connect_timeout,
+        )
+
+    def _fan_out_concurrency(self, samples: int) -> int:
+        # threads past the limit would wait for a slot, then send after a winner is found
+        return min(samples, self.concurrency_limit or samples)
+
+    def instruct_stream(
+        self,
+        prompt: Prompt,
+        parameters: Parameters = DEFAULT_PARAMETERS,
+        timeout: int | float = 500,
+        print_prompt: bool = False,
+        priority: str = DEFAULT_PRIORITY,
+    ) -> Generator[StreamChunk, None, None]:
+        """
+        Provide an instruction, get the response streamed back as it is generated
+
+        :param prompt: Prompt to provide an instruction
+        :param parameters: Generation parameters
+        :param timeout: Max seconds to wait between chunks
+        :param print_prompt: Print the prompt being used. Use case is debugging
+        :param priority: Lane to wait for a request slot in, see instruct
+        :yield: Chunks of generated text, with their arrival times
+        """
+        body = _instruct_body(prompt, parameters, print_prompt, self.codec)[1]
+        with self._generate_limiter.slot(self.acquire_timeout, priority):
+            yield from stream_generate(self._stream_url, body, timeout)
+
+    def instruct_until(
+        self,
+        prompt: Prompt,
+        stop: Sequence[StopPredicate],
+        parameters: Parameters = DEFAULT_PARAMETERS,
+        timeout: int | float = 500,
+        print_prompt: bool = False,
+        priority: str = DEFAULT_PRIORITY,
+        stop_server: bool = True,
+    ) -> StopResult:
+        """
+        Stream an instruction's response until a stop predicate fires
+
+        Each predicate is checked against the text generated so far after every chunk,
+        see ooba_api.stopping. When one fires the stream is closed and, with
+        stop_server, the server is told to stop generating, so it is free for the next
+        request rather than running on to max_new_tokens.
+
+        :param prompt: Prompt to provide an instruction
+        :param stop: Predicates to check, in order. The first to fire stops generation
+        :param parameters: Generation parameters
+        :param timeout: Max seconds to wait between chunks
+        :param print_prompt: Print the prompt being used. Use case is debugging
+        :param priority: Lane to wait for a request slot in, see instruct
+        :param stop_server: Call the stop endpoint when a predicate fires. The web UI
+            stops every generation in progress, so leave this off if the server is
+            generating for others at the same time
+        :return: The text, cut where the predicate fired, and which predicate fired
+        """
+        text = ""
+        stream = self.instruct_stream(prompt, parameters, timeout, print_prompt, priority)
+        with contextlib.closing(stream):
+            for chunk in stream:
+                text += chunk.text
+                if (result := find_stop(text, stop)) is not None:
+                    break
+            else:
+                return StopResult(text, None)
+        if stop_server:
+            self.stop_generation()
+        return result
+
+    def stop_generation(self, timeout: int | float = 5) -> None:
+        """
+        Ask the server to stop generating. Failures are logged, not raised
+
+        The web UI stops every generation in progress, not only this client's.
+        """
+        try:
+            response = self._post(self._stop_url, timeout, {})
+            response.raise_for_status()
+        except requests.RequestException as exc:
+            logger.warning(f"Could not stop generation: {exc!r}")
+
+    def chat(
+        self,
+        prompt: ChatPrompt,
+        parameters: Parameters = DEFAULT_PARAMETERS,
+        timeout: int | float = 500,
+        deadline: float | None = None,
+        priority: str = DEFAULT_PRIORITY,
+    ) -> str:
+        """
+        Send a message with the history before it, get the reply
+
+        The server renders the history with the character or instruction template. For
+        a running session, Conversation avoids encoding the whole history every turn.
+
+        :param prompt: New message, history and chat settings
+        :param parameters: Generation parameters
+        :param timeout: When to timeout
+        :param deadline: Max seconds for the whole call, see instruct
+        :param priority: Lane to wait for a request slot in, see instruct
+        """
+        rows = [self.codec.dumps(row) for row in prompt.history()]
+        body = _chat_body(
+            prompt.prompt, _history_json(rows), prompt.chat_settings(), parameters, self.codec
+        )
+        return self.chat_encoded(body, timeout, deadline, priority)
+
+    def chat_encoded(
+        self,
+        body: bytes,
+        timeout: int | float = 500,
+        deadline: float | None = None,
+        priority: str = DEFAULT_PRIORITY,
+    ) -> str:
+        """
+        Send an already encoded chat request, get the reply
+
+        :param body: JSON body of a chat request
+        :param timeout: When to timeout
+        :param deadline: Max seconds for the whole call, see instruct
+        :param priority: Lane to wait for a request slot in, see instruct
+        """
+        response = self._post(
+            self._chat_url,
+            timeout=timeout,
+            data=body,
+            deadline=Deadline.after(deadline),
+            priority=priority,
+        )
+        self._raise_for_status(response)
+        data = self.codec.loads(response.content)
+        _log_response(data)
+        return _chat_reply(data)
+
+    def count_tokens(self, text: str, timeout: int | float = 30) -> int:
+        """
+        Number of tokens the loaded model encodes the text to, cached per model
+
+        :param text: Text to count, as sent to the model
+        :param timeout: When to timeout
+        """
+        model_name = self._model_name()
+        count = self.token_cache.get(model_name, text)
+        if count is None:
+            response = self._post(self._token_count_url, timeout, {"prompt": text})
+            self._raise_for_status(response)
+            count = _token_count(self.codec.loads(response.content))
+            self.token_cache.set(model_name, text, count)
+        return count
+
+    def count_prompt_tokens(self, prompt: Prompt, timeout: int | float = 30) -> int:
+        """
+        Number of tokens in the rendered prompt
+
+        For prompts from a compiled template, the shared prefix is counted once and
+        cached, and only the rest of each prompt is sent. Counting the two parts
+        separately can come out a token or two higher than counting the whole prompt.
+
+        :param prompt: Prompt to count
+        :param timeout: When to timeout, per request
+        """
+        full_prompt = prompt.full_prompt()
+        prefix = prompt.shared_prefix()
+        if not prefix:
+            return self.count_tokens(full_prompt, timeout)
+        return self.count_tokens(prefix, timeout) + self.count_tokens(
+            full_prompt[len(prefix) :], timeout
+        )
+
+    def max_new_tokens_for(
+        self,
+        prompt: Prompt,
+        parameters: Parameters = DEFAULT_PARAMETERS,
+        min_new_tokens: int = 1,
+    ) -> int:
+        """
+        Largest max_new_tokens that generates without the server truncating the prompt
+
+        :param prompt: Prompt to provide an instruction
+        :param parameters: Generation parameters. max_new_tokens is kept if it already fits
+        :param min_new_tokens: Fewest new tokens worth generating
+        :raises PromptTooLong: Fewer than min_new_tokens fit
+        """
+        return max_new_tokens_for(self.count_prompt_tokens(prompt), parameters, min_new_tokens)
+
+    def fit_parameters(
+        self,
+        prompt: Prompt,
+        parameters: Parameters = DEFAULT_PARAMETERS,
+        min_new_tokens: int = 1,
+    ) -> Parameters:
+        """
+        Same as max_new_tokens_for, but returns parameters to send with the prompt
+
+        :return: parameters itself if it already fits, otherwise a copy with
+            max_new_tokens lowered
+        :raises PromptTooLong: Fewer than min_new_tokens fit
+        """
+        return fit_parameters(self.count_prompt_tokens(prompt), parameters, min_new_tokens)
+
+    def _model_api(
+        self, request: dict, timeout: int | float = 500, idempotent: bool = True
+    ) -> dict:
+        response = self._post(self._model_url, timeout, request, idempotent=idempotent)
+        response.raise_for_status()
+        data = self.codec.loads(response.content)
+        _log_response(data)
+
+        return data["result"]
+
+    def _model_name(self) -> str | None:
+        return (self.cached_model_info()).model_name
+
+    def _set_loaded_model(self, model_info: OobaModelInfo) -> OobaModelInfo:
+        self._loaded_model = model_info
+        self._loaded_model_at = time.monotonic()
+        return model_info
+
+    def _raise_for_status(self, response: requests.Response) -> None:
+        try:
+            response.raise_for_status()
+        except requests.HTTPError as exc:
+            # the web UI answers with a 500 when the model was unloaded or is being swapped
+            if exc.response is not None and exc.response.status_code >= 500:
+                self.invalidate_model_info()
+            raise
+
+    def invalidate_model_info(self) -> None:
+        """
+        Forget the cached model info, the next cached_model_info() asks the server
+        """
+        self._loaded_model = None
+
+    def model_info(self, timeout: int | float = 5) -> OobaModelInfo:
+        """
+        Ask the server which model is loaded, updating the cached model info
+        """
+        result = self._model_api({"action": "info"}, timeout=timeout)
+        return self._set_loaded_model(_model_info(result))
+
+    def cached_model_info(self, timeout: int | float = 5) -> OobaModelInfo:
+        """
+        Model info as last seen, only asking the server if it is missing or older than
+        model_info_ttl
+
+        The cache is invalidated when load_model succeeds and when a generation or token
+        count fails with a server error, which is how an unloaded or swapped model shows up.
+
+        :param timeout: When to timeout, if the server is asked
+        """
+        model_info = self._loaded_model
+        if model_info is not None and (
+            self.model_info_ttl is None
+            or time.monotonic() - self._loaded_model_at < self.model_info_ttl
+        ):
+            return model_info
+        return self.model_info(timeout)
+
+    def start_model_info_refresh(self, interval: float) -> None:
+        """
+        Refresh the cached model info every interval seconds from a background thread
+
+        With interval below model_info_ttl, cached_model_info() never waits on the server.
+        close() stops the refresh. Failed refreshes are logged and
+        retried at the next interval.
+        """
+        if self._refresh_thread is not None:
+            return
+        self._refresh_stop.clear()
+
+        def run() -> None:
+            while True:
+                try:
+                    self.model_info()
+                except requests.RequestException as exc:
+                    logger.warning(f"Could not refresh model info from {self.url}: {exc!r}")
+                except Exception:
+                    # keep refreshing, an unexpected response may not last
+                    logger.exception(f"Could not refresh model info from {self.url}")
+                if self._refresh_stop.wait(interval):
+                    return
+
+        self._refresh_thread = threading.Thread(
+            target=run, name="ooba_api-model-info", daemon=True
+        )
+        self._refresh_thread.start()
+
+    def stop_model_info_refresh(self) -> None:
+        self._refresh_stop.set()
+        if self._refresh_thread is not None:
+            self._refresh_thread.join()
+            self._refresh_thread = None
+
+    def load_model(
+        self, model_name: str, *, args_dict: dict, timeout: int | float = 5000
+    ) -> OobaModelInfo:
+        # loading again after a lost response would load the model twice, so not idempotent
+        try:
+            result = self._model_api(
+                {"action": "load", "model_name": model_name, "args": args_dict},
+                timeout=timeout,
+                idempotent=False,
+            )
+        except Exception:
+            # a failed load may have unloaded the previous model
+            self.invalidate_model_info()
+            raise
+        return self._set_loaded_model(_loaded_model_info(result))
@@ -0,0 +1,97 @@
+import asyncio
+import concurrent.futures
+import threading
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Generic, TypeVar
+
+from ooba_api.retry import Deadline
+
+T = TypeVar("T")
+
+
+class SingleFlight(Generic[T]):
+    """
+    Coalesces identical calls made from several threads at once
+
+    The first caller for a key runs the call. Callers arriving while it is in flight
+    wait for, and share, its result or exception, for as long as their own deadline
+    allows.
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[str, Future[T]] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, call: Callable[[], T], deadline: Deadline | None = None) -> T:
+        """
+        Run call, unless a call with the same key is in flight
+
+        :param key: Identifies identical calls
+        :param call: Makes the call, respecting deadline itself
+        :param deadline: How long to wait for a call already in flight
+        :raises DeadlineExceeded: The call in flight did not finish before the deadline
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if future is None:
+                future = self._calls[key] = Future()
+        if not leader:
+            if deadline is None:
+                return future.result()
+            try:
+                return future.result(deadline.cap(None))
+            except concurrent.futures.TimeoutError:
+                raise deadline.exceeded() from None
+
+        try:
+            result = call()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class AsyncSingleFlight(Generic[T]):
+    """
+    Coalesces identical calls made from several tasks at once
+
+    The call runs in its own task, so a cancelled caller does not cancel the call for
+    everyone else waiting on it.
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[str, asyncio.Task[T]] = {}
+
+    async def do(
+        self, key: str, call: Callable[[], Awaitable[T]], deadline: Deadline | None = None
+    ) -> T:
+        """
+        Run call, unless a call with the same key is in flight
+
+        :param key: Identifies identical calls
+        :param call: Makes the call
+        :param deadline: How long to wait for the call. It keeps running for the others
+        :raises DeadlineExceeded: The call did not finish before the deadline
+        """
+        task = self._calls.get(key)
+        if task is None:
+
+            async def run() -> T:
+                try:
+                    return await call()
+                finally:
+                    del self._calls[key]
+
+            task = self._calls[key] = asyncio.ensure_future(run())
+        if deadline is None:
+            return await asyncio.shield(task)
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), deadline.cap(None))
+        except asyncio.TimeoutError:
+            raise deadline.exceeded() from None
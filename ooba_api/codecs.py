@@ -0,0 +1,61 @@
+import json
+from typing import Any, Protocol, runtime_checkable
+
+
+@runtime_checkable
+class JsonCodec(Protocol):
+    """
+    Encodes request bodies and decodes response bodies
+    """
+
+    def dumps(self, obj: Any) -> bytes:
+        ...
+
+    def loads(self, data: bytes) -> Any:
+        ...
+
+
+class StdlibJsonCodec:
+    """
+    Codec using the standard library json module
+
+    Output is compact, matching OrjsonCodec byte for byte for request bodies, so the
+    server sees the same requests whichever codec is installed.
+    """
+
+    def __init__(self) -> None:
+        # json.dumps builds a new encoder per call when given options, so keep one around
+        self._encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False)
+
+    def dumps(self, obj: Any) -> bytes:
+        return self._encoder.encode(obj).encode()
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec:
+    """
+    Codec using orjson. Requires the `fast` extra, `pip install ooba-api-client[fast]`
+    """
+
+    def __init__(self) -> None:
+        import orjson
+
+        self._orjson = orjson
+
+    def dumps(self, obj: Any) -> bytes:
+        return self._orjson.dumps(obj)
+
+    def loads(self, data: bytes) -> Any:
+        return self._orjson.loads(data)
+
+
+def default_codec() -> JsonCodec:
+    """
+    OrjsonCodec if orjson is installed, otherwise StdlibJsonCodec
+    """
+    try:
+        return OrjsonCodec()
+    except ImportError:
+        return StdlibJsonCodec()
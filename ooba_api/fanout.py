@@ -0,0 +1,176 @@
+"""
+Fan-out sampling, one prompt sent with several parameter sets at once
+
+Used by the clients' instruct_samples, instruct_best_of and instruct_first_valid.
+"""
+import asyncio
+import random
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import AsyncGenerator, Awaitable, Callable, Generator, Sequence
+
+from ooba_api.parameters import Parameters
+from ooba_api.pydantic_compat import construct_many
+
+# seeds are drawn below this when the parameters ask for a random seed
+MAX_SEED = 2**31
+
+
+@dataclass
+class Sample:
+    # position of the parameter set in the fan-out
+    index: int
+
+    parameters: Parameters
+
+    # generated text, None if the request failed
+    text: str | None = None
+
+    # what went wrong with the request, or the validator or scoring function. None if
+    # nothing did
+    error: BaseException | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class NoValidSample(Exception):
+    """
+    Every sample failed, or was rejected by the validator
+    """
+
+    # every sample, in fan-out order
+    samples: list[Sample]
+
+    def __init__(self, samples: list[Sample]) -> None:
+        super().__init__(f"None of {len(samples)} samples were valid")
+        self.samples = samples
+
+
+def sample_parameters(parameters: Parameters | Sequence[Parameters], n: int) -> list[Parameters]:
+    """
+    Parameter sets to fan a prompt out with
+
+    :param parameters: A sequence is used as is. A single parameter set is copied n
+        times with consecutive seeds, starting at its seed, or a random one if its seed
+        is -1
+    :param n: Parameter sets to make from a single one
+    """
+    if not isinstance(parameters, Parameters):
+        if not parameters:
+            raise ValueError("Expected at least one parameter set")
+        return list(parameters)
+    if n < 1:
+        raise ValueError(f"Expected at least one sample, got {n}")
+    seed = parameters.seed if parameters.seed >= 0 else random.randrange(MAX_SEED)
+    return list(construct_many(parameters, [{"seed": seed + i} for i in range(n)]))
+
+
+def accept(sample: Sample, check: Callable[[str], bool]) -> bool:
+    """
+    Whether a finished sample passes check. A check that raises rejects the sample,
+    the exception is kept as its error
+    """
+    if not sample.ok:
+        return False
+    assert sample.text is not None
+    try:
+        return bool(check(sample.text))
+    except Exception as exc:
+        sample.error = exc
+        return False
+
+
+def best_sample(samples: list[Sample], score: Callable[[str], float]) -> Sample:
+    """
+    Highest scoring successful sample, the first of them on a tie
+
+    :raises NoValidSample: Every sample failed, or could not be scored
+    """
+    best: Sample | None = None
+    best_score = 0.0
+    for sample in samples:
+        if not sample.ok:
+            continue
+        assert sample.text is not None
+        try:
+            sample_score = score(sample.text)
+        except Exception as exc:
+            sample.error = exc
+            continue
+        if best is None or sample_score > best_score:
+            best, best_score = sample, sample_score
+    if best is None:
+        raise NoValidSample(samples)
+    return best
+
+
+def run_fan_out(
+    instruct: Callable[[Parameters], str],
+    parameter_sets: Sequence[Parameters],
+    max_concurrency: int,
+) -> Generator[Sample, None, None]:
+    """
+    Run instruct with every parameter set on a thread pool, yielding samples as they finish
+
+    Closing the generator early stops the fan-out. Requests not yet sent are dropped,
+    and those in flight are not waited for. To stop them as well, abort the transport
+    instruct sends with, as OobaApiClient.instruct_first_valid does.
+
+    :param instruct: Called with each parameter set, returns the generated text
+    :param parameter_sets: Parameter sets to run
+    :param max_concurrency: Max requests in flight
+    """
+    stopped = threading.Event()
+
+    def run_one(index: int, parameters: Parameters) -> Sample:
+        if stopped.is_set():
+            return Sample(index, parameters, error=RuntimeError("Fan-out stopped"))
+        try:
+            return Sample(index, parameters, text=instruct(parameters))
+        except Exception as exc:
+            return Sample(index, parameters, error=exc)
+
+    pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="ooba_api-fanout")
+    pending: set[Future[Sample]] = {
+        pool.submit(run_one, index, parameters) for index, parameters in enumerate(parameter_sets)
+    }
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        stopped.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def arun_fan_out(
+    instruct: Callable[[Parameters], Awaitable[str]], parameter_sets: Sequence[Parameters]
+) -> AsyncGenerator[Sample, None]:
+    """
+    Async version of run_fan_out. Closing it early cancels the requests still running
+
+    Every request is started at once, the client's limiter bounds how many are in flight.
+    """
+
+    async def run_one(index: int, parameters: Parameters) -> Sample:
+        try:
+            return Sample(index, parameters, text=await instruct(parameters))
+        except Exception as exc:
+            return Sample(index, parameters, error=exc)
+
+    pending = {
+        asyncio.create_task(run_one(index, parameters))
+        for index, parameters in enumerate(parameter_sets)
+    }
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
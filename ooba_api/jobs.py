@@ -0,0 +1,314 @@
+import argparse
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable
+
+from ooba_api.clients import OobaApiClient
+from ooba_api.parameters import Parameters, parse_value
+from ooba_api.prompts import InstructPrompt, LlamaInstructPrompt, Prompt
+from ooba_api.pydantic_compat import field_names
+from ooba_api.transport import RequestsTransport
+
+# --template choices
+PROMPT_CLASSES: dict[str, type[Prompt]] = {
+    "instruct": InstructPrompt,
+    "llama": LlamaInstructPrompt,
+}
+
+
+@dataclass
+class Checkpoint:
+    """
+    Progress of a batch job, saved next to its output so a restarted job resumes
+
+    Records finish out of order, so progress is every line before next_line plus the
+    finished lines after it. The job never runs more than max_ahead lines past
+    next_line, which keeps done, and the checkpoint, small.
+    """
+
+    # every input line before this one is finished
+    next_line: int = 0
+
+    # finished input lines at or after next_line
+    done: set[int] = field(default_factory=set)
+
+    # output bytes written for the finished lines. Anything after was written by a run
+    # that stopped before saving, and is written again on resume
+    offset: int = 0
+
+    @classmethod
+    def load(cls, path: Path) -> "Checkpoint":
+        """
+        Checkpoint saved at path, an empty one if there is none
+        """
+        if not path.exists():
+            return cls()
+        data = json.loads(path.read_text())
+        return cls(data["next_line"], set(data["done"]), data["offset"])
+
+    def save(self, path: Path) -> None:
+        # write then rename, so a crash leaves either the old or the new checkpoint
+        temporary = path.with_name(path.name + ".tmp")
+        temporary.write_text(
+            json.dumps(
+                {"next_line": self.next_line, "done": sorted(self.done), "offset": self.offset}
+            )
+        )
+        os.replace(temporary, path)
+
+    def finished(self, line: int) -> bool:
+        return line < self.next_line or line in self.done
+
+    def finish(self, line: int) -> None:
+        self.done.add(line)
+        while self.next_line in self.done:
+            self.done.remove(self.next_line)
+            self.next_line += 1
+
+
+@dataclass
+class JobSummary:
+    # records that generated text in this run
+    succeeded: int = 0
+
+    # records that could not be parsed or whose request failed, in this run
+    failed: int = 0
+
+    # records finished by an earlier run
+    skipped: int = 0
+
+
+def _load_record(line: int, text: str) -> tuple[Any, dict]:
+    data = json.loads(text)
+    if not isinstance(data, dict):
+        raise ValueError(f"Expected a JSON object, got {type(data).__name__}")
+    return data.pop("id", line), data
+
+
+def _render_record(
+    data: dict,
+    prompt_class: type[Prompt],
+    prompt_fields: dict,
+    parameter_fields: dict,
+    parameters: Parameters,
+) -> tuple[Prompt, Parameters]:
+    overrides = data.pop("parameters", None)
+    if overrides is not None and not isinstance(overrides, dict):
+        raise ValueError(
+            f"Expected parameters to be a JSON object, got {type(overrides).__name__}"
+        )
+    prompt = prompt_class(**prompt_fields | data)
+    if overrides:
+        # pydantic ignores unknown fields, so catch typos here
+        unknown = overrides.keys() - field_names(Parameters)
+        if unknown:
+            raise ValueError(f"Unknown parameters {sorted(unknown)}")
+        parameters = Parameters(**parameter_fields | overrides)
+    return prompt, parameters
+
+
+def run_jsonl(
+    instruct: Callable[[Prompt, Parameters], str],
+    input_path: Path,
+    output_path: Path,
+    *,
+    prompt_class: type[Prompt] = InstructPrompt,
+    prompt_fields: dict | None = None,
+    parameters: dict | None = None,
+    max_concurrency: int = 4,
+    checkpoint_path: Path | None = None,
+    checkpoint_every: int = 100,
+    max_ahead: int = 1024,
+) -> JobSummary:
+    """
+    Run every prompt record in a JSONL file, writing results to another as they finish
+
+    Each input line is a JSON object with "prompt" and optionally "id", "parameters"
+    and any other field of prompt_class, such as "negative_prompt" or "system_prompt".
+    Other fields are ignored. The id defaults to the line number, starting at 0.
+
+    Each output line is {"id": ..., "text": ...}, or {"id": ..., "error": ...} for a
+    record that could not be parsed or whose request failed. Output is in completion
+    order.
+
+    Progress is checkpointed, so running again with the same input resumes where the
+    last run stopped, even after a crash, and writes each record exactly once. Without
+    a checkpoint the output is overwritten. The input must not change between runs.
+
+    Records are read as they are needed, so memory stays constant however large the
+    input is.
+
+    :param instruct: Called with each prompt and its parameters, returns the generated
+        text. For example a lambda around OobaApiClient.instruct
+    :param input_path: JSONL file of prompt records
+    :param output_path: JSONL file to write results to
+    :param prompt_class: Prompt class records are rendered with
+    :param prompt_fields: Fields every prompt has, such as system_prompt. Records can
+        override them
+    :param parameters: Generation parameters for every record, a record's "parameters"
+        override them
+    :param max_concurrency: Max requests in flight
+    :param checkpoint_path: Where to save progress. Defaults to the output path with
+        .checkpoint appended
+    :param checkpoint_every: Save progress after this many records finish
+    :param max_ahead: Max lines a record can run ahead of the oldest unfinished one.
+        A slow request holds back new ones once the others are this far ahead
+    :return: Counts of the records run, failed and skipped
+    :raises ValueError: The output is shorter than the checkpoint says, so it was
+        changed since
+    """
+    if checkpoint_path is None:
+        checkpoint_path = output_path.with_name(output_path.name + ".checkpoint")
+    prompt_fields = prompt_fields or {}
+    parameter_fields = parameters or {}
+    shared_parameters = Parameters(**parameter_fields).frozen()
+    checkpoint = Checkpoint.load(checkpoint_path)
+    summary = JobSummary()
+    unsaved = 0
+
+    with ThreadPoolExecutor(
+        max_workers=max_concurrency, thread_name_prefix="ooba_api"
+    ) as pool, output_path.open("r+b" if output_path.exists() else "wb") as output:
+        if output.seek(0, os.SEEK_END) < checkpoint.offset:
+            raise ValueError(f"{output_path} is shorter than {checkpoint_path} says")
+        # drop results written after the last save, their records run again
+        output.truncate(checkpoint.offset)
+        output.seek(checkpoint.offset)
+        pending: dict[Future[str], tuple[int, Any]] = {}
+
+        def save() -> None:
+            nonlocal unsaved
+            output.flush()
+            checkpoint.offset = output.tell()
+            checkpoint.save(checkpoint_path)
+            unsaved = 0
+
+        def write(line: int, result: dict) -> None:
+            nonlocal unsaved
+            output.write(json.dumps(result).encode() + b"\n")
+            if "error" in result:
+                summary.failed += 1
+            else:
+                summary.succeeded += 1
+            checkpoint.finish(line)
+            unsaved += 1
+            if unsaved >= checkpoint_every:
+                save()
+
+        def collect() -> None:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                line, record_id = pending.pop(future)
+                try:
+                    write(line, {"id": record_id, "text": future.result()})
+                except Exception as exc:
+                    write(line, {"id": record_id, "error": repr(exc)})
+
+        try:
+            with input_path.open(encoding="utf-8") as lines:
+                for line, text in enumerate(lines):
+                    if checkpoint.finished(line):
+                        summary.skipped += 1 if text.strip() else 0
+                        continue
+                    if not text.strip():
+                        checkpoint.finish(line)
+                        continue
+                    while pending and (
+                        len(pending) >= max_concurrency
+                        or line - checkpoint.next_line >= max_ahead
+                    ):
+                        collect()
+                    record_id: Any = line
+                    try:
+                        record_id, data = _load_record(line, text)
+                        prompt, record_parameters = _render_record(
+                            data, prompt_class, prompt_fields, parameter_fields, shared_parameters
+                        )
+                    except ValueError as exc:
+                        write(line, {"id": record_id, "error": repr(exc)})
+                        continue
+                    pending[pool.submit(instruct, prompt, record_parameters)] = (
+                        line,
+                        record_id,
+                    )
+            while pending:
+                collect()
+        finally:
+            # the requests still running finish, but are run again on resume
+            for future in pending:
+                future.cancel()
+            save()
+    return summary
+
+
+def main(argv: list[str] | None = None) -> None:
+    """
+    ooba-batch, runs a JSONL file of prompts against a server, resuming if interrupted
+    """
+    parser = argparse.ArgumentParser(
+        prog="ooba-batch",
+        description="Run a JSONL file of prompts, writing results as they finish",
+    )
+    parser.add_argument("input", type=Path, help="JSONL file of prompt records")
+    parser.add_argument("output", type=Path, help="JSONL file to write results to")
+    parser.add_argument("--url", default="http://localhost:5000", help="Base URL of the server")
+    parser.add_argument("--concurrency", type=int, default=4, help="Max requests in flight")
+    parser.add_argument(
+        "--template",
+        choices=sorted(PROMPT_CLASSES),
+        default="instruct",
+        help="Prompt format records are rendered with",
+    )
+    parser.add_argument("--system-prompt", help="System prompt for the llama template")
+    parser.add_argument("--instruct-template", help="Instruct template for the instruct template")
+    parser.add_argument(
+        "--param",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="Generation parameter for every record, repeatable",
+    )
+    parser.add_argument("--timeout", type=float, default=500, help="Seconds per request")
+    parser.add_argument("--checkpoint", type=Path, help="Where to save progress")
+    args = parser.parse_args(argv)
+
+    parameters: dict = {}
+    for spec in args.param:
+        name, sep, value = spec.partition("=")
+        if not sep or name.strip() not in field_names(Parameters):
+            parser.error(f"Expected a known NAME=VALUE parameter, got {spec!r}")
+        parameters[name.strip()] = parse_value(value)
+    prompt_fields = {}
+    if args.system_prompt is not None:
+        prompt_fields["system_prompt"] = args.system_prompt
+    if args.instruct_template is not None:
+        prompt_fields["instruct_template"] = args.instruct_template
+    # pydantic ignores unknown fields, so the option would be dropped silently
+    for name in prompt_fields.keys() - field_names(PROMPT_CLASSES[args.template]):
+        parser.error(f"--{name.replace('_', '-')} does not apply to the {args.template} template")
+
+    # concurrency is set by the job, so the client itself is unlimited
+    with OobaApiClient(
+        args.url,
+        one_at_a_time=False,
+        transport=RequestsTransport(pool_maxsize=args.concurrency),
+    ) as client:
+        summary = run_jsonl(
+            lambda prompt, parameters: client.instruct(
+                prompt, parameters, args.timeout, priority="batch"
+            ),
+            args.input,
+            args.output,
+            prompt_class=PROMPT_CLASSES[args.template],
+            prompt_fields=prompt_fields,
+            parameters=parameters,
+            max_concurrency=args.concurrency,
+            checkpoint_path=args.checkpoint,
+        )
+    print(
+        f"{summary.succeeded} succeeded, {summary.failed} failed, "
+        f"{summary.skipped} skipped as already finished"
+    )
@@ -0,0 +1,574 @@
+import asyncio
+import contextlib
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterator, Mapping
+
+from ooba_api.stats import LatencySummary, summarize
+
+logger = logging.getLogger("ooba_api")
+
+# queue waits kept per lane for LaneStats
+WAIT_WINDOW = 1000
+
+
+class ConcurrencyLimitTimeout(TimeoutError):
+    """
+    Raised when a request could not get a slot within the acquire timeout
+    """
+
+
+class QueueFull(ConcurrencyLimitTimeout):
+    """
+    Raised at once, without waiting, when a request's priority lane already has
+    max_queue requests waiting
+    """
+
+
+@dataclass(frozen=True)
+class Lane:
+    """
+    A priority class of requests waiting for a slot
+    """
+
+    # share of the freed slots while other lanes are also waiting, relative to their weights
+    weight: int = 1
+
+    # requests that can wait in the lane, more are rejected with QueueFull. None means no limit
+    max_queue: int | None = None
+
+
+# interactive requests get 4 of every 5 slots while batch requests are also waiting
+DEFAULT_LANES: Mapping[str, Lane] = {"interactive": Lane(weight=4), "batch": Lane(weight=1)}
+
+DEFAULT_PRIORITY = "interactive"
+
+
+@dataclass
+class LaneStats:
+    """
+    Requests of one priority lane, since the limiter was created
+    """
+
+    # waiting for a slot now
+    waiting: int
+
+    # given a slot, including those that got one without waiting
+    admitted: int
+
+    # rejected with QueueFull
+    rejected: int
+
+    # gave up waiting
+    timed_out: int
+
+    # seconds spent waiting for a slot, over the last admitted requests
+    queue_wait: LatencySummary | None
+
+
+class _LaneState:
+    def __init__(self, lane: Lane) -> None:
+        if lane.weight < 1:
+            raise ValueError("Lane weight must be at least 1")
+        self.lane = lane
+        # waiting requests, oldest first
+        self.waiters: deque = deque()
+        # stride scheduling, the lane with the lowest pass is served next
+        self.pass_ = 0.0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.recent_waits: deque[float] = deque(maxlen=WAIT_WINDOW)
+
+    def stats(self) -> LaneStats:
+        return LaneStats(
+            waiting=len(self.waiters),
+            admitted=self.admitted,
+            rejected=self.rejected,
+            timed_out=self.timed_out,
+            queue_wait=summarize(list(self.recent_waits)) if self.recent_waits else None,
+        )
+
+
+class _Lanes:
+    """
+    Waiting requests by priority, served with weighted fairness
+
+    Not thread safe, the limiters call it with their lock held or from the event loop.
+    """
+
+    def __init__(self, lanes: Mapping[str, Lane]) -> None:
+        if not lanes:
+            raise ValueError("At least one lane is required")
+        self.config = dict(lanes)
+        self._lanes = {name: _LaneState(lane) for name, lane in lanes.items()}
+        # pass of the lane served last. A lane that starts waiting begins here, so time
+        # spent idle does not build up credit
+        self._virtual_time = 0.0
+        self.waiting = 0
+
+    def get(self, priority: str) -> _LaneState:
+        try:
+            return self._lanes[priority]
+        except KeyError:
+            raise ValueError(
+                f"Unknown priority {priority!r}, expected one of {sorted(self._lanes)}"
+            ) from None
+
+    def enqueue(self, state: _LaneState, waiter: object) -> None:
+        if state.lane.max_queue is not None and len(state.waiters) >= state.lane.max_queue:
+            state.rejected += 1
+            raise QueueFull(f"{len(state.waiters)} requests already waiting in the lane")
+        if not state.waiters:
+            state.pass_ = max(state.pass_, self._virtual_time)
+        state.waiters.append(waiter)
+        self.waiting += 1
+
+    def remove(self, state: _LaneState, waiter: object) -> None:
+        state.waiters.remove(waiter)
+        state.timed_out += 1
+        self.waiting -= 1
+
+    def pop_next(self) -> object | None:
+        if not self.waiting:
+            return None
+        state = min(
+            (state for state in self._lanes.values() if state.waiters),
+            key=lambda state: state.pass_,
+        )
+        self._virtual_time = state.pass_
+        state.pass_ += 1 / state.lane.weight
+        self.waiting -= 1
+        return state.waiters.popleft()
+
+    def admitted(self, state: _LaneState, wait: float) -> None:
+        state.admitted += 1
+        state.recent_waits.append(wait)
+
+    def stats(self) -> dict[str, LaneStats]:
+        return {name: state.stats() for name, state in self._lanes.items()}
+
+
+@dataclass(frozen=True)
+class AdaptiveLimit:
+    """
+    Settings for a limiter that finds how many requests the server handles well
+
+    After each window of requests, the limit grows by one if the mean latency per output
+    token stayed within tolerance of the baseline and the limit was reached. It is
+    multiplied by backoff when latency rises past that, or when a request times out or
+    gets a 5xx (AIMD). The baseline is the lowest mean seen, rising slowly so it follows
+    a server that got slower for good.
+    """
+
+    # limit to start from
+    initial: int = 1
+
+    # the limit never goes below this
+    min_limit: int = 1
+
+    # the limit never goes above this
+    max_limit: int = 64
+
+    # completed requests per adjustment
+    window: int = 10
+
+    # mean latency above this multiple of the baseline counts as rising
+    tolerance: float = 1.25
+
+    # multiply the limit by this when latency rises or requests fail
+    backoff: float = 0.7
+
+
+# the baseline rises this much per window when no lower latency is seen
+BASELINE_DRIFT = 1.05
+
+
+class _AIMD:
+    """
+    Limit of an adaptive limiter, see AdaptiveLimit
+
+    Not thread safe, the limiters call it with their lock held or from the event loop.
+    """
+
+    def __init__(self, settings: AdaptiveLimit) -> None:
+        if not 1 <= settings.min_limit <= settings.initial <= settings.max_limit:
+            raise ValueError("Expected 1 <= min_limit <= initial <= max_limit")
+        if not 0 < settings.backoff < 1:
+            raise ValueError("backoff must be between 0 and 1")
+        if settings.window < 1 or settings.tolerance < 1:
+            raise ValueError("window and tolerance must be at least 1")
+        self.settings = settings
+        self.limit = settings.initial
+        # lowest mean latency per window, None until a window completes
+        self.baseline: float | None = None
+        self._samples: list[float] = []
+        # whether the limit was reached during the window, an unused limit is not raised
+        self._saturated = False
+        # outcomes of requests in flight when the limit was lowered, ignored when failing,
+        # so one overload lowers the limit once
+        self._ignored = 0
+
+    def admitted(self, in_flight: int) -> None:
+        if in_flight >= self.limit:
+            self._saturated = True
+
+    def succeeded(self, latency: float) -> bool:
+        """
+        Record a latency, True if the limit was raised
+        """
+        self._ignored = max(self._ignored - 1, 0)
+        self._samples.append(latency)
+        if len(self._samples) < self.settings.window:
+            return False
+        mean = sum(self._samples) / len(self._samples)
+        saturated = self._saturated
+        self._samples.clear()
+        self._saturated = False
+        rising = self.baseline is not None and mean > self.baseline * self.settings.tolerance
+        self.baseline = (
+            mean if self.baseline is None else min(mean, self.baseline * BASELINE_DRIFT)
+        )
+        if rising:
+            self._lower()
+            return False
+        if saturated and self.limit < self.settings.max_limit:
+            self.limit += 1
+            return True
+        return False
+
+    def failed(self, in_flight: int) -> None:
+        if self._ignored:
+            self._ignored -= 1
+            return
+        self._lower()
+        # the others in flight were sent at the old limit
+        self._ignored = max(in_flight - 1, 0)
+
+    def _lower(self) -> None:
+        self.limit = max(int(self.limit * self.settings.backoff), self.settings.min_limit)
+        self._samples.clear()
+        self._saturated = False
+
+
+class _Waiter:
+    __slots__ = ("condition", "granted")
+
+    def __init__(self, lock: threading.Lock) -> None:
+        self.condition = threading.Condition(lock)
+        self.granted = False
+
+
+class ConcurrencyLimiter:
+    """
+    Limits how many requests are in flight at once, across threads
+
+    A limit of None means unlimited. Requests wait in priority lanes. When a slot
+    frees up, it goes to the oldest request of a lane chosen by weight, so a backlog in
+    one lane delays the others by no more than their weights allow.
+
+    With adaptive settings, the limit moves with the latencies and overloads reported
+    through record_latency and record_overload, and the given limit is ignored.
+    """
+
+    def __init__(
+        self,
+        limit: int | None = 1,
+        lanes: Mapping[str, Lane] = DEFAULT_LANES,
+        adaptive: AdaptiveLimit | None = None,
+    ) -> None:
+        self._limit = limit
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._lanes = _Lanes(lanes)
+        self._adaptive = _AIMD(adaptive) if adaptive is not None else None
+
+    @property
+    def limit(self) -> int | None:
+        """
+        Max requests in flight, the current one for an adaptive limiter
+        """
+        return self._adaptive.limit if self._adaptive is not None else self._limit
+
+    @property
+    def adaptive(self) -> AdaptiveLimit | None:
+        return self._adaptive.settings if self._adaptive is not None else None
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def lanes(self) -> dict[str, Lane]:
+        return self._lanes.config
+
+    def _has_capacity(self) -> bool:
+        limit = self.limit
+        return limit is None or self._in_flight < limit
+
+    def lane_stats(self) -> dict[str, LaneStats]:
+        """
+        Queue depth, admissions, rejections and queue wait of each priority lane
+        """
+        with self._lock:
+            return self._lanes.stats()
+
+    def record_latency(self, seconds: float) -> None:
+        """
+        Report how long a request took, per output token if known. Ignored unless
+        adaptive
+        """
+        if self._adaptive is None:
+            return
+        with self._lock:
+            if self._adaptive.succeeded(seconds):
+                self._grant()
+
+    def record_overload(self) -> None:
+        """
+        Report a request that timed out or got a 5xx. Ignored unless adaptive
+        """
+        if self._adaptive is None:
+            return
+        with self._lock:
+            self._adaptive.failed(self._in_flight)
+
+    def configure(self, limit: int | None, adaptive: AdaptiveLimit | None = None) -> None:
+        """
+        Change the limit, or the adaptive settings. Requests in flight keep their slots,
+        and waiters are admitted if the limit went up
+
+        :param limit: Max requests in flight. None means unlimited
+        :param adaptive: Settings to adapt the limit with. Overrides limit
+        """
+        with self._lock:
+            self._limit = limit
+            if adaptive != self.adaptive:
+                self._adaptive = _AIMD(adaptive) if adaptive is not None else None
+            self._grant()
+
+    def _admit(self) -> None:
+        self._in_flight += 1
+        if self._adaptive is not None:
+            self._adaptive.admitted(self._in_flight)
+
+    def _grant(self) -> None:
+        # called with the lock held. Hand free slots straight to the next waiters, so a
+        # new request cannot jump the queue
+        while self._has_capacity() and (waiter := self._lanes.pop_next()) is not None:
+            assert isinstance(waiter, _Waiter)
+            self._admit()
+            waiter.granted = True
+            waiter.condition.notify()
+
+    def acquire(self, timeout: float | None = None, priority: str = DEFAULT_PRIORITY) -> None:
+        """
+        Wait for a free slot
+
+        :param timeout: Max seconds to wait. None waits forever
+        :param priority: Lane to wait in
+        :raises ConcurrencyLimitTimeout: No slot became free in time
+        :raises QueueFull: The lane already has max_queue requests waiting
+        :raises ValueError: The priority is not one of the lanes
+        """
+        start = time.perf_counter()
+        with self._lock:
+            state = self._lanes.get(priority)
+            if self._has_capacity() and not self._lanes.waiting:
+                self._admit()
+                self._lanes.admitted(state, 0.0)
+                return
+            waiter = _Waiter(self._lock)
+            self._lanes.enqueue(state, waiter)
+            if not waiter.condition.wait_for(lambda: waiter.granted, timeout):
+                self._lanes.remove(state, waiter)
+                raise ConcurrencyLimitTimeout(
+                    f"No request slot free after {timeout}s ({self._in_flight} in flight)"
+                )
+            self._lanes.admitted(state, time.perf_counter() - start)
+
+    def release(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            self._grant()
+
+    @contextlib.contextmanager
+    def slot(
+        self, timeout: float | None = None, priority: str = DEFAULT_PRIORITY
+    ) -> Iterator[None]:
+        self.acquire(timeout, priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class AsyncConcurrencyLimiter:
+    """
+    Limits how many requests are in flight at once, across tasks on one event loop
+
+    A limit of None means unlimited. Requests wait in priority lanes, and the limit
+    can be adaptive, see ConcurrencyLimiter.
+    """
+
+    def __init__(
+        self,
+        limit: int | None = 1,
+        lanes: Mapping[str, Lane] = DEFAULT_LANES,
+        adaptive: AdaptiveLimit | None = None,
+    ) -> None:
+        self._limit = limit
+        self._in_flight = 0
+        self._lanes = _Lanes(lanes)
+        self._adaptive = _AIMD(adaptive) if adaptive is not None else None
+
+    @property
+    def limit(self) -> int | None:
+        """
+        Max requests in flight, the current one for an adaptive limiter
+        """
+        return self._adaptive.limit if self._adaptive is not None else self._limit
+
+    @property
+    def adaptive(self) -> AdaptiveLimit | None:
+        return self._adaptive.settings if self._adaptive is not None else None
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def lanes(self) -> dict[str, Lane]:
+        return self._lanes.config
+
+    def _has_capacity(self) -> bool:
+        limit = self.limit
+        return limit is None or self._in_flight < limit
+
+    def lane_stats(self) -> dict[str, LaneStats]:
+        """
+        Queue depth, admissions, rejections and queue wait of each priority lane
+        """
+        return self._lanes.stats()
+
+    def record_latency(self, seconds: float) -> None:
+        """
+        Report how long a request took, per output token if known. Ignored unless
+        adaptive
+        """
+        if self._adaptive is not None and self._adaptive.succeeded(seconds):
+            self._grant()
+
+    def record_overload(self) -> None:
+        """
+        Report a request that timed out or got a 5xx. Ignored unless adaptive
+        """
+        if self._adaptive is not None:
+            self._adaptive.failed(self._in_flight)
+
+    def _admit(self) -> None:
+        self._in_flight += 1
+        if self._adaptive is not None:
+            self._adaptive.admitted(self._in_flight)
+
+    async def acquire(
+        self, timeout: float | None = None, priority: str = DEFAULT_PRIORITY
+    ) -> None:
+        """
+        Wait for a free slot
+
+        :param timeout: Max seconds to wait. None waits forever
+        :param priority: Lane to wait in
+        :raises ConcurrencyLimitTimeout: No slot became free in time
+        :raises QueueFull: The lane already has max_queue requests waiting
+        :raises ValueError: The priority is not one of the lanes
+        """
+        start = time.perf_counter()
+        state = self._lanes.get(priority)
+        if self._has_capacity() and not self._lanes.waiting:
+            self._admit()
+            self._lanes.admitted(state, 0.0)
+            return
+        waiter: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._lanes.enqueue(state, waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except BaseException as exc:
+            if waiter.done():
+                # granted as the wait ended, give the slot back
+                self._in_flight -= 1
+                self._grant()
+            else:
+                self._lanes.remove(state, waiter)
+                waiter.cancel()
+            if isinstance(exc, asyncio.TimeoutError):
+                raise ConcurrencyLimitTimeout(
+                    f"No request slot free after {timeout}s ({self._in_flight} in flight)"
+                ) from None
+            raise
+        self._lanes.admitted(state, time.perf_counter() - start)
+
+    def _grant(self) -> None:
+        while self._has_capacity() and (waiter := self._lanes.pop_next()) is not None:
+            assert isinstance(waiter, asyncio.Future)
+            self._admit()
+            waiter.set_result(None)
+
+    async def release(self) -> None:
+        self._in_flight -= 1
+        self._grant()
+
+    @contextlib.asynccontextmanager
+    async def slot(
+        self, timeout: float | None = None, priority: str = DEFAULT_PRIORITY
+    ) -> AsyncIterator[None]:
+        await self.acquire(timeout, priority)
+        try:
+            yield
+        finally:
+            await self.release()
+
+
+# limiters are shared by every client in the process talking to the same server
+_shared_limiters: dict[tuple[str, str], ConcurrencyLimiter] = {}
+_shared_limiters_lock = threading.Lock()
+
+
+def shared_limiter(
+    url: str,
+    kind: str,
+    limit: int | None,
+    lanes: Mapping[str, Lane] = DEFAULT_LANES,
+    adaptive: AdaptiveLimit | None = None,
+    override: bool = False,
+) -> ConcurrencyLimiter:
+    """
+    Get the limiter for a server URL and kind of request, creating it if needed
+
+    The first client to register a URL creates its limiter. Later clients share it, and
+    with override their limit and adaptive settings replace the current ones, for every
+    client of the URL. Lanes are set by the first client and cannot change.
+
+    :param url: Base URL of the server
+    :param kind: Kind of request, for example "generate" or "model"
+    :param limit: Max requests in flight. None means unlimited
+    :param lanes: Priority lanes by name
+    :param adaptive: Settings to adapt the limit to the server with. Overrides limit
+    :param override: The caller chose limit and adaptive rather than taking defaults,
+        apply them to an existing limiter
+    """
+    with _shared_limiters_lock:
+        limiter = _shared_limiters.get((url, kind))
+        if limiter is None:
+            limiter = _shared_limiters[(url, kind)] = ConcurrencyLimiter(limit, lanes, adaptive)
+        elif override and (
+            limiter.adaptive != adaptive or (adaptive is None and limiter.limit != limit)
+        ):
+            logger.info(f"{kind} concurrency limit for {url} changed to {adaptive or limit}")
+            limiter.configure(limit, adaptive)
+        if limiter.lanes != dict(lanes):
+            logger.warning(f"{kind} lanes for {url} are already set, ignoring {dict(lanes)}")
+        return limiter
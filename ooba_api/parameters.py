@@ -1,8 +1,9 @@
-from typing import TYPE_CHECKING
+import json
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, TypeVar
 
 import pydantic
 
-from ooba_api.pydantic_compat import USING_PYDANTIC_LEGACY
+from ooba_api.pydantic_compat import USING_PYDANTIC_LEGACY, construct, construct_many
 
 if not TYPE_CHECKING:
     GuidanceScale = pydantic.confloat(ge=0, le=2.5)
@@ -33,6 +34,9 @@ else:
     TruncationLength = int
 
 
+P = TypeVar("P", bound="Parameters")
+
+
 class Parameters(pydantic.BaseModel):
     # add beginning token, highly recommended but maybe some models don't want this
     add_bos_token: bool = True
@@ -87,5 +91,77 @@ class Parameters(pydantic.BaseModel):
     # length to truncate the prompt. Should always be lower than the max context size
     truncation_length: TruncationLength = 4096
 
+    def frozen(self) -> "FrozenParameters":
+        """
+        Immutable copy of these parameters, cheaper to send repeatedly
+        """
+        if isinstance(self, FrozenParameters):
+            return self
+        return _construct(FrozenParameters, _dump(self))
+
+    @classmethod
+    def bulk(cls: type[P], rows: Iterable[dict], **fields) -> Iterator[P]:
+        """
+        Build many parameter sets that differ in a few values, validating once
+
+        The shared fields are validated once. The rows are trusted and not validated.
+        The copies share the template's values, so treat them as read only.
+
+        :param rows: Values that differ per parameter set, such as seed
+        :param fields: Values every parameter set has
+        :raises ValueError: A row has a field Parameters does not
+        """
+        return construct_many(cls(**fields), rows)
+
+
+class FrozenParameters(Parameters):
+    """
+    Parameters that cannot be changed after creation
+
+    The encoded parameters are cached on the instance, so requests reusing it skip
+    serializing the parameters each time.
+    """
+
+    # codec type -> encoded parameters
+    _encoded: dict = pydantic.PrivateAttr(default_factory=dict)
+
+    if USING_PYDANTIC_LEGACY:
+
+        class Config:
+            frozen = True
+
+    else:
+        model_config = pydantic.ConfigDict(frozen=True)
+
+
+def _dump(parameters: Parameters) -> dict:
+    # pydantic compatibility. dict -> model_dump
+    if hasattr(parameters, "model_dump"):
+        return parameters.model_dump()
+    return parameters.dict()
+
+
+def parse_value(value: str) -> Any:
+    """
+    Parameter value given on the command line, JSON if it parses as JSON, otherwise a string
+    """
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return value
+
+
+def _construct(cls: type[P], values: dict) -> P:
+    return construct(cls, values)
+
+
+def _replace(parameters: P, **changes) -> P:
+    """
+    Copy of parameters with some values changed
+
+    Unlike copy/model_copy, a FrozenParameters copy does not share the cached encoding.
+    """
+    return _construct(type(parameters), _dump(parameters) | changes)
+
 
-DEFAULT_PARAMETERS = Parameters()
+DEFAULT_PARAMETERS = FrozenParameters()
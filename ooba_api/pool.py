@@ -0,0 +1,341 @@
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Iterable, Iterator
+
+import requests
+
+from ooba_api.batch import BatchResult, run_as_completed
+from ooba_api.clients import OobaApiClient
+from ooba_api.limits import DEFAULT_PRIORITY
+from ooba_api.model_info import OobaModelNotLoaded
+from ooba_api.parameters import DEFAULT_PARAMETERS, Parameters
+from ooba_api.prompts import Prompt
+from ooba_api.retry import Deadline, HedgePolicy
+from ooba_api.stats import percentile
+from ooba_api.streaming import StreamChunk
+
+logger = logging.getLogger("ooba_api")
+
+
+class NoHealthyBackends(RuntimeError):
+    """
+    Raised when every backend in a pool has been ejected
+    """
+
+
+@dataclass
+class Backend:
+    client: OobaApiClient
+
+    # requests currently sent to this backend by the pool
+    in_flight: int = 0
+
+    # ejected backends are not routed to until a health check passes
+    healthy: bool = True
+
+    # why the backend was last ejected
+    last_error: str | None = None
+
+
+class OobaClientPool:
+    """
+    Routes requests across several web UI servers
+
+    Each request goes to the healthy backend with the fewest requests in flight.
+    Backends are ejected when they have no model loaded or stop answering, and are
+    brought back once a health check passes again. With a hedge policy, instructions
+    that run slow are also sent to a second backend and the first answer wins.
+    """
+
+    backends: list[Backend]
+
+    # when to send slow instructions to a second backend. None never does
+    hedge: HedgePolicy | None
+
+    def __init__(
+        self,
+        urls: Iterable[str],
+        *,
+        health_check_interval: float | None = 30,
+        hedge: HedgePolicy | None = None,
+        **client_kwargs,
+    ) -> None:
+        """
+        :param urls: Base URLs of the servers
+        :param health_check_interval: Seconds between background health checks. None
+            disables them, call check_health() instead
+        :param hedge: When to send slow instructions to a second backend
+        :param client_kwargs: Passed to each OobaApiClient
+        """
+        self.backends = [Backend(OobaApiClient(url, **client_kwargs)) for url in urls]
+        if not self.backends:
+            raise ValueError("At least one backend URL is required")
+        self.health_check_interval = health_check_interval
+
+        self._lock = threading.Lock()
+        # rotates which backend wins a tie, so idle backends share the load
+        self._next = 0
+        self._stop = threading.Event()
+        self._health_thread: threading.Thread | None = None
+        self.hedge = hedge
+        # recent successful instruct latencies, for the hedge delay
+        self._latencies: deque[float] = deque(maxlen=hedge.window if hedge else 0)
+        self._executor: ThreadPoolExecutor | None = None
+        if health_check_interval is not None:
+            self.start_health_checks()
+
+    def __enter__(self) -> "OobaClientPool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Stop health checks and close every backend's connections
+        """
+        self._stop.set()
+        if self._health_thread is not None:
+            self._health_thread.join()
+            self._health_thread = None
+        if self._executor is not None:
+            # attempts that lost a hedge are not waited for
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        for backend in self.backends:
+            backend.client.close()
+
+    def _acquire(self, exclude: Backend | None = None) -> Backend:
+        with self._lock:
+            count = len(self.backends)
+            candidates = [
+                self.backends[(self._next + offset) % count]
+                for offset in range(count)
+                if self.backends[(self._next + offset) % count].healthy
+                and self.backends[(self._next + offset) % count] is not exclude
+            ]
+            if not candidates:
+                raise NoHealthyBackends(
+                    "; ".join(f"{b.client.url}: {b.last_error}" for b in self.backends)
+                )
+            backend = min(candidates, key=lambda candidate: candidate.in_flight)
+            backend.in_flight += 1
+            self._next = (self._next + 1) % count
+            return backend
+
+    def _release(self, backend: Backend) -> None:
+        with self._lock:
+            backend.in_flight -= 1
+
+    def _eject(self, backend: Backend, reason: str) -> None:
+        if backend.healthy:
+            logger.warning(f"Ejecting backend {backend.client.url}: {reason}")
+        backend.healthy = False
+        backend.last_error = reason
+
+    def _hedge_delay(self) -> float | None:
+        # seconds to wait for the first attempt before hedging, None to not hedge
+        assert self.hedge is not None
+        with self._lock:
+            if len(self._latencies) < self.hedge.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return self.hedge.min_delay
+        return max(percentile(latencies, self.hedge.percentile), self.hedge.min_delay)
+
+    def _instruct_on(
+        self,
+        backend: Backend,
+        prompt: Prompt,
+        parameters: Parameters,
+        timeout: int | float,
+        print_prompt: bool,
+        deadline: Deadline | None,
+        priority: str,
+    ) -> str:
+        # sends to an acquired backend and releases it
+        start = time.perf_counter()
+        try:
+            text = backend.client.instruct(
+                prompt,
+                parameters,
+                timeout,
+                print_prompt,
+                deadline=deadline.cap(None) if deadline is not None else None,
+                priority=priority,
+            )
+        except requests.ConnectionError as exc:
+            self._eject(backend, repr(exc))
+            raise
+        finally:
+            self._release(backend)
+        if self.hedge is not None:
+            with self._lock:
+                self._latencies.append(time.perf_counter() - start)
+        return text
+
+    def instruct(
+        self,
+        prompt: Prompt,
+        parameters: Parameters = DEFAULT_PARAMETERS,
+        timeout: int | float = 500,
+        print_prompt: bool = False,
+        deadline: float | None = None,
+        priority: str = DEFAULT_PRIORITY,
+    ) -> str:
+        """
+        Provide an instruction to the least busy backend, get a response
+
+        With a hedge policy, an instruction still running after the hedge delay is also
+        sent to another backend, and the first answer is returned.
+
+        :param prompt: Prompt to provide an instruction
+        :param parameters: Generation parameters
+        :param timeout: When to timeout
+        :param print_prompt: Print the prompt being used. Use case is debugging
+        :param deadline: Seconds the whole call may take, across every backend tried
+        :param priority: Lane to wait for a request slot in, see OobaApiClient.instruct
+        :raises NoHealthyBackends: Every backend is ejected
+        :raises DeadlineExceeded: The deadline passed
+        """
+        budget = Deadline.after(deadline)
+        backend = self._acquire()
+        if self.hedge is None:
+            return self._instruct_on(
+                backend, prompt, parameters, timeout, print_prompt, budget, priority
+            )
+
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.hedge.max_workers, thread_name_prefix="ooba_api-hedge"
+                    )
+        attempt = functools.partial(
+            self._instruct_on,
+            prompt=prompt,
+            parameters=parameters,
+            timeout=timeout,
+            print_prompt=print_prompt,
+            deadline=budget,
+            priority=priority,
+        )
+        pending: set[Future[str]] = {self._executor.submit(attempt, backend)}
+        delay = self._hedge_delay()
+        if delay is not None:
+            if budget is not None:
+                delay = min(delay, max(budget.remaining(), 0))
+            done, pending = wait(pending, timeout=delay)
+            if not done:
+                try:
+                    second = self._acquire(exclude=backend)
+                except NoHealthyBackends:
+                    pass
+                else:
+                    logger.debug(f"Hedging request to {second.client.url} after {delay:.3f}s")
+                    pending.add(self._executor.submit(attempt, second))
+            pending |= done
+
+        # first success wins. The other attempt finishes in the background
+        error: BaseException | None = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = error or future.exception()
+        assert error is not None
+        raise error
+
+    def instruct_many(
+        self,
+        prompts: Iterable[Prompt],
+        parameters: Parameters = DEFAULT_PARAMETERS,
+        timeout: int | float = 500,
+        max_concurrency: int = 4,
+        priority: str = "batch",
+    ) -> list[BatchResult]:
+        """
+        Run many independent instructions in parallel, spread across the backends
+
+        :return: One result per prompt, in input order. Failed requests carry the error
+        """
+        instruct = functools.partial(
+            self.instruct, parameters=parameters, timeout=timeout, priority=priority
+        )
+        results = list(run_as_completed(instruct, prompts, max_concurrency))
+        results.sort(key=lambda result: result.index)
+        return results
+
+    def instruct_stream(
+        self,
+        prompt: Prompt,
+        parameters: Parameters = DEFAULT_PARAMETERS,
+        timeout: int | float = 500,
+        print_prompt: bool = False,
+        priority: str = DEFAULT_PRIORITY,
+    ) -> Iterator[StreamChunk]:
+        """
+        Stream an instruction from the least busy backend
+
+        :param priority: Lane to wait for a request slot in, see OobaApiClient.instruct
+        :yield: Chunks of generated text, with their arrival times
+        """
+        backend = self._acquire()
+        try:
+            yield from backend.client.instruct_stream(
+                prompt, parameters, timeout, print_prompt, priority
+            )
+        finally:
+            self._release(backend)
+
+    def check_health(self) -> None:
+        """
+        Ask every backend for its model info, ejecting or restoring backends
+        """
+        for backend in self.backends:
+            try:
+                model_info = backend.client.model_info()
+            except Exception as exc:
+                # an unexpected response counts as unhealthy too, the other backends are
+                # still checked
+                self._eject(backend, repr(exc))
+                continue
+            if isinstance(model_info, OobaModelNotLoaded):
+                self._eject(backend, "no model loaded")
+            elif not backend.healthy:
+                logger.info(f"Restoring backend {backend.client.url}")
+                backend.healthy = True
+                backend.last_error = None
+
+    def start_health_checks(self) -> None:
+        """
+        Run check_health in a background thread every health_check_interval seconds
+        """
+        if self._health_thread is not None:
+            return
+        if self.health_check_interval is None:
+            raise ValueError("health_check_interval is not set")
+        interval = self.health_check_interval
+        self._stop.clear()
+
+        def run() -> None:
+            while True:
+                try:
+                    self.check_health()
+                except Exception:
+                    # keep checking, or ejected backends would never be restored
+                    logger.exception("Health check failed")
+                if self._stop.wait(interval):
+                    return
+
+        self._health_thread = threading.Thread(
+            target=run, name="ooba_api-health-check", daemon=True
+        )
+        self._health_thread.start()
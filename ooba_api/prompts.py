@@ -1,18 +1,67 @@
+import string
 import textwrap
-from typing import TYPE_CHECKING
+from typing import Iterable, Iterator, Mapping, TypeVar
 
 import pydantic
 
-from ooba_api.pydantic_compat import USING_PYDANTIC_LEGACY
+from ooba_api.pydantic_compat import USING_PYDANTIC_LEGACY, construct_many
+
+PromptT = TypeVar("PromptT", bound="Prompt")
 
 
 class Prompt(pydantic.BaseModel):
     negative_prompt: str | None = None
     prompt: str
 
+    @classmethod
+    def bulk(cls: type[PromptT], rows: Iterable[str | dict], **fields) -> Iterator[PromptT]:
+        """
+        Build many prompts that share a template, validating the template once
+
+        The shared fields are validated once. The rows are trusted and not validated,
+        which skips pydantic's per-object validation. Prompts are built lazily, so the
+        result can go straight to instruct_many.
+
+        :param rows: Prompt texts, or dicts of the fields that differ per prompt, such as
+            prompt and negative_prompt
+        :param fields: Fields every prompt has, such as instruct_template
+        :raises ValueError: A row has no prompt, or a field the prompt class does not
+        """
+        return construct_many(cls(prompt="", **fields), map(_prompt_row, rows))
+
+    @classmethod
+    def from_columns(
+        cls: type[PromptT], columns: Mapping[str, Iterable], **fields
+    ) -> Iterator[PromptT]:
+        """
+        Same as bulk, but from columns of equal length
+
+        :param columns: Field name -> value per prompt, including "prompt"
+        :param fields: Fields every prompt has, such as instruct_template
+        :raises ValueError: The columns are not the same length
+        """
+        names = list(columns)
+        rows = (dict(zip(names, values)) for values in zip(*columns.values(), strict=True))
+        return cls.bulk(rows, **fields)
+
     def full_prompt(self) -> str:
         return self.prompt
 
+    def shared_prefix(self) -> str | None:
+        """
+        Start of the full prompt that is identical across every prompt built from the
+        same compiled template. None if the prompt was not built from one
+        """
+        return None
+
+
+def _prompt_row(row: str | dict) -> dict:
+    if isinstance(row, str):
+        return {"prompt": row}
+    if "prompt" not in row:
+        raise ValueError(f"Row has no prompt: {row!r}")
+    return row
+
 
 class InstructPrompt(Prompt):
     """
@@ -24,24 +73,75 @@ class InstructPrompt(Prompt):
     def full_prompt(self) -> str:
         return self.instruct_template.format(prompt=self.prompt)
 
+    @classmethod
+    def compile(cls, instruct_template: str = "{prompt}") -> "CompiledTemplate":
+        """
+        Parse an instruct template once, for building many prompts
 
-if not TYPE_CHECKING:
-    if USING_PYDANTIC_LEGACY:
-        Messages = pydantic.conlist(dict, min_items=1)
-    else:
-        Messages = pydantic.conlist(dict, min_length=1)
-else:
-    Messages = list
+        :param instruct_template: Template with a {prompt} field
+        """
+        return CompiledTemplate(instruct_template)
 
 
 class ChatPrompt(Prompt):
     """
-    Used for chat
+    Used for chat, through the chat endpoint
 
-    Not tested, not implemented, just placeholder
+    prompt is the new message from the user. messages is the history before it, as
+    {"role": "user" | "assistant", "content": ...} dicts. The server renders the history
+    with the character or instruction template.
     """
 
-    messages: Messages
+    # empty to start a conversation
+    messages: list[dict] = []
+
+    # "chat", "chat-instruct" or "instruct"
+    mode: str = "chat"
+
+    # character to talk to. None uses the server's default
+    character: str | None = None
+
+    # instruction template for the instruct modes. None uses the server's default
+    instruction_template: str | None = None
+
+    # name of the user in the rendered history
+    your_name: str = "You"
+
+    def history(self) -> list[list[str]]:
+        """
+        The messages as [user message, reply] rows, the shape the chat endpoint takes
+        """
+        rows: list[list[str]] = []
+        for message in self.messages:
+            if message["role"] == "user" or not rows or rows[-1][1]:
+                rows.append(["", ""])
+            rows[-1][0 if message["role"] == "user" else 1] = message["content"]
+        return rows
+
+    def chat_settings(self) -> dict:
+        return _chat_settings(
+            self.mode, self.character, self.instruction_template, self.your_name
+        )
+
+
+def _chat_settings(
+    mode: str, character: str | None, instruction_template: str | None, your_name: str
+) -> dict:
+    # settings left as None are not sent, so the server uses its defaults
+    settings = {
+        "mode": mode,
+        "character": character,
+        "instruction_template": instruction_template,
+        "your_name": your_name,
+    }
+    return {name: value for name, value in settings.items() if value is not None}
+
+
+LLAMA_INSTRUCT_TEMPLATE = textwrap.dedent(
+    """
+    [INST] <<SYS>> {system_prompt} <</SYS>> {user_prompt} [/INST]
+    """
+).strip()
 
 
 class LlamaInstructPrompt(Prompt):
@@ -50,13 +150,151 @@ class LlamaInstructPrompt(Prompt):
     """
 
     system_prompt: str = ""
-    instruct_template: str = textwrap.dedent(
-        """
-        [INST] <<SYS>> {system_prompt} <</SYS>> {user_prompt} [/INST]
-        """
-    ).strip()
+    instruct_template: str = LLAMA_INSTRUCT_TEMPLATE
 
     def full_prompt(self) -> str:
         return self.instruct_template.format(
             system_prompt=self.system_prompt, user_prompt=self.prompt
         )
+
+    @classmethod
+    def compile(
+        cls, system_prompt: str = "", instruct_template: str | None = None
+    ) -> "CompiledTemplate":
+        """
+        Parse the template once with a fixed system prompt, for building many prompts
+
+        :param system_prompt: System prompt, rendered into the shared prefix
+        :param instruct_template: Template with {system_prompt} and {user_prompt} fields.
+            Defaults to the llama template
+        """
+        if instruct_template is None:
+            instruct_template = LLAMA_INSTRUCT_TEMPLATE
+        return CompiledTemplate(
+            instruct_template, prompt_field="user_prompt", system_prompt=system_prompt
+        )
+
+
+class CompiledTemplate:
+    """
+    A prompt template parsed once, with its fixed fields already rendered
+
+    Everything before the prompt field is rendered into prefix, which is the same
+    string object for every prompt built from this template. Rendering a prompt only
+    formats the prompt field and joins the pieces.
+    """
+
+    # the template as given
+    template: str
+
+    # field filled in per prompt
+    prompt_field: str
+
+    # rendered template up to the prompt field
+    prefix: str
+
+    def __init__(self, template: str, prompt_field: str = "prompt", **fixed: str) -> None:
+        """
+        :param template: str.format style template
+        :param prompt_field: Name of the field filled in per prompt
+        :param fixed: Values for every other field in the template
+        :raises ValueError: A field other than prompt_field has no value, or the template
+            has no prompt_field
+        """
+        self.template = template
+        self.prompt_field = prompt_field
+
+        # (True, format string of one use of the prompt field) or (False, rendered text)
+        pieces: list[tuple[bool, str]] = []
+        for literal, field_name, format_spec, conversion in string.Formatter().parse(template):
+            if literal:
+                pieces.append((False, literal))
+            if field_name is None:
+                continue
+            if not field_name:
+                raise ValueError("Positional fields are not supported, name every field")
+            field = "{" + field_name + (f"!{conversion}" if conversion else "")
+            field += f":{format_spec}}}" if format_spec else "}"
+            if _root_name(field_name) == prompt_field:
+                pieces.append((True, field))
+            elif _root_name(field_name) in fixed:
+                pieces.append((False, field.format(**fixed)))
+            else:
+                raise ValueError(f"No value for template field {field_name!r}")
+
+        if not any(is_prompt for is_prompt, _ in pieces):
+            raise ValueError(f"Template has no {{{prompt_field}}} field")
+
+        # merge static runs, so each render is a handful of concatenations
+        merged: list[tuple[bool, str]] = []
+        for is_prompt, piece in pieces:
+            if merged and not is_prompt and not merged[-1][0]:
+                merged[-1] = (False, merged[-1][1] + piece)
+            else:
+                merged.append((is_prompt, piece))
+        self.prefix = "" if merged[0][0] else merged.pop(0)[1]
+        self._pieces = merged
+        self._plain_field = f"{{{prompt_field}}}"
+
+    def __repr__(self) -> str:
+        return f"CompiledTemplate({self.template!r}, prompt_field={self.prompt_field!r})"
+
+    def render(self, prompt: str) -> str:
+        """
+        Render the template for one prompt
+
+        :param prompt: Value of the prompt field
+        """
+        parts = [self.prefix]
+        for is_prompt, piece in self._pieces:
+            if not is_prompt:
+                parts.append(piece)
+            elif piece == self._plain_field:
+                parts.append(prompt)
+            else:
+                parts.append(piece.format(**{self.prompt_field: prompt}))
+        return "".join(parts)
+
+    def prompt(self, prompt: str, negative_prompt: str | None = None) -> "CompiledPrompt":
+        """
+        Build a prompt from this template
+
+        :param prompt: Value of the prompt field
+        :param negative_prompt: Negative prompt
+        """
+        return CompiledPrompt(prompt=prompt, negative_prompt=negative_prompt, template=self)
+
+    def prompts(self, rows: Iterable[str | dict]) -> Iterator["CompiledPrompt"]:
+        """
+        Build many prompts from this template, without validating each one
+
+        :param rows: Prompt texts, or dicts with prompt and negative_prompt
+        """
+        return CompiledPrompt.bulk(rows, template=self)
+
+
+def _root_name(field_name: str) -> str:
+    # "{a.b}" and "{a[0]}" both look up "a"
+    return field_name.partition(".")[0].partition("[")[0]
+
+
+class CompiledPrompt(Prompt):
+    """
+    Prompt built from a CompiledTemplate, see CompiledTemplate.prompt
+    """
+
+    template: CompiledTemplate
+
+    if USING_PYDANTIC_LEGACY:
+
+        class Config:
+            arbitrary_types_allowed = True
+
+    else:
+        model_config = pydantic.ConfigDict(arbitrary_types_allowed=True)
+
+    def full_prompt(self) -> str:
+        return self.template.render(self.prompt)
+
+    def shared_prefix(self) -> str | None:
+        return self.template.prefix
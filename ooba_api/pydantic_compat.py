@@ -1,5 +1,57 @@
-from distutils.version import LooseVersion
+from typing import Iterable, Iterator, TypeVar
 
 import pydantic
 
-USING_PYDANTIC_LEGACY = int(LooseVersion(pydantic.__version__).version[0]) < 2
+USING_PYDANTIC_LEGACY = int(pydantic.VERSION.split(".")[0]) < 2
+
+M = TypeVar("M", bound=pydantic.BaseModel)
+
+
+def _fields(cls: type[pydantic.BaseModel]) -> dict:
+    # pydantic compatibility. __fields__ -> model_fields, typed as an instance property
+    return getattr(cls, "__fields__" if USING_PYDANTIC_LEGACY else "model_fields")
+
+
+def field_names(cls: type[pydantic.BaseModel]) -> frozenset[str]:
+    return frozenset(_fields(cls))
+
+
+def construct(cls: type[M], values: dict) -> M:
+    # skip validation, the values were already validated, or deliberately set, on a model
+    if USING_PYDANTIC_LEGACY:
+        return cls.construct(**values)
+    return cls.model_construct(**values)
+
+
+def construct_many(template: M, rows: Iterable[dict]) -> Iterator[M]:
+    """
+    Copies of an already validated model, each with a few fields changed
+
+    The rows are trusted and not validated. On pydantic 2, model_construct costs more
+    than validating a small model, so models without private attributes are built by
+    setting their state directly, the same way model_construct ends up doing.
+
+    :param template: Model holding the values shared by every copy
+    :param rows: Fields that differ per copy
+    :raises ValueError: A row has a field the model does not
+    """
+    cls = type(template)
+    names = field_names(cls)
+    # in declaration order, like a validated model, so copies encode to the same bytes
+    shared = {name: getattr(template, name) for name in _fields(cls)}
+    direct = not USING_PYDANTIC_LEGACY and not cls.__private_attributes__
+    fields_set = template.__pydantic_fields_set__ if direct else set()
+    new = cls.__new__
+    set_state = object.__setattr__
+    for row in rows:
+        if not row.keys() <= names:
+            raise ValueError(f"Unknown {cls.__name__} fields {sorted(row.keys() - names)}")
+        if not direct:
+            yield construct(cls, shared | row)
+            continue
+        model = new(cls)
+        set_state(model, "__dict__", shared | row)
+        set_state(model, "__pydantic_fields_set__", fields_set | row.keys())
+        set_state(model, "__pydantic_extra__", None)
+        set_state(model, "__pydantic_private__", None)
+        yield model
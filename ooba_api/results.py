@@ -0,0 +1,59 @@
+from dataclasses import dataclass, field
+
+
+@dataclass
+class RequestTimings:
+    """
+    Where the time went for one request, in seconds
+    """
+
+    # waiting for a free slot from the client's concurrency limiter
+    queue_wait: float = 0.0
+
+    # opening the connection. 0 if a pooled connection was reused, None if unknown
+    connect: float | None = None
+
+    # from sending the request until the response headers arrived, including connect
+    time_to_first_byte: float | None = None
+
+    # parsing the response body
+    decode: float = 0.0
+
+    # the whole call, including queue wait and decode
+    total: float = 0.0
+
+
+@dataclass
+class InstructResult:
+    # generated text
+    text: str
+
+    # base URL of the server that generated the text
+    url: str
+
+    # length of the rendered prompt, in characters. None if the body was pre-encoded
+    prompt_length: int | None
+
+    # output tokens, if the server reported them
+    output_tokens: int | None = None
+
+    timings: RequestTimings = field(default_factory=RequestTimings)
+
+    @property
+    def output_length(self) -> int:
+        """
+        Length of the generated text, in characters
+        """
+        return len(self.text)
+
+    @property
+    def tokens_per_second(self) -> float | None:
+        """
+        Output tokens per second of request time, None if the server did not report tokens
+        """
+        if self.output_tokens is None:
+            return None
+        generation_time = self.timings.total - self.timings.queue_wait - self.timings.decode
+        if generation_time <= 0:
+            return None
+        return self.output_tokens / generation_time
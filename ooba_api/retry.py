@@ -0,0 +1,155 @@
+import random
+import time
+from dataclasses import dataclass
+
+import httpx
+import requests
+from urllib3.exceptions import NewConnectionError
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Raised when a call's deadline passes before it could finish
+    """
+
+
+class Deadline:
+    """
+    Time budget for a whole call, covering queueing, every attempt and the backoff between
+    """
+
+    def __init__(self, seconds: float) -> None:
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def after(cls, seconds: float | None) -> "Deadline | None":
+        """
+        Deadline in seconds from now, None if seconds is None
+        """
+        return cls(seconds) if seconds is not None else None
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def exceeded(self) -> DeadlineExceeded:
+        return DeadlineExceeded(f"Deadline of {self.seconds}s exceeded")
+
+    def cap(self, timeout: float | None) -> float:
+        """
+        The timeout, shortened to the time remaining
+
+        :raises DeadlineExceeded: No time remains
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise self.exceeded()
+        return remaining if timeout is None else min(timeout, remaining)
+
+
+def _never_sent(error: BaseException) -> bool:
+    # failed before the request reached the server, so any request is safe to repeat
+    if isinstance(error, (requests.ConnectTimeout, httpx.ConnectError, httpx.ConnectTimeout)):
+        return True
+    if isinstance(error, requests.ConnectionError) and error.args:
+        # requests wraps urllib3's MaxRetryError, refused connections have this reason
+        return isinstance(getattr(error.args[0], "reason", None), NewConnectionError)
+    return False
+
+
+@dataclass(frozen=True)
+class HedgePolicy:
+    """
+    When OobaClientPool sends a second attempt to another backend
+
+    Once the first attempt has taken longer than the given percentile of recent
+    latencies, the same request goes to another backend and whichever answers first
+    wins. The slower attempt still runs to completion on its backend.
+    """
+
+    # hedge attempts slower than this percentile of recent latencies, as a fraction
+    percentile: float = 0.95
+
+    # recent successful latencies the percentile is taken over
+    window: int = 200
+
+    # no hedging until this many latencies have been seen. With 0, min_delay is used
+    # until there are latencies
+    min_samples: int = 20
+
+    # never hedge sooner than this, in seconds
+    min_delay: float = 0.0
+
+    # threads running attempts, bounds the hedged requests in flight at once
+    max_workers: int = 64
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    When and how soon to retry a failed request
+
+    Idempotent requests (generate, model info, token counts) are retried on connection
+    errors, timeouts and retry_statuses. Loading a model is only retried when the
+    request never reached the server.
+    """
+
+    # attempts in total, including the first
+    max_attempts: int = 3
+
+    # seconds to wait before the first retry
+    backoff: float = 0.5
+
+    # each retry waits this many times longer than the last
+    backoff_multiplier: float = 2.0
+
+    # longest wait between attempts, in seconds
+    max_backoff: float = 30.0
+
+    # wait a random time up to the backoff, so clients that failed together spread out
+    jitter: bool = True
+
+    # responses with these statuses are retried
+    retry_statuses: frozenset[int] = frozenset({500, 502, 503, 504})
+
+    def backoff_for(self, attempt: int) -> float:
+        """
+        Seconds to wait after the given attempt failed
+
+        :param attempt: Attempt that failed, starting at 1
+        """
+        delay = min(self.backoff * self.backoff_multiplier ** (attempt - 1), self.max_backoff)
+        return random.uniform(0, delay) if self.jitter else delay
+
+    def retry_delay(
+        self,
+        attempt: int,
+        *,
+        error: BaseException | None = None,
+        status: int | None = None,
+        idempotent: bool = True,
+    ) -> float | None:
+        """
+        Seconds to wait before retrying, None if the request should not be retried
+
+        :param attempt: Attempt that failed, starting at 1
+        :param error: Exception the attempt raised
+        :param status: Status code the attempt got back
+        :param idempotent: Whether repeating the request is harmless
+        """
+        if attempt >= self.max_attempts:
+            return None
+        if error is not None:
+            retryable = _never_sent(error) or (
+                idempotent
+                and isinstance(
+                    error, (requests.ConnectionError, requests.Timeout, httpx.TransportError)
+                )
+            )
+        else:
+            retryable = idempotent and status in self.retry_statuses
+        return self.backoff_for(attempt) if retryable else None
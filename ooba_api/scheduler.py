@@ -0,0 +1,314 @@
+import itertools
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Iterable
+
+import requests
+
+from ooba_api.clients import OobaApiClient
+from ooba_api.model_info import OobaModelInfo
+from ooba_api.parameters import DEFAULT_PARAMETERS, Parameters
+from ooba_api.prompts import Prompt
+
+logger = logging.getLogger("ooba_api")
+
+
+@dataclass(frozen=True)
+class ModelKey:
+    """
+    A model and the loras loaded with it, as reported by model_info()
+    """
+
+    model_name: str
+
+    # sorted, so the order the loras were given in does not matter
+    lora_names: tuple[str, ...] = ()
+
+    @classmethod
+    def of(cls, model_info: OobaModelInfo) -> "ModelKey | None":
+        """
+        Key of the loaded model, None if no model is loaded
+        """
+        if model_info.model_name is None:
+            return None
+        return cls(model_info.model_name, tuple(sorted(model_info.lora_names)))
+
+
+@dataclass
+class ScheduledRequest:
+    prompt: Prompt
+
+    # model the request must run on
+    model: ModelKey
+
+    # load arguments, used if a backend has to switch to the model
+    args_dict: dict
+
+    parameters: Parameters
+
+    timeout: int | float
+
+    # submission order, the oldest waiting request is served first when switching
+    sequence: int
+
+    future: Future[str] = field(default_factory=Future)
+
+
+@dataclass
+class ModelBackend:
+    client: OobaApiClient
+
+    # model the backend has loaded or is switching to. None if unknown or not loaded
+    model: ModelKey | None = None
+
+    # requests served in a row for the current model, for the fairness cap
+    streak: int = 0
+
+    # times the backend loaded a model
+    switches: int = 0
+
+
+class ModelScheduler:
+    """
+    Runs requests that each need a particular model, keeping model switches rare
+
+    Loading a model takes minutes, so each backend drains every queued request for the
+    model it has loaded before loading another. Switching goes to the model with the
+    oldest waiting request, preferring models no other backend has. To keep a busy
+    model from starving the rest, a backend that has served max_consecutive requests in
+    a row switches once another model is waiting that no backend has loaded.
+
+    Each backend runs one request at a time, from its own worker thread. Workers start
+    on the first submit.
+    """
+
+    backends: list[ModelBackend]
+
+    # requests a backend serves in a row before yielding to a model nobody has loaded
+    max_consecutive: int
+
+    # seconds to allow for loading a model
+    load_timeout: int | float
+
+    def __init__(
+        self,
+        urls: Iterable[str],
+        *,
+        max_consecutive: int = 32,
+        load_timeout: int | float = 5000,
+        **client_kwargs,
+    ) -> None:
+        """
+        :param urls: Base URLs of the servers
+        :param max_consecutive: Requests a backend serves in a row before yielding to a
+            model no backend has loaded
+        :param load_timeout: Seconds to allow for loading a model
+        :param client_kwargs: Passed to each OobaApiClient
+        """
+        self.backends = [ModelBackend(OobaApiClient(url, **client_kwargs)) for url in urls]
+        if not self.backends:
+            raise ValueError("At least one backend URL is required")
+        if max_consecutive < 1:
+            raise ValueError("max_consecutive must be at least 1")
+        self.max_consecutive = max_consecutive
+        self.load_timeout = load_timeout
+
+        self._condition = threading.Condition()
+        # waiting requests by model, each in submission order
+        self._queues: dict[ModelKey, deque[ScheduledRequest]] = {}
+        self._sequence = itertools.count()
+        self._closed = False
+        self._workers: list[threading.Thread] = []
+        # backends whose loaded model is known, no work is routed until all are
+        self._discovered = 0
+
+    def __enter__(self) -> "ModelScheduler":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Finish every queued request, then stop the workers and close the clients
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.join()
+        # nothing ran them if no worker was started
+        for queue in self._queues.values():
+            for request in queue:
+                request.future.cancel()
+        self._queues.clear()
+        for backend in self.backends:
+            backend.client.close()
+
+    def submit(
+        self,
+        prompt: Prompt,
+        model_name: str,
+        args_dict: dict | None = None,
+        lora_names: Iterable[str] = (),
+        parameters: Parameters = DEFAULT_PARAMETERS,
+        timeout: int | float = 500,
+    ) -> Future[str]:
+        """
+        Queue an instruction that must run on the given model
+
+        :param prompt: Prompt to provide an instruction
+        :param model_name: Model the instruction must run on
+        :param args_dict: Load arguments, used if a backend has to switch to the model.
+            Loras are loaded through these arguments
+        :param lora_names: Loras that must be loaded with the model
+        :param parameters: Generation parameters
+        :param timeout: When to timeout the generation
+        :return: Future of the generated text
+        """
+        model = ModelKey(model_name, tuple(sorted(lora_names)))
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Cannot submit to a closed scheduler")
+            request = ScheduledRequest(
+                prompt=prompt,
+                model=model,
+                args_dict=args_dict or {},
+                parameters=parameters,
+                timeout=timeout,
+                sequence=next(self._sequence),
+            )
+            self._queues.setdefault(model, deque()).append(request)
+            self._start_workers()
+            self._condition.notify_all()
+        return request.future
+
+    def instruct(
+        self,
+        prompt: Prompt,
+        model_name: str,
+        args_dict: dict | None = None,
+        lora_names: Iterable[str] = (),
+        parameters: Parameters = DEFAULT_PARAMETERS,
+        timeout: int | float = 500,
+    ) -> str:
+        """
+        Run an instruction on the given model, waiting for the result
+
+        See submit() for the parameters.
+        """
+        return self.submit(
+            prompt, model_name, args_dict, lora_names, parameters, timeout
+        ).result()
+
+    def _start_workers(self) -> None:
+        if self._workers:
+            return
+        for backend in self.backends:
+            worker = threading.Thread(
+                target=self._work, args=(backend,), name="ooba_api-scheduler", daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def _served_elsewhere(self, model: ModelKey, backend: ModelBackend) -> bool:
+        return any(other.model == model for other in self.backends if other is not backend)
+
+    def _choose(self, backend: ModelBackend) -> ScheduledRequest | None:
+        # called with the condition held
+        waiting = [model for model, queue in self._queues.items() if queue]
+        unserved = [
+            model
+            for model in waiting
+            if model != backend.model and not self._served_elsewhere(model, backend)
+        ]
+        if backend.model in waiting and (backend.streak < self.max_consecutive or not unserved):
+            backend.streak += 1
+            return self._queues[backend.model].popleft()
+
+        # another backend already has these loaded, only help with a long queue
+        candidates = unserved or [
+            model
+            for model in waiting
+            if model != backend.model and len(self._queues[model]) > self.max_consecutive
+        ]
+        if not candidates:
+            return None
+        model = min(candidates, key=lambda candidate: self._queues[candidate][0].sequence)
+        backend.model = model
+        backend.streak = 1
+        return self._queues[model].popleft()
+
+    def _next_request(self, backend: ModelBackend) -> ScheduledRequest | None:
+        with self._condition:
+            while True:
+                if self._discovered < len(self.backends):
+                    self._condition.wait()
+                    continue
+                request = self._choose(backend)
+                if request is not None:
+                    # queues and loaded models changed, other workers may have work now
+                    self._condition.notify_all()
+                    return request
+                if self._closed and not any(self._queues.values()):
+                    return None
+                self._condition.wait()
+
+    def _work(self, backend: ModelBackend) -> None:
+        loaded = None
+        try:
+            loaded = ModelKey.of(backend.client.model_info())
+        except requests.RequestException as exc:
+            logger.warning(f"Could not get the model of {backend.client.url}: {exc!r}")
+        except Exception:
+            # an unexpected response, the model is unknown and loaded on first use
+            logger.exception(f"Could not get the model of {backend.client.url}")
+        finally:
+            with self._condition:
+                backend.model = loaded
+                self._discovered += 1
+                self._condition.notify_all()
+
+        while (request := self._next_request(backend)) is not None:
+            try:
+                loaded = self._serve(backend, request, loaded)
+            except Exception as exc:
+                # a bug here must neither strand the caller nor end the worker
+                logger.exception(f"Could not serve a request on {backend.client.url}")
+                if not request.future.done():
+                    request.future.set_exception(exc)
+
+    def _serve(
+        self, backend: ModelBackend, request: ScheduledRequest, loaded: ModelKey | None
+    ) -> ModelKey | None:
+        # runs the request, switching models if needed, and returns the loaded model
+        if not request.future.set_running_or_notify_cancel():
+            return loaded
+        try:
+            if request.model != loaded:
+                logger.info(
+                    f"Switching {backend.client.url} from "
+                    f"{loaded.model_name if loaded else None} to {request.model.model_name}"
+                )
+                # a failed load may leave the old model unloaded
+                loaded = None
+                backend.switches += 1
+                backend.client.load_model(
+                    request.model.model_name,
+                    args_dict=request.args_dict,
+                    timeout=self.load_timeout,
+                )
+                loaded = request.model
+            text = backend.client.instruct(request.prompt, request.parameters, request.timeout)
+        except Exception as exc:
+            request.future.set_exception(exc)
+            if loaded != request.model:
+                with self._condition:
+                    backend.model = loaded
+                    self._condition.notify_all()
+        else:
+            request.future.set_result(text)
+        return loaded
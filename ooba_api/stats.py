@@ -0,0 +1,49 @@
+import math
+from dataclasses import asdict, dataclass
+
+
+@dataclass
+class LatencySummary:
+    """
+    Distribution of request latencies, in seconds
+    """
+
+    count: int
+    mean: float
+    p50: float
+    p95: float
+    p99: float
+    max: float
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """
+    Nearest-rank percentile
+
+    :param sorted_values: Values in ascending order, at least one
+    :param fraction: Percentile as a fraction, 0.95 for p95
+    """
+    rank = max(math.ceil(fraction * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies: list[float]) -> LatencySummary:
+    """
+    Summarize latencies
+
+    :raises ValueError: No latencies were given
+    """
+    if not latencies:
+        raise ValueError("No latencies to summarize")
+    ordered = sorted(latencies)
+    return LatencySummary(
+        count=len(ordered),
+        mean=sum(ordered) / len(ordered),
+        p50=percentile(ordered, 0.50),
+        p95=percentile(ordered, 0.95),
+        p99=percentile(ordered, 0.99),
+        max=ordered[-1],
+    )
@@ -0,0 +1,113 @@
+"""
+Stop predicates, checked against the text streamed so far to end generation early
+
+Parameters.stopping_strings only matches literal strings on the server. A predicate is
+any callable taking the text generated so far and returning None to keep going, or the
+length of text to keep to stop. It runs after every chunk, so it should be quick.
+"""
+import re
+from dataclasses import dataclass
+from typing import Callable, Iterable
+
+# text generated so far -> None to keep generating, or the length of text to keep
+StopPredicate = Callable[[str], int | None]
+
+FENCE = "```"
+
+
+@dataclass(frozen=True)
+class RegexStop:
+    """
+    Stops once the pattern matches, keeping the text up to the end of the match
+    """
+
+    # regular expression to search the text for
+    pattern: str | re.Pattern[str]
+
+    # keep the matched text, otherwise cut before it
+    keep_match: bool = True
+
+    def __call__(self, text: str) -> int | None:
+        match = re.search(self.pattern, text)
+        if match is None:
+            return None
+        return match.end() if self.keep_match else match.start()
+
+
+@dataclass(frozen=True)
+class JsonObjectStop:
+    """
+    Stops once the first JSON object is closed, keeping the text up to its closing brace
+
+    Text before the opening brace is kept as well. Braces inside strings are skipped,
+    the object is not otherwise validated.
+    """
+
+    def __call__(self, text: str) -> int | None:
+        start = text.find("{")
+        if start < 0:
+            return None
+        depth = 0
+        in_string = False
+        escaped = False
+        for position in range(start, len(text)):
+            char = text[position]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char == "{":
+                depth += 1
+            elif char == "}":
+                depth -= 1
+                if depth == 0:
+                    return position + 1
+        return None
+
+
+@dataclass(frozen=True)
+class CodeFenceStop:
+    """
+    Stops once a fenced code block is closed, keeping the text up to the closing fence
+    """
+
+    # the prompt already opened the block, for example it ends with ```python, so the
+    # first fence generated closes it
+    opened: bool = False
+
+    def __call__(self, text: str) -> int | None:
+        start = 0
+        if not self.opened:
+            start = text.find(FENCE)
+            if start < 0:
+                return None
+            start += len(FENCE)
+        end = text.find(FENCE, start)
+        return None if end < 0 else end + len(FENCE)
+
+
+@dataclass
+class StopResult:
+    # generated text, cut where the predicate stopped it
+    text: str
+
+    # the predicate that stopped generation, None if the server finished first
+    stopped_by: StopPredicate | None
+
+
+def find_stop(text: str, predicates: Iterable[StopPredicate]) -> StopResult | None:
+    """
+    Check the text generated so far against each predicate, in order
+
+    :return: The text cut by the first predicate that fires, None if none do
+    """
+    for predicate in predicates:
+        end = predicate(text)
+        if end is not None:
+            return StopResult(text[:end], predicate)
+    return None
@@ -0,0 +1,77 @@
+import asyncio
+import json
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterator
+
+import websockets
+from websockets.sync.client import connect
+
+# seconds to wait for the websocket handshake
+STREAM_CONNECT_TIMEOUT = 5
+
+
+@dataclass
+class StreamChunk:
+    # text generated since the previous chunk
+    text: str
+
+    # position of the chunk in the stream, starting at 0
+    index: int
+
+    # time.perf_counter() when the chunk was received
+    arrival_time: float
+
+    # seconds between sending the request and receiving the chunk
+    elapsed: float
+
+
+def _stream_chunk(raw_message: str | bytes, index: int, start: float) -> StreamChunk | None:
+    """
+    Convert a message from the stream endpoint to a chunk. None means the stream ended
+    """
+    arrival_time = time.perf_counter()
+    message = json.loads(raw_message)
+    if message["event"] == "stream_end":
+        return None
+    return StreamChunk(
+        text=message["text"], index=index, arrival_time=arrival_time, elapsed=arrival_time - start
+    )
+
+
+def stream_generate(url: str, body: bytes, timeout: float) -> Iterator[StreamChunk]:
+    """
+    Stream a generate request over the webui websocket API
+
+    :param url: Full URL of the stream endpoint, for example ws://localhost:5005/api/v1/stream
+    :param body: Same JSON body as a generate request
+    :param timeout: Max seconds to wait between chunks
+    :yield: Chunks of text, as they arrive
+    """
+    with connect(url, open_timeout=STREAM_CONNECT_TIMEOUT) as websocket:
+        start = time.perf_counter()
+        # the webui only reads text frames
+        websocket.send(body.decode())
+        index = 0
+        while True:
+            raw_message = websocket.recv(timeout=timeout)
+            if (chunk := _stream_chunk(raw_message, index, start)) is None:
+                return
+            yield chunk
+            index += 1
+
+
+async def astream_generate(url: str, body: bytes, timeout: float) -> AsyncIterator[StreamChunk]:
+    """
+    Async version of stream_generate
+    """
+    async with websockets.connect(url, open_timeout=STREAM_CONNECT_TIMEOUT) as websocket:
+        start = time.perf_counter()
+        await websocket.send(body.decode())
+        index = 0
+        while True:
+            raw_message = await asyncio.wait_for(websocket.recv(), timeout)
+            if (chunk := _stream_chunk(raw_message, index, start)) is None:
+                return
+            yield chunk
+            index += 1
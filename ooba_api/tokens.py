@@ -0,0 +1,85 @@
+import threading
+from collections import OrderedDict
+
+from ooba_api.parameters import Parameters, _replace
+
+
+class PromptTooLong(ValueError):
+    """
+    Raised when a prompt leaves no room for generation within the truncation length
+    """
+
+    def __init__(self, prompt_tokens: int, truncation_length: int, min_new_tokens: int) -> None:
+        super().__init__(
+            f"Prompt is {prompt_tokens} tokens, leaving less than {min_new_tokens} new "
+            f"tokens within the truncation length of {truncation_length}"
+        )
+        self.prompt_tokens = prompt_tokens
+        self.truncation_length = truncation_length
+        self.min_new_tokens = min_new_tokens
+
+
+class TokenCountCache:
+    """
+    In-memory token counts by model name and text, evicting the least recently used
+    """
+
+    # max number of entries
+    maxsize: int
+
+    def __init__(self, maxsize: int = 4096) -> None:
+        self.maxsize = maxsize
+        self._entries: OrderedDict[tuple[str | None, str], int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, model_name: str | None, text: str) -> int | None:
+        with self._lock:
+            count = self._entries.get((model_name, text))
+            if count is not None:
+                self._entries.move_to_end((model_name, text))
+            return count
+
+    def set(self, model_name: str | None, text: str, count: int) -> None:
+        with self._lock:
+            self._entries[(model_name, text)] = count
+            self._entries.move_to_end((model_name, text))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+def max_new_tokens_for(
+    prompt_tokens: int, parameters: Parameters, min_new_tokens: int = 1
+) -> int:
+    """
+    Largest max_new_tokens that fits the prompt within the truncation length
+
+    The web UI cuts the start of the prompt when prompt tokens plus max_new_tokens
+    exceed the truncation length. This finds the limit before the request is sent.
+
+    :param prompt_tokens: Tokens in the rendered prompt
+    :param parameters: Generation parameters. max_new_tokens is kept if it already fits
+    :param min_new_tokens: Fewest new tokens worth generating
+    :raises PromptTooLong: Fewer than min_new_tokens fit
+    """
+    available = parameters.truncation_length - prompt_tokens
+    if available < min_new_tokens:
+        raise PromptTooLong(prompt_tokens, parameters.truncation_length, min_new_tokens)
+    return min(parameters.max_new_tokens, available)
+
+
+def fit_parameters(
+    prompt_tokens: int, parameters: Parameters, min_new_tokens: int = 1
+) -> Parameters:
+    """
+    Parameters with max_new_tokens lowered, if needed, so the prompt is not truncated
+
+    :return: parameters itself if it already fits, otherwise a copy of the same type
+    :raises PromptTooLong: Fewer than min_new_tokens fit
+    """
+    max_new_tokens = max_new_tokens_for(prompt_tokens, parameters, min_new_tokens)
+    if max_new_tokens == parameters.max_new_tokens:
+        return parameters
+    return _replace(parameters, max_new_tokens=max_new_tokens)
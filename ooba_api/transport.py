@@ -0,0 +1,318 @@
+import contextlib
+import socket
+import threading
+import time
+import weakref
+from http.cookiejar import DefaultCookiePolicy
+from typing import Protocol
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from ooba_api.results import RequestTimings
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# seconds the calling thread's last request spent opening a connection
+_connect_time = threading.local()
+
+# transport the calling thread is sending with, told about the connections it opens
+_sending_with = threading.local()
+
+
+def _opened(sock: socket.socket) -> None:
+    transport = getattr(_sending_with, "value", None)
+    if transport is not None:
+        transport._track(sock)
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self) -> None:
+        start = time.perf_counter()
+        super().connect()
+        _connect_time.value = time.perf_counter() - start
+        _opened(self.sock)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self) -> None:
+        start = time.perf_counter()
+        super().connect()
+        _connect_time.value = time.perf_counter() - start
+        _opened(self.sock)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    """
+    Records how long new connections take to open
+    """
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+class TransportAborted(Exception):
+    """
+    The request was sent on a transport that was aborted
+    """
+
+
+class Transport(Protocol):
+    """
+    Sends requests on behalf of a client. Implementations own any connection state
+    """
+
+    def post(
+        self, url: str, *, timeout: float, content: bytes, timings: RequestTimings | None = None
+    ) -> requests.Response:
+        ...
+
+    def close(self) -> None:
+        ...
+
+
+class RequestsTransport:
+    """
+    Transport backed by a pooled, keep-alive `requests.Session`
+
+    A single session is shared by every thread using the client. The underlying
+    urllib3 connection pool is thread-safe, and the session rejects cookies and holds
+    no auth state, so no additional locking is needed on the hot path.
+    """
+
+    # number of per-host connection pools to cache
+    pool_connections: int
+
+    # max connections kept alive per host. Should be at least the number of worker threads
+    pool_maxsize: int
+
+    # seconds to wait to establish a connection, separate from the read timeout
+    connect_timeout: float
+
+    def __init__(
+        self,
+        *,
+        pool_connections: int = 4,
+        pool_maxsize: int = 16,
+        connect_timeout: float = 5,
+        keep_alive: bool = True,
+    ) -> None:
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.connect_timeout = connect_timeout
+        self.keep_alive = keep_alive
+
+        self._session: requests.Session | None = None
+        self._session_lock = threading.Lock()
+        # sockets of the connections this transport opened, shut down by abort
+        self._sockets: weakref.WeakSet[socket.socket] = weakref.WeakSet()
+        self._aborted = False
+
+    def _create_session(self) -> requests.Session:
+        session = requests.Session()
+        # block=True waits for a free connection instead of opening (and discarding) extras
+        adapter = _TimedHTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=True,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers["Connection"] = "keep-alive" if self.keep_alive else "close"
+        # the API does not use cookies, and the jar would be shared state between threads
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        return session
+
+    @property
+    def session(self) -> requests.Session:
+        session = self._session
+        if session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._create_session()
+                session = self._session
+        return session
+
+    def post(
+        self, url: str, *, timeout: float, content: bytes, timings: RequestTimings | None = None
+    ) -> requests.Response:
+        """
+        POST a JSON body
+
+        :param url: Full URL to post to
+        :param timeout: Read timeout, in seconds
+        :param content: Encoded JSON body to send
+        :param timings: Filled in with connect time and time to first byte
+        :raises TransportAborted: abort() was called
+        """
+        if self._aborted:
+            raise TransportAborted("The transport was aborted")
+        _connect_time.value = 0.0
+        _sending_with.value = self
+        try:
+            response = self.session.post(
+                url, timeout=(self.connect_timeout, timeout), data=content, headers=JSON_HEADERS
+            )
+        finally:
+            _sending_with.value = None
+        if timings is not None:
+            timings.connect = _connect_time.value
+            # requests measures up to the response headers, before the body is read
+            timings.time_to_first_byte = response.elapsed.total_seconds()
+        return response
+
+    def close(self) -> None:
+        """
+        Close all pooled connections. The transport may be used again afterwards
+        """
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def abort(self) -> None:
+        """
+        Shut down every connection, so requests in flight fail with a ConnectionError
+
+        Later requests raise TransportAborted. Meant for a transport used by one group
+        of requests, such as the samples of instruct_first_valid.
+        """
+        with self._session_lock:
+            self._aborted = True
+            sockets = list(self._sockets)
+        for sock in sockets:
+            _shutdown(sock)
+        self.close()
+
+    def _track(self, sock: socket.socket) -> None:
+        with self._session_lock:
+            self._sockets.add(sock)
+            aborted = self._aborted
+        # opened while abort was running
+        if aborted:
+            _shutdown(sock)
+
+
+def _shutdown(sock: socket.socket) -> None:
+    # unlike close, wakes up a thread blocked reading from the socket
+    with contextlib.suppress(OSError):
+        sock.shutdown(socket.SHUT_RDWR)
+
+
+class AsyncTransport(Protocol):
+    """
+    Sends requests on behalf of an async client. Implementations own any connection state
+    """
+
+    async def post(
+        self, url: str, *, timeout: float, content: bytes, timings: RequestTimings | None = None
+    ) -> httpx.Response:
+        ...
+
+    async def close(self) -> None:
+        ...
+
+
+class HttpxTransport:
+    """
+    Async transport backed by a pooled, keep-alive `httpx.AsyncClient`
+
+    Safe to share between tasks on the same event loop.
+    """
+
+    # max connections open at once, across all hosts
+    max_connections: int
+
+    # max idle connections kept alive for reuse
+    max_keepalive_connections: int
+
+    # seconds to wait to establish a connection, separate from the read timeout
+    connect_timeout: float
+
+    def __init__(
+        self,
+        *,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        connect_timeout: float = 5,
+    ) -> None:
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.connect_timeout = connect_timeout
+
+        self._client: httpx.AsyncClient | None = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # no lock needed, there is no await between the check and the assignment
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                )
+            )
+        return self._client
+
+    async def post(
+        self, url: str, *, timeout: float, content: bytes, timings: RequestTimings | None = None
+    ) -> httpx.Response:
+        """
+        POST a JSON body
+
+        :param url: Full URL to post to
+        :param timeout: Read timeout, in seconds
+        :param content: Encoded JSON body to send
+        :param timings: Filled in with connect time and time to first byte
+        """
+        extensions = {}
+        if timings is not None:
+            timings.connect = 0.0
+            start = time.perf_counter()
+            connect_start = start
+
+            async def trace(event_name: str, info: dict) -> None:
+                nonlocal connect_start
+                now = time.perf_counter()
+                if event_name == "connection.connect_tcp.started":
+                    connect_start = now
+                elif event_name in (
+                    "connection.connect_tcp.complete",
+                    "connection.start_tls.complete",
+                ):
+                    timings.connect = now - connect_start
+                elif event_name.endswith(".receive_response_headers.complete"):
+                    timings.time_to_first_byte = now - start
+
+            extensions["trace"] = trace
+
+        return await self.client.post(
+            url,
+            timeout=httpx.Timeout(timeout, connect=self.connect_timeout),
+            content=content,
+            headers=JSON_HEADERS,
+            extensions=extensions,
+        )
+
+    async def close(self) -> None:
+        """
+        Close all pooled connections. The transport may be used again afterwards
+        """
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.aclose()
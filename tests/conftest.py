@@ -1,6 +1,7 @@
 # flake8: noqa: F401
 
 from sample_output import (
+    chat_output,
     generate_output,
     load_model_output,
     model_loaded_output,
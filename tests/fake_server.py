@@ -0,0 +1,247 @@
+"""
+Stand-in for the text generation web UI, serving the legacy HTTP and streaming APIs
+
+Used by the end to end tests and the benchmarks. Generation is simulated with a fixed
+latency and a tokens per second rate, and errors can be injected.
+"""
+import contextlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+from sample_output import (
+    generate_payload,
+    load_model_payload,
+    model_loaded_payload,
+    model_not_loaded_payload,
+)
+from websockets.exceptions import ConnectionClosed
+from websockets.sync.server import ServerConnection, serve
+
+# text of one generated token
+TOKEN = " token"
+
+
+class FakeWebUI:
+    """
+    Serves /api/v1/generate, /api/v1/chat, /api/v1/model, /api/v1/token-count,
+    /api/v1/stop-stream and the websocket stream
+
+    Use as a context manager. Each generate or chat request answers with
+    min(max_new_tokens, output_tokens) tokens.
+    """
+
+    # seconds before the first token, per request
+    latency: float
+
+    # simulated generation speed. None generates instantly
+    tokens_per_second: float | None
+
+    # max tokens generated per request
+    output_tokens: int
+
+    # fraction of HTTP requests answered with a 500
+    error_rate: float
+
+    # the next this many HTTP requests are answered with a 500, before error_rate applies
+    fail_next: int
+
+    # whether /api/v1/model reports a loaded model
+    model_loaded: bool
+
+    # requests generated at once, like a GPU's batch. More wait their turn. None is unlimited
+    capacity: int | None
+
+    # send usage.completion_tokens with each generation, like the OpenAI compatible API.
+    # The legacy API does not
+    report_usage: bool
+
+    def __init__(
+        self,
+        *,
+        latency: float = 0.0,
+        tokens_per_second: float | None = None,
+        output_tokens: int = 16,
+        error_rate: float = 0.0,
+        fail_next: int = 0,
+        model_loaded: bool = True,
+        capacity: int | None = None,
+        report_usage: bool = False,
+        seed: int = 0,
+    ) -> None:
+        """
+        :param latency: Seconds before the first token, per request
+        :param tokens_per_second: Simulated generation speed. None generates instantly
+        :param output_tokens: Max tokens generated per request
+        :param error_rate: Fraction of HTTP requests answered with a 500
+        :param fail_next: The next this many HTTP requests are answered with a 500
+        :param model_loaded: Whether /api/v1/model reports a loaded model
+        :param capacity: Requests generated at once. More wait their turn. None is unlimited
+        :param report_usage: Send usage.completion_tokens with each generation, which the
+            legacy API does not
+        :param seed: Seed for choosing which requests fail
+        """
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.error_rate = error_rate
+        self.fail_next = fail_next
+        self.model_loaded = model_loaded
+        self.capacity = capacity
+        self.report_usage = report_usage
+        self._generating = threading.Semaphore(capacity) if capacity else None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        # bumped by /api/v1/stop-stream, streams started before it end early
+        self._stops = 0
+        # request path -> bodies received, in order
+        self.requests: dict[str, list[dict]] = {}
+
+        self._http = _HTTPServer(("localhost", 0), _make_handler(self))
+        self._ws = serve(self._stream, "localhost", 0)
+        self._threads = [
+            # short poll, so shutdown does not wait half a second
+            threading.Thread(
+                target=self._http.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+            ),
+            threading.Thread(target=self._ws.serve_forever, daemon=True),
+        ]
+
+    @property
+    def url(self) -> str:
+        return f"http://localhost:{self._http.server_address[1]}"
+
+    @property
+    def stream_url(self) -> str:
+        return f"ws://localhost:{self._ws.socket.getsockname()[1]}"
+
+    def __enter__(self) -> "FakeWebUI":
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._http.shutdown()
+        self._http.server_close()
+        self._ws.shutdown()
+        for thread in self._threads:
+            thread.join()
+
+    def _record(self, path: str, body: dict) -> None:
+        with self._lock:
+            self.requests.setdefault(path, []).append(body)
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                return True
+            return self._random.random() < self.error_rate
+
+    def _token_count(self, body: dict) -> int:
+        return min(body.get("max_new_tokens", self.output_tokens), self.output_tokens)
+
+    def _token_delay(self) -> float:
+        return 1 / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def _generate(self, body: dict) -> dict:
+        tokens = self._token_count(body)
+        with self._generating or contextlib.nullcontext():
+            time.sleep(self.latency + tokens * self._token_delay())
+        payload = generate_payload()
+        payload["results"][0]["text"] = TOKEN * tokens
+        if self.report_usage:
+            payload["usage"] = {"completion_tokens": tokens}
+        return payload
+
+    def _chat(self, body: dict) -> dict:
+        reply = self._generate(body)["results"][0]["text"]
+        history = body["history"]
+        row = [body["user_input"], reply]
+        return {
+            "results": [
+                {
+                    "history": {
+                        "internal": history["internal"] + [row],
+                        "visible": history["visible"] + [row],
+                    }
+                }
+            ]
+        }
+
+    def _model(self, body: dict) -> dict:
+        if body.get("action") == "load":
+            return load_model_payload()
+        return model_loaded_payload() if self.model_loaded else model_not_loaded_payload()
+
+    def handle_post(self, path: str, body: dict) -> tuple[int, Any]:
+        self._record(path, body)
+        if self._should_fail():
+            return 500, {"error": "injected error"}
+        if path == "/api/v1/generate":
+            return 200, self._generate(body)
+        if path == "/api/v1/chat":
+            return 200, self._chat(body)
+        if path == "/api/v1/model":
+            return 200, self._model(body)
+        if path == "/api/v1/stop-stream":
+            with self._lock:
+                self._stops += 1
+            return 200, {"results": "success"}
+        if path == "/api/v1/token-count":
+            return 200, {"results": [{"tokens": len(body["prompt"].split())}]}
+        return 404, {"error": f"no route for {path}"}
+
+    def _stream(self, websocket: ServerConnection) -> None:
+        body = json.loads(websocket.recv())
+        self._record("/api/v1/stream", body)
+        stops = self._stops
+        time.sleep(self.latency)
+        tokens = self._token_count(body)
+        try:
+            for message_num in range(tokens):
+                if message_num:
+                    time.sleep(self._token_delay())
+                if self._stops != stops:
+                    tokens = message_num
+                    break
+                websocket.send(
+                    json.dumps(
+                        {"event": "text_stream", "message_num": message_num, "text": TOKEN}
+                    )
+                )
+            websocket.send(json.dumps({"event": "stream_end", "message_num": tokens}))
+        except ConnectionClosed:
+            # the client stopped reading
+            pass
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 resets connections when many clients connect at once
+    request_queue_size = 128
+
+
+def _make_handler(server: FakeWebUI) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # headers and body are written separately, avoid delayed ACK stalls
+        disable_nagle_algorithm = True
+
+        def do_POST(self) -> None:
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            status, payload = server.handle_post(self.path, body)
+            content = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args) -> None:
+            pass
+
+    return Handler
@@ -1,13 +1,24 @@
 import pytest
 
 
-@pytest.fixture()
-def generate_output() -> dict:
+def generate_payload() -> dict:
     return {"results": [{"text": "output text"}]}
 
 
-@pytest.fixture()
-def model_not_loaded_output() -> dict:
+def chat_payload() -> dict:
+    return {
+        "results": [
+            {
+                "history": {
+                    "internal": [["Hi", "Hello!"], ["Tell me a joke", "Why & how?"]],
+                    "visible": [["Hi", "Hello!"], ["Tell me a joke", "Why &amp; how?"]],
+                }
+            }
+        ]
+    }
+
+
+def model_not_loaded_payload() -> dict:
     return {
         "result": {
             "model_name": "None",
@@ -141,8 +152,7 @@ def model_not_loaded_output() -> dict:
     }
 
 
-@pytest.fixture()
-def model_loaded_output() -> dict:
+def model_loaded_payload() -> dict:
     return {
         "result": {
             "model_name": "codellama-7b-instruct.Q4_K_M.gguf",
@@ -284,8 +294,7 @@ def model_loaded_output() -> dict:
     }
 
 
-@pytest.fixture()
-def load_model_output() -> dict:
+def load_model_payload() -> dict:
     return {
         "result": {
             "model_name": "codellama-7b-instruct.Q4_K_M.gguf",
@@ -426,3 +435,31 @@ def load_model_output() -> dict:
             },
         }
     }
+
+
+# the payloads are plain functions, so the fake server can serve them outside of pytest
+
+
+@pytest.fixture()
+def generate_output() -> dict:
+    return generate_payload()
+
+
+@pytest.fixture()
+def chat_output() -> dict:
+    return chat_payload()
+
+
+@pytest.fixture()
+def model_not_loaded_output() -> dict:
+    return model_not_loaded_payload()
+
+
+@pytest.fixture()
+def model_loaded_output() -> dict:
+    return model_loaded_payload()
+
+
+@pytest.fixture()
+def load_model_output() -> dict:
+    return load_model_payload()
@@ -0,0 +1,150 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from ooba_api.async_clients import AsyncOobaApiClient
+from ooba_api.cache import LRUResponseCache
+from ooba_api.model_info import OobaModelInfo, OobaModelNotLoaded
+from ooba_api.parameters import Parameters
+from ooba_api.prompts import InstructPrompt
+from ooba_api.transport import HttpxTransport
+
+
+def _client_returning(status_code: int, body: dict, requests: list | None = None, **kwargs):
+    def handler(request: httpx.Request) -> httpx.Response:
+        if requests is not None:
+            requests.append(request)
+        return httpx.Response(status_code, json=body)
+
+    transport = HttpxTransport()
+    transport._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return AsyncOobaApiClient("http://host", transport=transport, **kwargs)
+
+
+class TestAsyncOobaApiClient:
+    def test_default_init(self) -> None:
+        client = AsyncOobaApiClient()
+
+        assert client.url == "http://localhost:5000"
+        assert client._generate_url == "http://localhost:5000/api/v1/generate"
+        assert client._model_url == "http://localhost:5000/api/v1/model"
+        assert isinstance(client.transport, HttpxTransport)
+
+    def test_context_manager_closes_owned_transport(self) -> None:
+        async def run() -> HttpxTransport:
+            async with AsyncOobaApiClient() as client:
+                transport = client.transport
+                assert isinstance(transport, HttpxTransport)
+                assert transport.client is not None
+            return transport
+
+        assert asyncio.run(run())._client is None
+
+    def test_count_tokens(self) -> None:
+        sent: list[httpx.Request] = []
+        client = _client_returning(200, {"results": [{"tokens": 7}]}, sent)
+        client._loaded_model = OobaModelInfo(
+            model_name="model", lora_names=[], shared_settings={}, shared_args={}
+        )
+
+        async def run() -> list[int]:
+            return [await client.count_tokens("text"), await client.count_tokens("text")]
+
+        assert asyncio.run(run()) == [7, 7]
+        assert len(sent) == 1
+        assert str(sent[0].url) == "http://host/api/v1/token-count"
+        assert json.loads(sent[0].content) == {"prompt": "text"}
+
+    class TestInstruct:
+        def test_returns_text_body(self, generate_output: dict) -> None:
+            sent: list[httpx.Request] = []
+            client = _client_returning(200, generate_output, sent)
+
+            value = asyncio.run(client.instruct(InstructPrompt(prompt="a prompt")))
+
+            assert value == "output text"
+            assert str(sent[0].url) == "http://host/api/v1/generate"
+            body = json.loads(sent[0].content)
+            assert body["prompt"] == "a prompt"
+            assert body["negative_prompt"] == ""
+            assert body["max_new_tokens"] == 128
+
+        def test_uses_cache_with_fixed_seed(self, generate_output: dict) -> None:
+            sent: list[httpx.Request] = []
+            client = _client_returning(200, generate_output, sent, cache=LRUResponseCache())
+            client._loaded_model = OobaModelInfo(
+                model_name="model", lora_names=[], shared_settings={}, shared_args={}
+            )
+            prompt = InstructPrompt(prompt="a prompt")
+
+            async def run() -> list[str]:
+                return [
+                    await client.instruct(prompt, Parameters(seed=1)),
+                    await client.instruct(prompt, Parameters(seed=1)),
+                ]
+
+            assert asyncio.run(run()) == ["output text", "output text"]
+            assert len(sent) == 1
+
+        def test_instruct_result(self, generate_output: dict) -> None:
+            client = _client_returning(200, generate_output)
+
+            result = asyncio.run(client.instruct_result(InstructPrompt(prompt="a prompt")))
+
+            assert result.text == "output text"
+            assert result.url == "http://host"
+            assert result.prompt_length == len("a prompt")
+            assert result.output_tokens is None
+            assert result.tokens_per_second is None
+            assert result.timings.total >= result.timings.queue_wait >= 0
+
+        def test_raises_for_bad_status(self) -> None:
+            client = _client_returning(400, {})
+
+            with pytest.raises(httpx.HTTPStatusError):
+                asyncio.run(client.instruct(InstructPrompt(prompt="a prompt")))
+
+        def test_concurrent_requests(self, generate_output: dict) -> None:
+            client = _client_returning(200, generate_output, one_at_a_time=False)
+
+            async def run() -> list[str]:
+                return await asyncio.gather(
+                    *(client.instruct(InstructPrompt(prompt=str(i))) for i in range(10))
+                )
+
+            assert asyncio.run(run()) == ["output text"] * 10
+
+    class TestModelInfo:
+        def test_when_not_loaded(self, model_not_loaded_output: dict) -> None:
+            client = _client_returning(200, model_not_loaded_output)
+
+            result = asyncio.run(client.model_info())
+
+            assert isinstance(result, OobaModelNotLoaded)
+            assert result.shared_args
+            assert result.shared_settings
+
+        def test_when_loaded(self, model_loaded_output: dict) -> None:
+            client = _client_returning(200, model_loaded_output)
+
+            result: OobaModelInfo = asyncio.run(client.model_info())
+
+            assert result.model_name == "codellama-7b-instruct.Q4_K_M.gguf"
+
+    class TestLoadModel:
+        def test_load_model(self, load_model_output: dict) -> None:
+            sent: list[httpx.Request] = []
+            client = _client_returning(200, load_model_output, sent)
+
+            result = asyncio.run(
+                client.load_model("codellama-7b-instruct.Q4_K_M.gguf", args_dict={"n_ctx": 2500})
+            )
+
+            assert result.model_name == "codellama-7b-instruct.Q4_K_M.gguf"
+            assert json.loads(sent[0].content) == {
+                "action": "load",
+                "model_name": "codellama-7b-instruct.Q4_K_M.gguf",
+                "args": {"n_ctx": 2500},
+            }
@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from megamock import Mega, MegaMock
+
+from ooba_api.async_clients import AsyncOobaApiClient
+from ooba_api.batch import arun_as_completed, run_as_completed
+from ooba_api.clients import OobaApiClient
+from ooba_api.prompts import Prompt
+
+
+def _prompts(count: int) -> list[Prompt]:
+    return [Prompt(prompt=str(i)) for i in range(count)]
+
+
+def _instruct(prompt: Prompt, **kwargs) -> str:
+    if prompt.prompt == "3":
+        raise ValueError("bad prompt")
+    # later prompts finish first
+    time.sleep(0.001 * (10 - int(prompt.prompt)))
+    return f"output {prompt.prompt}"
+
+
+async def _ainstruct(prompt: Prompt, **kwargs) -> str:
+    if prompt.prompt == "3":
+        raise ValueError("bad prompt")
+    await asyncio.sleep(0.001 * (10 - int(prompt.prompt)))
+    return f"output {prompt.prompt}"
+
+
+class TestRunAsCompleted:
+    def test_runs_every_prompt(self) -> None:
+        results = list(run_as_completed(_instruct, _prompts(10), max_concurrency=4))
+
+        assert sorted(result.index for result in results) == list(range(10))
+
+    def test_captures_errors(self) -> None:
+        results = {r.index: r for r in run_as_completed(_instruct, _prompts(10), 4)}
+
+        assert not results[3].ok
+        assert isinstance(results[3].error, ValueError)
+        assert results[3].text is None
+        assert results[4].ok
+        assert results[4].text == "output 4"
+
+    def test_bounded_parallelism(self) -> None:
+        in_flight = 0
+        peak = 0
+        lock = threading.Lock()
+
+        def instruct(prompt: Prompt) -> str:
+            nonlocal in_flight, peak
+            with lock:
+                in_flight += 1
+                peak = max(peak, in_flight)
+            time.sleep(0.005)
+            with lock:
+                in_flight -= 1
+            return ""
+
+        list(run_as_completed(instruct, _prompts(20), max_concurrency=3))
+
+        assert peak == 3
+
+    def test_pulls_prompts_lazily(self) -> None:
+        pulled = 0
+
+        def prompts():
+            nonlocal pulled
+            for prompt in _prompts(100):
+                pulled += 1
+                yield prompt
+
+        results = run_as_completed(_instruct, prompts(), max_concurrency=2)
+        next(results)
+        results.close()
+
+        assert pulled <= 3
+
+
+class TestArunAsCompleted:
+    def test_captures_errors(self) -> None:
+        async def run() -> dict:
+            return {r.index: r async for r in arun_as_completed(_ainstruct, _prompts(10), 4)}
+
+        results = asyncio.run(run())
+
+        assert sorted(results) == list(range(10))
+        assert isinstance(results[3].error, ValueError)
+        assert results[4].text == "output 4"
+
+
+class TestInstructMany:
+    def test_results_in_input_order(self) -> None:
+        client = MegaMock.it(OobaApiClient)
+        Mega(client.instruct_many).use_real_logic()
+        Mega(client.instruct_many_as_completed).use_real_logic()
+        client.instruct.side_effect = _instruct
+
+        results = client.instruct_many(_prompts(10), max_concurrency=4)
+
+        assert [result.index for result in results] == list(range(10))
+        assert [result.text for result in results if result.ok][:3] == [
+            "output 0",
+            "output 1",
+            "output 2",
+        ]
+        assert not results[3].ok
+
+    @pytest.mark.parametrize("max_concurrency", [1, 5])
+    def test_async_results_in_input_order(self, max_concurrency: int) -> None:
+        client = AsyncOobaApiClient()
+        client.instruct = _ainstruct  # type: ignore
+
+        results = asyncio.run(client.instruct_many(_prompts(10), max_concurrency=max_concurrency))
+
+        assert [result.index for result in results] == list(range(10))
+        assert results[9].text == "output 9"
+        assert not results[3].ok
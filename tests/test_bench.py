@@ -0,0 +1,89 @@
+import json
+from pathlib import Path
+
+import pytest
+from fake_server import FakeWebUI
+
+from ooba_api.bench import load_prompts, main, parameter_grid
+
+
+def test_parameter_grid() -> None:
+    grid = parameter_grid(["max_new_tokens=64,128", "temperature=0.2,0.7", "seed=1"])
+
+    assert grid == [
+        {"max_new_tokens": 64, "temperature": 0.2, "seed": 1},
+        {"max_new_tokens": 64, "temperature": 0.7, "seed": 1},
+        {"max_new_tokens": 128, "temperature": 0.2, "seed": 1},
+        {"max_new_tokens": 128, "temperature": 0.7, "seed": 1},
+    ]
+    assert parameter_grid([]) == [{}]
+    with pytest.raises(ValueError, match="Unknown parameter"):
+        parameter_grid(["max_tokens=64"])
+
+
+def test_load_prompts(tmp_path: Path) -> None:
+    path = tmp_path / "prompts.txt"
+    path.write_text('plain prompt\n\n{"prompt": "json prompt", "negative_prompt": "no"}\n')
+
+    prompts = load_prompts(path)
+
+    assert [prompt.prompt for prompt in prompts] == ["plain prompt", "json prompt"]
+    assert prompts[1].negative_prompt == "no"
+
+
+class TestMain:
+    def test_reports_table_and_json(self, tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+        output = tmp_path / "results.json"
+        with FakeWebUI(output_tokens=4) as server:
+            main(
+                [
+                    "--url",
+                    server.url,
+                    "--concurrency",
+                    "1,2",
+                    "--duration",
+                    "0.1",
+                    "--param",
+                    "max_new_tokens=2,4",
+                    "--json",
+                    str(output),
+                ]
+            )
+
+        table = capsys.readouterr().out
+        assert "codellama-7b-instruct.Q4_K_M.gguf (loader: ctransformers" in table
+        assert "max_new_tokens=2" in table
+        results = json.loads(output.read_text())
+        assert results["model"]["n_ctx"] == 2500
+        assert [(run["concurrency"], run["parameters"]) for run in results["runs"]] == [
+            (1, {"max_new_tokens": 2}),
+            (2, {"max_new_tokens": 2}),
+            (1, {"max_new_tokens": 4}),
+            (2, {"max_new_tokens": 4}),
+        ]
+        first = results["runs"][0]
+        assert first["requests"] > 0
+        assert first["errors"] == 0
+        assert first["output_tokens"] == first["requests"] * 2
+        assert first["latency"]["p99"] >= first["latency"]["p50"]
+
+    def test_streaming_measures_time_to_first_token(self, capsys: pytest.CaptureFixture) -> None:
+        with FakeWebUI(output_tokens=4) as server:
+            main(
+                [
+                    "--url",
+                    server.url,
+                    "--stream-url",
+                    server.stream_url,
+                    "--duration",
+                    "0.1",
+                    "--stream",
+                    "--json",
+                    "-",
+                ]
+            )
+
+        run = json.loads(capsys.readouterr().out)["runs"][0]
+        assert run["time_to_first_token"]["p50"] <= run["latency"]["p50"]
+        # counted by the server's token-count endpoint, one token per word
+        assert run["output_tokens"] == run["requests"] * 4
@@ -0,0 +1,83 @@
+import time
+
+from ooba_api.cache import LRUResponseCache, SQLiteResponseCache, cache_key
+
+
+class TestCacheKey:
+    def test_stable(self) -> None:
+        assert cache_key(b'{"prompt":"a","seed":1}', "model") == cache_key(
+            b'{"prompt":"a","seed":1}', "model"
+        )
+
+    def test_depends_on_request_and_model(self) -> None:
+        key = cache_key(b'{"prompt":"a","seed":1}', "model")
+
+        assert key != cache_key(b'{"prompt":"b","seed":1}', "model")
+        assert key != cache_key(b'{"prompt":"a","seed":2}', "model")
+        assert key != cache_key(b'{"prompt":"a","seed":1}', "other model")
+        assert key != cache_key(b'{"prompt":"a","seed":1}', None)
+
+    def test_ignores_field_order_and_layout(self) -> None:
+        key = cache_key(b'{"prompt":"a","seed":1}', "model")
+
+        assert key == cache_key(b'{"seed":1,"prompt":"a"}', "model")
+        assert key == cache_key(b'{"prompt": "a", "seed": 1}', "model")
+
+
+class TestLRUResponseCache:
+    def test_get_and_set(self) -> None:
+        cache = LRUResponseCache()
+
+        assert cache.get("key") is None
+        cache.set("key", "value")
+        assert cache.get("key") == "value"
+
+    def test_evicts_least_recently_used(self) -> None:
+        cache = LRUResponseCache(maxsize=2)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        cache.get("a")
+
+        cache.set("c", "3")
+
+        assert len(cache) == 2
+        assert cache.get("a") == "1"
+        assert cache.get("b") is None
+        assert cache.get("c") == "3"
+
+    def test_ttl(self) -> None:
+        cache = LRUResponseCache(ttl=0.01)
+        cache.set("key", "value")
+
+        time.sleep(0.02)
+
+        assert cache.get("key") is None
+        assert len(cache) == 0
+
+
+class TestSQLiteResponseCache:
+    def test_survives_reopening(self, tmp_path) -> None:
+        path = tmp_path / "cache.sqlite"
+        cache = SQLiteResponseCache(path)
+        cache.set("key", "value")
+        cache.close()
+
+        reopened = SQLiteResponseCache(path)
+
+        assert reopened.get("key") == "value"
+        assert reopened.get("missing") is None
+
+    def test_overwrites(self, tmp_path) -> None:
+        cache = SQLiteResponseCache(tmp_path / "cache.sqlite")
+        cache.set("key", "value")
+        cache.set("key", "new value")
+
+        assert cache.get("key") == "new value"
+
+    def test_ttl(self, tmp_path) -> None:
+        cache = SQLiteResponseCache(tmp_path / "cache.sqlite", ttl=0.01)
+        cache.set("key", "value")
+
+        time.sleep(0.02)
+
+        assert cache.get("key") is None
@@ -0,0 +1,122 @@
+import asyncio
+import json
+from typing import Iterator
+
+import pytest
+from fake_server import TOKEN, FakeWebUI
+
+from ooba_api.async_clients import AsyncOobaApiClient
+from ooba_api.chat import AsyncConversation, ChatHistory, Conversation
+from ooba_api.clients import OobaApiClient
+from ooba_api.codecs import StdlibJsonCodec
+from ooba_api.parameters import Parameters
+from ooba_api.tokens import PromptTooLong
+
+# the fake server counts words, so each turn below is 2 + 4 tokens
+PARAMETERS = Parameters(max_new_tokens=4, truncation_length=30)
+
+
+@pytest.fixture()
+def server() -> Iterator[FakeWebUI]:
+    with FakeWebUI(output_tokens=4) as server:
+        yield server
+
+
+class TestChatHistory:
+    def test_encoded(self) -> None:
+        history = ChatHistory(StdlibJsonCodec())
+        assert json.loads(history.encoded()) == {"internal": [], "visible": []}
+
+        history.append("hi", "hello", 2)
+        history.append("how are you", "fine", 4)
+
+        assert json.loads(history.encoded()) == {
+            "internal": [["hi", "hello"], ["how are you", "fine"]],
+            "visible": [["hi", "hello"], ["how are you", "fine"]],
+        }
+        assert history.tokens == 6
+
+    def test_drop_oldest(self) -> None:
+        history = ChatHistory(StdlibJsonCodec())
+        history.append("hi", "hello", 2)
+        history.append("how are you", "fine", 4)
+
+        assert history.drop_oldest() == ("hi", "hello")
+        assert history.turns == [("how are you", "fine")]
+        assert history.tokens == 4
+        assert len(history) == 1
+
+
+class TestConversation:
+    def test_keeps_history(self, server: FakeWebUI) -> None:
+        with OobaApiClient(server.url) as client:
+            conversation = Conversation(client, PARAMETERS, mode="instruct")
+
+            assert conversation.say("hello there") == TOKEN * 4
+            conversation.say("and again")
+
+        first, second = server.requests["/api/v1/chat"]
+        assert first["history"]["internal"] == []
+        assert second["history"]["internal"] == [["hello there", TOKEN * 4]]
+        assert second["mode"] == "instruct"
+        assert conversation.history.turns == [
+            ("hello there", TOKEN * 4),
+            ("and again", TOKEN * 4),
+        ]
+
+    def test_drops_oldest_turns_over_budget(self, server: FakeWebUI) -> None:
+        with OobaApiClient(server.url) as client:
+            conversation = Conversation(client, PARAMETERS)
+            for turn in range(6):
+                conversation.say(f"message {turn}")
+
+        # 30 tokens, less 4 for the reply and 2 for the message, leaves 4 turns
+        assert [len(body["history"]["internal"]) for body in server.requests["/api/v1/chat"]] == [
+            0,
+            1,
+            2,
+            3,
+            4,
+            4,
+        ]
+        assert conversation.dropped_turns == 1
+        assert conversation.history.turns[0][0] == "message 1"
+
+    def test_rejects_message_over_budget(self, server: FakeWebUI) -> None:
+        with OobaApiClient(server.url) as client:
+            conversation = Conversation(client, PARAMETERS)
+            conversation.extend([("earlier message", "earlier reply")])
+
+            with pytest.raises(PromptTooLong):
+                conversation.say("word " * 27)
+
+        assert "/api/v1/chat" not in server.requests
+        assert conversation.history.turns == [("earlier message", "earlier reply")]
+
+    def test_extend(self, server: FakeWebUI) -> None:
+        with OobaApiClient(server.url) as client:
+            conversation = Conversation(client, PARAMETERS)
+            conversation.extend([("earlier message", "earlier reply")])
+            conversation.say("hello there")
+
+        assert server.requests["/api/v1/chat"][0]["history"]["internal"] == [
+            ["earlier message", "earlier reply"]
+        ]
+        assert conversation.history.tokens == 4 + 6
+
+
+class TestAsyncConversation:
+    def test_drops_oldest_turns_over_budget(self, server: FakeWebUI) -> None:
+        async def run() -> AsyncConversation:
+            async with AsyncOobaApiClient(server.url) as client:
+                conversation = AsyncConversation(client, PARAMETERS)
+                await conversation.extend([("earlier message", "earlier reply")])
+                for turn in range(5):
+                    assert await conversation.say(f"message {turn}") == TOKEN * 4
+                return conversation
+
+        conversation = asyncio.run(run())
+
+        # the 4 token earlier turn goes first
+        assert conversation.dropped_turns == 1
+        assert len(server.requests["/api/v1/chat"][-1]["history"]["internal"]) == 4
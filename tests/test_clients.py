@@ -1,13 +1,25 @@
 import json
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import pytest
 import requests
 from megamock import Mega, MegaMock
+from pytest_mock import MockerFixture
 
-from ooba_api.clients import OobaApiClient
+from ooba_api.cache import LRUResponseCache
+from ooba_api.clients import OobaApiClient, _service_time
+from ooba_api.coalesce import SingleFlight
+from ooba_api.codecs import StdlibJsonCodec
+from ooba_api.limits import ConcurrencyLimiter
 from ooba_api.model_info import OobaModelInfo, OobaModelNotLoaded
-from ooba_api.prompts import InstructPrompt
+from ooba_api.parameters import Parameters
+from ooba_api.prompts import ChatPrompt, InstructPrompt, LlamaInstructPrompt
+from ooba_api.results import InstructResult, RequestTimings
+from ooba_api.tokens import PromptTooLong, TokenCountCache
+from ooba_api.transport import RequestsTransport
 
 
 class TestOobaApiClient:
@@ -19,17 +31,78 @@ class TestOobaApiClient:
         assert client._generate_url == "http://localhost:5000/api/v1/generate"
         assert client.api_key is None
 
+    def test_limiters_are_shared_by_url(self) -> None:
+        client = OobaApiClient("http://shared-host")
+        same_server = OobaApiClient("http://shared-host")
+        other_server = OobaApiClient("http://other-host")
+
+        assert client._generate_limiter is same_server._generate_limiter
+        assert client._model_limiter is same_server._model_limiter
+        assert client._generate_limiter is not client._model_limiter
+        assert client._generate_limiter is not other_server._generate_limiter
+
+    def test_one_at_a_time(self) -> None:
+        assert OobaApiClient("http://one-host")._generate_limiter.limit == 1
+        assert (
+            OobaApiClient("http://many-host", one_at_a_time=False)._generate_limiter.limit is None
+        )
+        assert OobaApiClient("http://four-host", max_concurrency=4)._generate_limiter.limit == 4
+
+    def test_explicit_limit_applies_to_shared_limiter(self) -> None:
+        first = OobaApiClient("http://later-host")
+        second = OobaApiClient("http://later-host", max_concurrency=8, max_model_concurrency=2)
+        third = OobaApiClient("http://later-host")
+
+        assert first.concurrency_limit == second.concurrency_limit == 8
+        assert third.concurrency_limit == 8
+        assert first._model_limiter.limit == 2
+
+    def test_context_manager_closes_owned_transport(self) -> None:
+        transport = MegaMock.it(RequestsTransport)
+        client = OobaApiClient()
+        client.transport = transport
+
+        with client as entered:
+            assert entered is client
+
+        transport.close.assert_called_once_with()
+
+    def test_does_not_close_provided_transport(self) -> None:
+        transport = MegaMock.it(RequestsTransport)
+        client = OobaApiClient(transport=transport)
+
+        client.close()
+
+        transport.close.assert_not_called()
+
+    def test_post_uses_transport(self) -> None:
+        transport = MegaMock.it(RequestsTransport)
+        client = OobaApiClient(transport=transport, codec=StdlibJsonCodec())
+
+        client._post("http://host/api/v1/model", 5, {"action": "info"})
+
+        transport.post.assert_called_once_with(
+            "http://host/api/v1/model", timeout=5, content=b'{"action":"info"}', timings=None
+        )
+
     class TestInstruct:
         @pytest.fixture(autouse=True)
         def setup(self) -> None:
             self.client = MegaMock.it(OobaApiClient)
             Mega(self.client.instruct).use_real_logic()
+            Mega(self.client._generate).use_real_logic()
+            Mega(self.client._raise_for_status).use_real_logic()
+            self.client._generate_limiter = ConcurrencyLimiter(None)
             self.client._generate_url = "http://host/api/v1/generate"
+            self.client.url = "http://host"
+            self.client.cache = None
+            self.client._single_flight = None
+            self.client.codec = StdlibJsonCodec()
 
         def test_returns_text_body(self, generate_output: dict) -> None:
             prompt = InstructPrompt(prompt="a prompt")
             response = MegaMock.it(requests.Response)
-            response.json.return_value = generate_output
+            response.content = json.dumps(generate_output).encode()
             self.client._post.return_value = response
 
             value = self.client.instruct(prompt=prompt)
@@ -41,7 +114,7 @@ class TestOobaApiClient:
         ) -> None:
             prompt = InstructPrompt(prompt="a prompt")
             response = MegaMock.it(requests.Response)
-            response.json.return_value = generate_output
+            response.content = json.dumps(generate_output).encode()
             self.client._post.return_value = response
 
             self.client.instruct(prompt=prompt)
@@ -51,7 +124,7 @@ class TestOobaApiClient:
         def test_print_prompt(self, generate_output: dict, capsys: pytest.CaptureFixture) -> None:
             prompt = InstructPrompt(prompt="a prompt")
             response = MegaMock.it(requests.Response)
-            response.json.return_value = generate_output
+            response.content = json.dumps(generate_output).encode()
             self.client._post.return_value = response
 
             self.client.instruct(prompt=prompt, print_prompt=True)
@@ -70,12 +143,101 @@ class TestOobaApiClient:
             with pytest.raises(requests.HTTPError):
                 self.client.instruct(prompt=prompt)
 
+        def test_uses_cache_with_fixed_seed(self, generate_output: dict) -> None:
+            prompt = InstructPrompt(prompt="a prompt")
+            response = MegaMock.it(requests.Response)
+            response.content = json.dumps(generate_output).encode()
+            self.client._post.return_value = response
+            self.client._model_name.return_value = "model"
+            self.client.cache = LRUResponseCache()
+
+            first = self.client.instruct(prompt=prompt, parameters=Parameters(seed=1))
+            second = self.client.instruct(prompt=prompt, parameters=Parameters(seed=1))
+
+            assert first == second == "output text"
+            self.client._post.assert_called_once()
+
+        def test_cache_bypassed_for_random_seed(self, generate_output: dict) -> None:
+            prompt = InstructPrompt(prompt="a prompt")
+            response = MegaMock.it(requests.Response)
+            response.content = json.dumps(generate_output).encode()
+            self.client._post.return_value = response
+            self.client._model_name.return_value = "model"
+            self.client.cache = LRUResponseCache()
+
+            self.client.instruct(prompt=prompt)
+            self.client.instruct(prompt=prompt)
+            assert self.client._post.call_count == 2
+
+            self.client.instruct(prompt=prompt, cache_random_seed=True)
+            self.client.instruct(prompt=prompt, cache_random_seed=True)
+            assert self.client._post.call_count == 3
+
+        def test_coalesces_identical_requests(self, generate_output: dict) -> None:
+            prompt = InstructPrompt(prompt="a prompt")
+            response = MegaMock.it(requests.Response)
+            response.content = json.dumps(generate_output).encode()
+            release = threading.Event()
+
+            def post(*args, **kwargs) -> requests.Response:
+                release.wait()
+                return response
+
+            self.client._post.side_effect = post
+            self.client._model_name.return_value = "model"
+            self.client._single_flight = SingleFlight()
+
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                futures = [
+                    pool.submit(self.client.instruct, prompt, Parameters(seed=1))
+                    for _ in range(4)
+                ]
+                time.sleep(0.05)
+                release.set()
+
+            assert [future.result() for future in futures] == ["output text"] * 4
+            self.client._post.assert_called_once()
+
+        def test_instruct_result(self, generate_output: dict) -> None:
+            prompt = InstructPrompt(prompt="a prompt")
+            response = MegaMock.it(requests.Response)
+            response.content = json.dumps(
+                generate_output | {"usage": {"completion_tokens": 2}}
+            ).encode()
+            self.client._post.return_value = response
+            Mega(self.client.instruct_result).use_real_logic()
+
+            result = self.client.instruct_result(prompt=prompt)
+
+            assert result.text == "output text"
+            assert result.url == "http://host"
+            assert result.prompt_length == len("a prompt")
+            assert result.output_length == len("output text")
+            assert result.output_tokens == 2
+            assert result.timings.total >= result.timings.decode >= 0
+            timings = self.client._post.call_args.kwargs["timings"]
+            assert timings is result.timings
+
+        def test_skips_debug_formatting_when_disabled(
+            self, generate_output: dict, caplog: pytest.LogCaptureFixture, mocker: MockerFixture
+        ) -> None:
+            response = MegaMock.it(requests.Response)
+            response.content = json.dumps(generate_output).encode()
+            self.client._post.return_value = response
+            caplog.set_level(logging.WARNING, "ooba_api")
+            dumps = mocker.spy(json, "dumps")
+
+            self.client.instruct(prompt=InstructPrompt(prompt="a prompt"))
+
+            assert all("indent" not in call.kwargs for call in dumps.call_args_list)
+            assert caplog.records == []
+
         def test_logs_prompt(
             self, generate_output: dict, caplog: pytest.LogCaptureFixture
         ) -> None:
             prompt = InstructPrompt(prompt="a prompt")
             response = MegaMock.it(requests.Response)
-            response.json.return_value = generate_output
+            response.content = json.dumps(generate_output).encode()
             self.client._post.return_value = response
             caplog.set_level(logging.DEBUG, "ooba_api")
 
@@ -87,17 +249,126 @@ class TestOobaApiClient:
             assert records[1].name == "ooba_api"
             assert records[1].msg == json.dumps(generate_output, indent=2)
 
+    class TestCountTokens:
+        @pytest.fixture(autouse=True)
+        def setup(self) -> None:
+            self.client = MegaMock.it(OobaApiClient)
+            Mega(self.client.count_tokens).use_real_logic()
+            Mega(self.client.count_prompt_tokens).use_real_logic()
+            Mega(self.client.fit_parameters).use_real_logic()
+            self.client._token_count_url = "http://host/api/v1/token-count"
+            self.client.codec = StdlibJsonCodec()
+            self.client.token_cache = TokenCountCache()
+            self.client._model_name.return_value = "model"
+
+        def _respond_with_length(self) -> None:
+            def post(url: str, timeout: float, data: dict) -> requests.Response:
+                response = MegaMock.it(requests.Response)
+                response.content = json.dumps(
+                    {"results": [{"tokens": len(data["prompt"])}]}
+                ).encode()
+                return response
+
+            self.client._post.side_effect = post
+
+        def test_counts_and_caches(self) -> None:
+            self._respond_with_length()
+
+            assert self.client.count_tokens("four") == 4
+            assert self.client.count_tokens("four") == 4
+
+            self.client._post.assert_called_once_with(
+                "http://host/api/v1/token-count", 30, {"prompt": "four"}
+            )
+
+        def test_counts_shared_prefix_once(self) -> None:
+            self._respond_with_length()
+            template = LlamaInstructPrompt.compile(system_prompt="system")
+
+            first = self.client.count_prompt_tokens(template.prompt("first"))
+            second = self.client.count_prompt_tokens(template.prompt("second"))
+
+            assert first == len(template.prompt("first").full_prompt())
+            assert second == len(template.prompt("second").full_prompt())
+            sent = [call.args[2]["prompt"] for call in self.client._post.call_args_list]
+            assert sent == [template.prefix, "first [/INST]", "second [/INST]"]
+
+        def test_fit_parameters(self) -> None:
+            self._respond_with_length()
+            prompt = InstructPrompt(prompt="x" * 90)
+
+            parameters = self.client.fit_parameters(
+                prompt, Parameters(max_new_tokens=50, truncation_length=100)
+            )
+
+            assert parameters.max_new_tokens == 10
+            with pytest.raises(PromptTooLong):
+                self.client.fit_parameters(
+                    prompt, Parameters(truncation_length=100), min_new_tokens=20
+                )
+
+    class TestChat:
+        @pytest.fixture(autouse=True)
+        def setup(self) -> None:
+            self.client = MegaMock.it(OobaApiClient)
+            Mega(self.client.chat).use_real_logic()
+            Mega(self.client.chat_encoded).use_real_logic()
+            Mega(self.client._raise_for_status).use_real_logic()
+            self.client._chat_url = "http://host/api/v1/chat"
+            self.client.codec = StdlibJsonCodec()
+
+        def test_sends_history_and_returns_reply(self, chat_output: dict) -> None:
+            response = MegaMock.it(requests.Response)
+            response.content = json.dumps(chat_output).encode()
+            self.client._post.return_value = response
+            prompt = ChatPrompt(
+                prompt="Tell me a joke",
+                messages=[
+                    {"role": "user", "content": "Hi"},
+                    {"role": "assistant", "content": "Hello!"},
+                ],
+                mode="instruct",
+            )
+
+            reply = self.client.chat(prompt, Parameters(max_new_tokens=7))
+
+            # the internal history, not the HTML escaped one
+            assert reply == "Why & how?"
+            args, kwargs = Mega(self.client._post).call_args
+            assert args == ("http://host/api/v1/chat",)
+            body = json.loads(kwargs["data"])
+            assert body["user_input"] == "Tell me a joke"
+            assert body["history"] == {
+                "internal": [["Hi", "Hello!"]],
+                "visible": [["Hi", "Hello!"]],
+            }
+            assert body["mode"] == "instruct"
+            assert "character" not in body
+            assert body["max_new_tokens"] == 7
+
+        def test_starts_a_conversation(self, chat_output: dict) -> None:
+            response = MegaMock.it(requests.Response)
+            response.content = json.dumps(chat_output).encode()
+            self.client._post.return_value = response
+
+            self.client.chat(ChatPrompt(prompt="Hi"))
+
+            body = json.loads(Mega(self.client._post).call_args.kwargs["data"])
+            assert body["history"] == {"internal": [], "visible": []}
+
     class TestModelInfo:
         @pytest.fixture(autouse=True)
         def setup(self) -> None:
             self.client = MegaMock.it(OobaApiClient)
             Mega(self.client.model_info).use_real_logic()
             Mega(self.client._model_api).use_real_logic()
+            Mega(self.client._set_loaded_model).use_real_logic()
             self.client._model_url = "http://host/api/v1/model"
+            self.client.codec = StdlibJsonCodec()
 
         def test_when_not_loaded(self, model_not_loaded_output: dict) -> None:
             response = MegaMock.it(requests.Response)
-            response.json.return_value = model_not_loaded_output
+            response.content = json.dumps(model_not_loaded_output).encode()
             self.client._post.return_value = response
 
             result: OobaModelNotLoaded = self.client.model_info()
@@ -108,11 +379,13 @@ class TestOobaApiClient:
 
         def test_when_loaded(self, model_loaded_output: dict) -> None:
             response = MegaMock.it(requests.Response)
-            response.json.return_value = model_loaded_output
+            response.content = json.dumps(model_loaded_output).encode()
             self.client._post.return_value = response
 
             result: OobaModelInfo = self.client.model_info()
 
+            assert self.client._loaded_model is result
+
             assert result.model_name == "codellama-7b-instruct.Q4_K_M.gguf"
             # lora, at least creating one, is broken at the time of this writing
             assert result.lora_names == ["todo-actual-value"]
@@ -125,11 +398,13 @@ class TestOobaApiClient:
             self.client = MegaMock.it(OobaApiClient)
             Mega(self.client.load_model).use_real_logic()
             Mega(self.client._model_api).use_real_logic()
+            Mega(self.client._set_loaded_model).use_real_logic()
             self.client._model_url = "http://host/api/v1/model"
+            self.client.codec = StdlibJsonCodec()
 
         def test_load_model(self, load_model_output) -> None:
             response = MegaMock.it(requests.Response)
-            response.json.return_value = load_model_output
+            response.content = json.dumps(load_model_output).encode()
             self.client._post.return_value = response
 
             result: OobaModelInfo = self.client.load_model(
@@ -148,3 +423,23 @@ class TestOobaApiClient:
             assert result.lora_names == []
             assert result.shared_args
             assert result.shared_settings
+
+
+class TestServiceTime:
+    def test_per_reported_token(self) -> None:
+        timings = RequestTimings(queue_wait=1.0, decode=0.5, total=3.5)
+        result = InstructResult("text", "http://host", 4, output_tokens=4, timings=timings)
+
+        assert _service_time(result) == 0.5
+
+    def test_estimates_tokens_without_usage(self) -> None:
+        # the legacy API's response shape, 16 characters are about 4 tokens
+        timings = RequestTimings(total=2.0)
+        result = InstructResult("x" * 16, "http://host", 4, timings=timings)
+
+        assert _service_time(result) == 0.5
+
+    def test_empty_output(self) -> None:
+        result = InstructResult("", "http://host", 4, timings=RequestTimings(total=2.0))
+
+        assert _service_time(result) == 2.0
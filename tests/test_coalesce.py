@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ooba_api.coalesce import AsyncSingleFlight, SingleFlight
+from ooba_api.retry import Deadline, DeadlineExceeded
+
+
+class TestSingleFlight:
+    def test_identical_calls_share_one_call(self) -> None:
+        single_flight: SingleFlight[str] = SingleFlight()
+        calls = 0
+        release = threading.Event()
+
+        def call() -> str:
+            nonlocal calls
+            calls += 1
+            release.wait()
+            return "result"
+
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            futures = [pool.submit(single_flight.do, "key", call) for _ in range(5)]
+            time.sleep(0.05)
+            release.set()
+            results = [future.result() for future in futures]
+
+        assert results == ["result"] * 5
+        assert calls == 1
+
+    def test_different_keys_do_not_share(self) -> None:
+        single_flight: SingleFlight[str] = SingleFlight()
+
+        assert single_flight.do("a", lambda: "a") == "a"
+        assert single_flight.do("b", lambda: "b") == "b"
+
+    def test_calls_again_once_finished(self) -> None:
+        single_flight: SingleFlight[int] = SingleFlight()
+        calls = iter(range(10))
+
+        assert single_flight.do("key", lambda: next(calls)) == 0
+        assert single_flight.do("key", lambda: next(calls)) == 1
+
+    def test_exception_is_shared(self) -> None:
+        single_flight: SingleFlight[str] = SingleFlight()
+        release = threading.Event()
+
+        def call() -> str:
+            release.wait()
+            raise ValueError("failed")
+
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            futures = [pool.submit(single_flight.do, "key", call) for _ in range(3)]
+            time.sleep(0.05)
+            release.set()
+            for future in futures:
+                with pytest.raises(ValueError):
+                    future.result()
+
+    def test_follower_waits_until_its_deadline(self) -> None:
+        single_flight: SingleFlight[str] = SingleFlight()
+        release = threading.Event()
+
+        def call() -> str:
+            release.wait()
+            return "result"
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            leader = pool.submit(single_flight.do, "key", call)
+            time.sleep(0.05)
+            start = time.monotonic()
+            with pytest.raises(DeadlineExceeded):
+                single_flight.do("key", call, Deadline(0.05))
+            waited = time.monotonic() - start
+            release.set()
+
+            assert leader.result() == "result"
+        assert waited < 0.5
+
+
+class TestAsyncSingleFlight:
+    def test_identical_calls_share_one_call(self) -> None:
+        single_flight: AsyncSingleFlight[str] = AsyncSingleFlight()
+        calls = 0
+
+        async def call() -> str:
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "result"
+
+        async def run() -> list[str]:
+            return await asyncio.gather(*(single_flight.do("key", call) for _ in range(5)))
+
+        assert asyncio.run(run()) == ["result"] * 5
+        assert calls == 1
+
+    def test_cancelled_caller_does_not_cancel_others(self) -> None:
+        single_flight: AsyncSingleFlight[str] = AsyncSingleFlight()
+
+        async def call() -> str:
+            await asyncio.sleep(0.01)
+            return "result"
+
+        async def run() -> str:
+            first = asyncio.create_task(single_flight.do("key", call))
+            second = asyncio.create_task(single_flight.do("key", call))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+
+        assert asyncio.run(run()) == "result"
+
+    def test_caller_waits_until_its_deadline(self) -> None:
+        single_flight: AsyncSingleFlight[str] = AsyncSingleFlight()
+
+        async def call() -> str:
+            await asyncio.sleep(0.1)
+            return "result"
+
+        async def run() -> str:
+            leader = asyncio.ensure_future(single_flight.do("key", call))
+            await asyncio.sleep(0)
+            with pytest.raises(DeadlineExceeded):
+                await single_flight.do("key", call, Deadline(0.01))
+            return await leader
+
+        assert asyncio.run(run()) == "result"
@@ -0,0 +1,32 @@
+import json
+
+import pytest
+
+from ooba_api.codecs import OrjsonCodec, StdlibJsonCodec, default_codec
+
+
+class TestStdlibJsonCodec:
+    def test_round_trip(self) -> None:
+        codec = StdlibJsonCodec()
+        data = {"prompt": "héllo", "seed": 1, "stop": ["\n"]}
+
+        assert codec.loads(codec.dumps(data)) == data
+
+    def test_compact_and_unescaped(self) -> None:
+        assert StdlibJsonCodec().dumps({"a": [1, "é"]}) == '{"a":[1,"é"]}'.encode()
+
+
+class TestOrjsonCodec:
+    def test_matches_stdlib(self) -> None:
+        pytest.importorskip("orjson")
+        data = {"prompt": "héllo", "temperature": 0.7, "stop": ["\n"], "seed": -1}
+
+        assert OrjsonCodec().dumps(data) == StdlibJsonCodec().dumps(data)
+        assert OrjsonCodec().loads(b'{"a":1}') == {"a": 1}
+
+
+def test_default_codec_falls_back_to_stdlib(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setitem(__import__("sys").modules, "orjson", None)
+
+    assert isinstance(default_codec(), StdlibJsonCodec)
+    assert json.loads(default_codec().dumps({"a": 1})) == {"a": 1}
@@ -0,0 +1,411 @@
+import asyncio
+import time
+from typing import Iterator
+
+import httpx
+import pytest
+import requests
+from fake_server import TOKEN, FakeWebUI
+
+from ooba_api.async_clients import AsyncOobaApiClient
+from ooba_api.cache import LRUResponseCache
+from ooba_api.clients import OobaApiClient
+from ooba_api.fanout import NoValidSample, Sample
+from ooba_api.limits import AdaptiveLimit
+from ooba_api.model_info import OobaModelInfo, OobaModelNotLoaded
+from ooba_api.parameters import Parameters
+from ooba_api.prompts import InstructPrompt
+from ooba_api.retry import DeadlineExceeded, RetryPolicy
+from ooba_api.stopping import RegexStop, StopResult
+
+NO_WAIT = RetryPolicy(backoff=0, jitter=False)
+
+
+@pytest.fixture()
+def server() -> Iterator[FakeWebUI]:
+    with FakeWebUI(output_tokens=4) as server:
+        yield server
+
+
+class TestOobaApiClient:
+    def test_instruct(self, server: FakeWebUI) -> None:
+        with OobaApiClient(server.url) as client:
+            result = client.instruct_result(InstructPrompt(prompt="a prompt"))
+
+        assert result.text == TOKEN * 4
+        # the legacy API does not report usage
+        assert result.output_tokens is None
+        assert result.timings.connect is not None and result.timings.connect > 0
+        assert server.requests["/api/v1/generate"][0]["prompt"] == "a prompt"
+
+    def test_reported_usage(self) -> None:
+        with FakeWebUI(output_tokens=4, report_usage=True) as server, OobaApiClient(
+            server.url
+        ) as client:
+            result = client.instruct_result(InstructPrompt(prompt="a prompt"))
+
+        assert result.output_tokens == 4
+
+    def test_max_new_tokens_limits_output(self, server: FakeWebUI) -> None:
+        with OobaApiClient(server.url) as client:
+            text = client.instruct(
+                InstructPrompt(prompt="a prompt"), Parameters(max_new_tokens=2)
+            )
+
+        assert text == TOKEN * 2
+
+    def test_model_info(self, server: FakeWebUI) -> None:
+        with OobaApiClient(server.url) as client:
+            assert client.model_info().model_name == "codellama-7b-instruct.Q4_K_M.gguf"
+            server.model_loaded = False
+            assert isinstance(client.model_info(), OobaModelNotLoaded)
+
+    def test_count_tokens(self, server: FakeWebUI) -> None:
+        with OobaApiClient(server.url) as client:
+            assert client.count_tokens("three little words") == 3
+
+    def test_injected_errors_raise(self) -> None:
+        with FakeWebUI(error_rate=1.0) as server, OobaApiClient(server.url) as client:
+            with pytest.raises(requests.HTTPError):
+                client.instruct(InstructPrompt(prompt="a prompt"))
+
+    def test_retries_server_errors(self, server: FakeWebUI) -> None:
+        server.fail_next = 2
+        with OobaApiClient(server.url, retry=NO_WAIT) as client:
+            text = client.instruct(InstructPrompt(prompt="a prompt"))
+
+        assert text == TOKEN * 4
+        assert len(server.requests["/api/v1/generate"]) == 3
+
+    def test_gives_up_after_max_attempts(self, server: FakeWebUI) -> None:
+        server.fail_next = 3
+        with OobaApiClient(server.url, retry=NO_WAIT) as client:
+            with pytest.raises(requests.HTTPError):
+                client.instruct(InstructPrompt(prompt="a prompt"))
+
+        assert len(server.requests["/api/v1/generate"]) == 3
+
+    def test_does_not_retry_loading_a_model(self, server: FakeWebUI) -> None:
+        server.fail_next = 1
+        with OobaApiClient(server.url, retry=NO_WAIT) as client:
+            with pytest.raises(requests.HTTPError):
+                client.load_model("other-model", args_dict={})
+
+        assert len(server.requests["/api/v1/model"]) == 1
+
+    def test_deadline(self) -> None:
+        with FakeWebUI(latency=1) as server, OobaApiClient(server.url, retry=NO_WAIT) as client:
+            with pytest.raises(DeadlineExceeded):
+                client.instruct(InstructPrompt(prompt="a prompt"), deadline=0.1)
+
+    def test_adaptive_limit_grows_and_backs_off(self) -> None:
+        # how the limit settles under load is covered by tests/test_limits.py, without
+        # depending on timing
+        with FakeWebUI(output_tokens=4) as server, OobaApiClient(
+            server.url, adaptive=AdaptiveLimit(window=5)
+        ) as client:
+            # the first window sets the baseline, and one at a time uses the whole limit
+            for _ in range(50):
+                client.instruct(InstructPrompt(prompt="a prompt"))
+                if client.concurrency_limit == 2:
+                    break
+            assert client.concurrency_limit == 2
+
+            server.fail_next = 1
+            with pytest.raises(requests.HTTPError):
+                client.instruct(InstructPrompt(prompt="a prompt"))
+            assert client.concurrency_limit == 1
+
+    def test_priority_lanes(self, server: FakeWebUI) -> None:
+        with OobaApiClient(server.url) as client:
+            client.instruct(InstructPrompt(prompt="a prompt"))
+            client.instruct_many([InstructPrompt(prompt="a prompt")] * 2)
+            with pytest.raises(ValueError, match="Unknown priority"):
+                client.instruct(InstructPrompt(prompt="a prompt"), priority="urgent")
+
+            stats = client.lane_stats()
+
+        assert stats["interactive"].admitted == 1
+        assert stats["batch"].admitted == 2
+
+    def test_instruct_stream(self, server: FakeWebUI) -> None:
+        client = OobaApiClient(server.url, stream_url=server.stream_url)
+
+        chunks = list(client.instruct_stream(InstructPrompt(prompt="a prompt")))
+
+        assert "".join(chunk.text for chunk in chunks) == TOKEN * 4
+        assert server.requests["/api/v1/stream"][0]["prompt"] == "a prompt"
+
+    def test_instruct_samples(self, server: FakeWebUI) -> None:
+        with OobaApiClient(server.url, max_concurrency=4) as client:
+            samples = client.instruct_samples(
+                InstructPrompt(prompt="a prompt"), Parameters(seed=5, max_new_tokens=2), n=3
+            )
+            best = client.instruct_best_of(
+                InstructPrompt(prompt="a prompt"),
+                len,
+                [Parameters(max_new_tokens=2), Parameters(max_new_tokens=3)],
+            )
+
+        assert [sample.text for sample in samples] == [TOKEN * 2] * 3
+        assert [sample.parameters.seed for sample in samples] == [5, 6, 7]
+        assert sorted(body["seed"] for body in server.requests["/api/v1/generate"][:3]) == [
+            5,
+            6,
+            7,
+        ]
+        assert (best.index, best.text) == (1, TOKEN * 3)
+
+    def test_instruct_first_valid(self) -> None:
+        with FakeWebUI(latency=0.05) as server, OobaApiClient(
+            server.url, max_concurrency=4
+        ) as client:
+            sample = client.instruct_first_valid(
+                InstructPrompt(prompt="a prompt"),
+                lambda text: TOKEN in text,
+                n=4,
+                stop_server=True,
+            )
+
+            assert sample.text == TOKEN * 16
+            # the other samples were still running when the first passed
+            assert len(server.requests["/api/v1/stop-stream"]) == 1
+
+    def test_instruct_first_valid_aborts_the_rest(self) -> None:
+        with FakeWebUI(output_tokens=60, tokens_per_second=20) as server, OobaApiClient(
+            server.url, max_concurrency=2
+        ) as client:
+            start = time.monotonic()
+            sample = client.instruct_first_valid(
+                InstructPrompt(prompt="a prompt"),
+                lambda text: True,
+                [Parameters(max_new_tokens=2), Parameters(max_new_tokens=60)],
+            )
+
+            assert sample.index == 0
+            # the second sample, three seconds long, gives up its slot without finishing
+            while client._generate_limiter.in_flight and time.monotonic() - start < 1.5:
+                time.sleep(0.01)
+            assert client._generate_limiter.in_flight == 0
+
+    def test_samples_skip_the_cache(self, server: FakeWebUI) -> None:
+        cache = LRUResponseCache()
+        with OobaApiClient(server.url, max_concurrency=4, cache=cache, coalesce=True) as client:
+            client.instruct_first_valid(
+                InstructPrompt(prompt="a prompt"), lambda text: True, n=4, stop_server=True
+            )
+            client.instruct_samples(InstructPrompt(prompt="a prompt"), n=2)
+
+        assert len(cache) == 0
+
+    def test_instruct_first_valid_without_valid_samples(self, server: FakeWebUI) -> None:
+        with OobaApiClient(server.url) as client:
+            with pytest.raises(NoValidSample) as exc_info:
+                client.instruct_first_valid(
+                    InstructPrompt(prompt="a prompt"), lambda text: text.startswith("{"), n=3
+                )
+
+        assert [sample.index for sample in exc_info.value.samples] == [0, 1, 2]
+        assert len(server.requests["/api/v1/generate"]) == 3
+
+    def test_instruct_until(self) -> None:
+        stop = RegexStop(f"({TOKEN}){{3}}")
+
+        with FakeWebUI(output_tokens=100, tokens_per_second=100) as server, OobaApiClient(
+            server.url, stream_url=server.stream_url
+        ) as client:
+            start = time.monotonic()
+            result = client.instruct_until(InstructPrompt(prompt="a prompt"), [stop])
+
+            # stopped well before the 100 tokens, about a second, were generated
+            assert time.monotonic() - start < 0.5
+            assert result.text == TOKEN * 3
+            assert result.stopped_by is stop
+            assert len(server.requests["/api/v1/stop-stream"]) == 1
+
+    def test_instruct_until_finishes_without_stopping(self, server: FakeWebUI) -> None:
+        with OobaApiClient(server.url, stream_url=server.stream_url) as client:
+            result = client.instruct_until(InstructPrompt(prompt="a prompt"), [RegexStop("x")])
+
+        assert result == StopResult(TOKEN * 4, None)
+        assert "/api/v1/stop-stream" not in server.requests
+
+    def test_failed_stop_is_logged(self, server: FakeWebUI) -> None:
+        with OobaApiClient(server.url, stream_url=server.stream_url) as client:
+            server.fail_next = 1
+            result = client.instruct_until(InstructPrompt(prompt="a prompt"), [RegexStop(TOKEN)])
+
+        assert result.text == TOKEN
+        assert len(server.requests["/api/v1/stop-stream"]) == 1
+
+
+class TestCachedModelInfo:
+    def test_cached_until_ttl(self, server: FakeWebUI) -> None:
+        with OobaApiClient(server.url, model_info_ttl=0.05) as client:
+            client.cached_model_info()
+            client.cached_model_info()
+            assert len(server.requests["/api/v1/model"]) == 1
+
+            time.sleep(0.06)
+            client.cached_model_info()
+            assert len(server.requests["/api/v1/model"]) == 2
+
+    def test_load_model_replaces_cache(self, server: FakeWebUI) -> None:
+        with OobaApiClient(server.url) as client:
+            client.cached_model_info()
+            loaded = client.load_model("other-model", args_dict={})
+
+            assert client.cached_model_info() is loaded
+            assert [body["action"] for body in server.requests["/api/v1/model"]] == [
+                "info",
+                "load",
+            ]
+
+    def test_server_error_invalidates(self, server: FakeWebUI) -> None:
+        with OobaApiClient(server.url) as client:
+            client.cached_model_info()
+            server.fail_next = 1
+            with pytest.raises(requests.HTTPError):
+                client.instruct(InstructPrompt(prompt="a prompt"))
+
+            server.model_loaded = False
+            assert isinstance(client.cached_model_info(), OobaModelNotLoaded)
+
+    def test_background_refresh(self, server: FakeWebUI) -> None:
+        with OobaApiClient(server.url, model_info_ttl=60) as client:
+            client.start_model_info_refresh(0.01)
+            while len(server.requests.get("/api/v1/model", [])) < 2:
+                time.sleep(0.01)
+            server.model_loaded = False
+            while client.cached_model_info().model_name is not None:
+                time.sleep(0.01)
+        assert client._refresh_thread is None
+
+    def test_background_refresh_survives_errors(
+        self, server: FakeWebUI, caplog: pytest.LogCaptureFixture
+    ) -> None:
+        with OobaApiClient(server.url, model_info_ttl=60) as client:
+            model_info = client.model_info
+            calls = 0
+
+            def flaky_model_info(timeout: int | float = 5) -> OobaModelInfo:
+                nonlocal calls
+                calls += 1
+                if calls == 1:
+                    raise KeyError("model_name")
+                return model_info(timeout)
+
+            client.model_info = flaky_model_info  # type: ignore[method-assign]
+            client.start_model_info_refresh(0.01)
+            while not server.requests.get("/api/v1/model"):
+                time.sleep(0.01)
+            assert client._refresh_thread is not None and client._refresh_thread.is_alive()
+        assert "Could not refresh model info" in caplog.text
+
+
+class TestAsyncOobaApiClient:
+    def test_concurrent_instructs(self, server: FakeWebUI) -> None:
+        async def run() -> list[str]:
+            async with AsyncOobaApiClient(server.url, max_concurrency=4) as client:
+                return await asyncio.gather(
+                    *(client.instruct(InstructPrompt(prompt=f"prompt {i}")) for i in range(8))
+                )
+
+        assert asyncio.run(run()) == [TOKEN * 4] * 8
+        assert len(server.requests["/api/v1/generate"]) == 8
+
+    def test_retries_server_errors(self, server: FakeWebUI) -> None:
+        server.fail_next = 2
+
+        async def run() -> str:
+            async with AsyncOobaApiClient(server.url, retry=NO_WAIT) as client:
+                return await client.instruct(InstructPrompt(prompt="a prompt"))
+
+        assert asyncio.run(run()) == TOKEN * 4
+        assert len(server.requests["/api/v1/generate"]) == 3
+
+    def test_deadline(self) -> None:
+        async def run(url: str) -> str:
+            async with AsyncOobaApiClient(url, retry=NO_WAIT) as client:
+                return await client.instruct(InstructPrompt(prompt="a prompt"), deadline=0.1)
+
+        with FakeWebUI(latency=1) as server:
+            with pytest.raises(DeadlineExceeded):
+                asyncio.run(run(server.url))
+
+    def test_instruct_stream(self, server: FakeWebUI) -> None:
+        async def run() -> str:
+            client = AsyncOobaApiClient(server.url, stream_url=server.stream_url)
+            prompt = InstructPrompt(prompt="a prompt")
+            return "".join([chunk.text async for chunk in client.instruct_stream(prompt)])
+
+        assert asyncio.run(run()) == TOKEN * 4
+
+    def test_instruct_first_valid(self, server: FakeWebUI) -> None:
+        async def run() -> tuple[Sample, Sample]:
+            async with AsyncOobaApiClient(server.url, max_concurrency=4) as client:
+                prompt = InstructPrompt(prompt="a prompt")
+                return (
+                    await client.instruct_first_valid(prompt, lambda text: TOKEN in text, n=4),
+                    await client.instruct_best_of(
+                        prompt, len, [Parameters(max_new_tokens=2), Parameters(max_new_tokens=3)]
+                    ),
+                )
+
+        first, best = asyncio.run(run())
+
+        assert first.text == TOKEN * 4
+        assert (best.index, best.text) == (1, TOKEN * 3)
+
+    def test_instruct_until(self, server: FakeWebUI) -> None:
+        stop = RegexStop(TOKEN * 2)
+
+        async def run() -> list[StopResult]:
+            async with AsyncOobaApiClient(server.url, stream_url=server.stream_url) as client:
+                prompt = InstructPrompt(prompt="a prompt")
+                return [
+                    await client.instruct_until(prompt, [stop]),
+                    await client.instruct_until(prompt, [stop], stop_server=False),
+                ]
+
+        assert asyncio.run(run()) == [StopResult(TOKEN * 2, stop)] * 2
+        assert len(server.requests["/api/v1/stop-stream"]) == 1
+
+    def test_model_info_refresh(self, server: FakeWebUI) -> None:
+        async def run() -> None:
+            async with AsyncOobaApiClient(server.url, model_info_ttl=60) as client:
+                client.start_model_info_refresh(0.01)
+                while len(server.requests.get("/api/v1/model", [])) < 2:
+                    await asyncio.sleep(0.01)
+                assert (await client.cached_model_info()).model_name is not None
+                server.fail_next = 1
+                with pytest.raises(httpx.HTTPStatusError):
+                    await client.count_tokens("a prompt")
+                assert client._loaded_model is None
+            assert client._refresh_task is None
+
+        asyncio.run(run())
+
+    def test_model_info_refresh_survives_errors(
+        self, server: FakeWebUI, caplog: pytest.LogCaptureFixture
+    ) -> None:
+        async def run() -> None:
+            async with AsyncOobaApiClient(server.url, model_info_ttl=60) as client:
+                model_info = client.model_info
+                calls = 0
+
+                async def flaky_model_info(timeout: int | float = 5) -> OobaModelInfo:
+                    nonlocal calls
+                    calls += 1
+                    if calls == 1:
+                        raise KeyError("model_name")
+                    return await model_info(timeout)
+
+                client.model_info = flaky_model_info  # type: ignore[method-assign]
+                client.start_model_info_refresh(0.01)
+                while not server.requests.get("/api/v1/model"):
+                    await asyncio.sleep(0.01)
+                assert client._refresh_task is not None and not client._refresh_task.done()
+
+        asyncio.run(run())
+        assert "Could not refresh model info" in caplog.text
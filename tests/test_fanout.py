@@ -0,0 +1,137 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from ooba_api.codecs import StdlibJsonCodec
+from ooba_api.fanout import (
+    NoValidSample,
+    Sample,
+    accept,
+    arun_fan_out,
+    best_sample,
+    run_fan_out,
+    sample_parameters,
+)
+from ooba_api.parameters import FrozenParameters, Parameters, _dump
+
+
+class TestSampleParameters:
+    def test_consecutive_seeds(self) -> None:
+        parameter_sets = sample_parameters(Parameters(seed=10, temperature=0.5), 3)
+
+        assert [parameters.seed for parameters in parameter_sets] == [10, 11, 12]
+        assert all(parameters.temperature == 0.5 for parameters in parameter_sets)
+
+    def test_encodes_like_validated_parameters(self) -> None:
+        codec = StdlibJsonCodec()
+        parameter_sets = sample_parameters(Parameters(seed=10, temperature=0.5), 2)
+
+        assert [codec.dumps(_dump(parameters)) for parameters in parameter_sets] == [
+            codec.dumps(_dump(Parameters(seed=seed, temperature=0.5))) for seed in (10, 11)
+        ]
+
+    def test_random_seed_is_fixed_per_sample(self) -> None:
+        parameter_sets = sample_parameters(FrozenParameters(), 2)
+
+        assert parameter_sets[0].seed >= 0
+        assert parameter_sets[1].seed == parameter_sets[0].seed + 1
+        assert all(isinstance(parameters, FrozenParameters) for parameters in parameter_sets)
+
+    def test_sequence_is_used_as_is(self) -> None:
+        parameter_sets = [Parameters(temperature=0.1), Parameters(temperature=0.9)]
+
+        assert sample_parameters(parameter_sets, 4) == parameter_sets
+
+    def test_rejects_no_samples(self) -> None:
+        with pytest.raises(ValueError):
+            sample_parameters(Parameters(), 0)
+        with pytest.raises(ValueError):
+            sample_parameters([], 4)
+
+
+class TestChoosing:
+    def test_accept(self) -> None:
+        sample = Sample(0, Parameters(), text="not json")
+
+        assert accept(Sample(0, Parameters(), text="ok"), lambda text: text == "ok")
+        assert not accept(sample, lambda text: bool(int(text)))
+        assert isinstance(sample.error, ValueError)
+        assert not accept(sample, lambda text: True)
+
+    def test_best_sample(self) -> None:
+        samples = [
+            Sample(0, Parameters(), text="a"),
+            Sample(1, Parameters(), error=RuntimeError()),
+            Sample(2, Parameters(), text="ccc"),
+            Sample(3, Parameters(), text="bb"),
+        ]
+
+        assert best_sample(samples, len) is samples[2]
+
+    def test_best_sample_without_valid_samples(self) -> None:
+        samples = [Sample(0, Parameters(), text="a"), Sample(1, Parameters(), error=OSError())]
+
+        with pytest.raises(NoValidSample) as exc_info:
+            best_sample(samples, float)
+
+        assert exc_info.value.samples == samples
+        assert isinstance(samples[0].error, ValueError)
+
+
+class TestRunFanOut:
+    def test_yields_every_sample(self) -> None:
+        def instruct(parameters: Parameters) -> str:
+            if parameters.seed == 1:
+                raise RuntimeError("failed")
+            return str(parameters.seed)
+
+        samples = list(run_fan_out(instruct, sample_parameters(Parameters(seed=0), 3), 2))
+
+        assert sorted(sample.index for sample in samples) == [0, 1, 2]
+        assert {sample.text for sample in samples} == {"0", "2", None}
+
+    def test_closing_drops_unsent_requests(self) -> None:
+        release = threading.Event()
+        started: list[int] = []
+
+        def instruct(parameters: Parameters) -> str:
+            started.append(parameters.seed)
+            if parameters.seed != 0:
+                release.wait()
+            return "text"
+
+        samples = run_fan_out(instruct, sample_parameters(Parameters(seed=0), 6), 2)
+        start = time.monotonic()
+
+        assert next(samples).index == 0
+        samples.close()
+
+        # the request in flight is not waited for
+        assert time.monotonic() - start < 0.5
+        release.set()
+        time.sleep(0.05)
+        # the worker freed by the first sample may have picked up the next one
+        assert sorted(started) in ([0, 1], [0, 1, 2])
+
+    def test_async_closing_cancels_requests(self) -> None:
+        cancelled: list[int] = []
+
+        async def instruct(parameters: Parameters) -> str:
+            try:
+                await asyncio.sleep(parameters.seed)
+            except asyncio.CancelledError:
+                cancelled.append(parameters.seed)
+                raise
+            return "text"
+
+        async def run() -> Sample:
+            samples = arun_fan_out(instruct, sample_parameters(Parameters(seed=0), 3))
+            first = await samples.__anext__()
+            await samples.aclose()
+            await asyncio.sleep(0)
+            return first
+
+        assert asyncio.run(run()).index == 0
+        assert sorted(cancelled) == [1, 2]
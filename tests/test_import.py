@@ -0,0 +1,53 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import ooba_api
+
+# cumulative microseconds a cold `import ooba_api` may take, well above the few
+# milliseconds it takes when nothing heavy is imported eagerly
+IMPORT_BUDGET_US = 50_000
+
+
+def _import_times(statement: str) -> dict[str, int]:
+    # module -> cumulative import time in microseconds, from a fresh interpreter
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=Path(__file__).resolve().parents[1],
+    ).stderr
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line.split("|")
+        times[module.strip()] = int(cumulative)
+    return times
+
+
+def test_cold_import_within_budget() -> None:
+    times = _import_times("import ooba_api")
+
+    assert times["ooba_api"] < IMPORT_BUDGET_US
+
+
+def test_import_is_lazy() -> None:
+    times = _import_times("import ooba_api")
+
+    for heavy in ["requests", "httpx", "pydantic", "distutils", "ooba_api.clients"]:
+        assert heavy not in times
+
+
+def test_exports_resolve() -> None:
+    assert sorted(ooba_api.__all__) == sorted(ooba_api._EXPORTS)
+    for name in ooba_api.__all__:
+        assert getattr(ooba_api, name).__name__ == name
+
+
+def test_unknown_name() -> None:
+    with pytest.raises(AttributeError):
+        ooba_api.NotAName  # type: ignore[attr-defined]
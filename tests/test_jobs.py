@@ -0,0 +1,228 @@
+import json
+import threading
+import time
+from pathlib import Path
+
+import pytest
+from fake_server import FakeWebUI
+
+from ooba_api.jobs import Checkpoint, main, run_jsonl
+from ooba_api.parameters import Parameters
+from ooba_api.prompts import LlamaInstructPrompt, Prompt
+
+
+class Crash(BaseException):
+    pass
+
+
+def _write_records(path: Path, count: int) -> None:
+    path.write_text(
+        "".join(json.dumps({"id": f"r{i}", "prompt": str(i)}) + "\n" for i in range(count))
+    )
+
+
+def _echo(prompt: Prompt, parameters: Parameters) -> str:
+    return f"output {prompt.prompt}"
+
+
+def _results(path: Path) -> list[dict]:
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+class TestCheckpoint:
+    def test_tracks_out_of_order_lines(self) -> None:
+        checkpoint = Checkpoint()
+
+        checkpoint.finish(1)
+        checkpoint.finish(2)
+        assert checkpoint.next_line == 0
+        assert checkpoint.finished(2)
+        assert not checkpoint.finished(0)
+
+        checkpoint.finish(0)
+        assert checkpoint.next_line == 3
+        assert checkpoint.done == set()
+
+    def test_round_trips(self, tmp_path: Path) -> None:
+        path = tmp_path / "checkpoint"
+        Checkpoint(next_line=3, done={5, 7}, offset=120).save(path)
+
+        assert Checkpoint.load(path) == Checkpoint(next_line=3, done={5, 7}, offset=120)
+        assert Checkpoint.load(tmp_path / "missing") == Checkpoint()
+
+
+class TestRunJsonl:
+    def test_writes_every_result(self, tmp_path: Path) -> None:
+        input_path = tmp_path / "input.jsonl"
+        output_path = tmp_path / "output.jsonl"
+        _write_records(input_path, 20)
+
+        summary = run_jsonl(_echo, input_path, output_path, max_concurrency=4)
+
+        assert summary.succeeded == 20
+        assert sorted(_results(output_path), key=lambda result: int(result["id"][1:])) == [
+            {"id": f"r{i}", "text": f"output {i}"} for i in range(20)
+        ]
+
+    def test_renders_records(self, tmp_path: Path) -> None:
+        input_path = tmp_path / "input.jsonl"
+        output_path = tmp_path / "output.jsonl"
+        input_path.write_text(
+            '{"prompt": "a", "parameters": {"seed": 7}}\n'
+            "\n"
+            '{"prompt": "b", "system_prompt": "override", "source": "ignored"}\n'
+        )
+        seen: list[tuple[Prompt, Parameters]] = []
+
+        def instruct(prompt: Prompt, parameters: Parameters) -> str:
+            seen.append((prompt, parameters))
+            return "ok"
+
+        run_jsonl(
+            instruct,
+            input_path,
+            output_path,
+            prompt_class=LlamaInstructPrompt,
+            prompt_fields={"system_prompt": "shared"},
+            parameters={"max_new_tokens": 64},
+            max_concurrency=1,
+        )
+
+        assert [prompt for prompt, _ in seen] == [
+            LlamaInstructPrompt(prompt="a", system_prompt="shared"),
+            LlamaInstructPrompt(prompt="b", system_prompt="override"),
+        ]
+        assert [(parameters.seed, parameters.max_new_tokens) for _, parameters in seen] == [
+            (7, 64),
+            (-1, 64),
+        ]
+        # ids default to the line number
+        assert [result["id"] for result in _results(output_path)] == [0, 2]
+
+    def test_records_errors(self, tmp_path: Path) -> None:
+        input_path = tmp_path / "input.jsonl"
+        output_path = tmp_path / "output.jsonl"
+        input_path.write_text(
+            "not json\n"
+            '{"id": "typo", "prompt": "a", "parameters": {"temprature": 0.5}}\n'
+            '{"id": "list", "prompt": "a", "parameters": ["temperature"]}\n'
+            '{"id": "fails", "prompt": "b"}\n'
+        )
+
+        def instruct(prompt: Prompt, parameters: Parameters) -> str:
+            raise RuntimeError("server error")
+
+        summary = run_jsonl(instruct, input_path, output_path)
+
+        assert summary.failed == 4
+        errors = {result["id"]: result["error"] for result in _results(output_path)}
+        assert "JSONDecodeError" in errors[0]
+        assert "temprature" in errors["typo"]
+        assert "JSON object" in errors["list"]
+        assert "server error" in errors["fails"]
+
+    def test_resumes_after_crash(self, tmp_path: Path) -> None:
+        input_path = tmp_path / "input.jsonl"
+        output_path = tmp_path / "output.jsonl"
+        _write_records(input_path, 30)
+
+        def crashing(prompt: Prompt, parameters: Parameters) -> str:
+            if prompt.prompt == "17":
+                raise Crash()
+            return _echo(prompt, parameters)
+
+        with pytest.raises(Crash):
+            run_jsonl(crashing, input_path, output_path, checkpoint_every=5)
+        first_run = len(_results(output_path))
+        # a result written after the last save, lost with the process
+        with output_path.open("a") as output:
+            output.write('{"id": "unsaved"}\n')
+
+        summary = run_jsonl(_echo, input_path, output_path, checkpoint_every=5)
+
+        assert summary.skipped == first_run
+        assert summary.succeeded == 30 - first_run
+        assert sorted(result["id"] for result in _results(output_path)) == sorted(
+            f"r{i}" for i in range(30)
+        )
+
+    def test_completed_run_skips_everything(self, tmp_path: Path) -> None:
+        input_path = tmp_path / "input.jsonl"
+        output_path = tmp_path / "output.jsonl"
+        _write_records(input_path, 5)
+        run_jsonl(_echo, input_path, output_path)
+
+        summary = run_jsonl(_echo, input_path, output_path)
+
+        assert summary.skipped == 5
+        assert summary.succeeded == 0
+        assert len(_results(output_path)) == 5
+
+    def test_rejects_changed_output(self, tmp_path: Path) -> None:
+        input_path = tmp_path / "input.jsonl"
+        output_path = tmp_path / "output.jsonl"
+        _write_records(input_path, 5)
+        run_jsonl(_echo, input_path, output_path)
+        output_path.write_text("")
+
+        with pytest.raises(ValueError, match="shorter"):
+            run_jsonl(_echo, input_path, output_path)
+
+    def test_slow_record_bounds_lookahead(self, tmp_path: Path) -> None:
+        input_path = tmp_path / "input.jsonl"
+        output_path = tmp_path / "output.jsonl"
+        _write_records(input_path, 20)
+        slow_done = threading.Event()
+        started_while_slow: list[int] = []
+
+        def instruct(prompt: Prompt, parameters: Parameters) -> str:
+            if prompt.prompt == "0":
+                time.sleep(0.05)
+                slow_done.set()
+            elif not slow_done.is_set():
+                started_while_slow.append(int(prompt.prompt))
+            return "ok"
+
+        run_jsonl(instruct, input_path, output_path, max_concurrency=4, max_ahead=5)
+
+        assert max(started_while_slow) == 4
+
+
+class TestMain:
+    def test_runs_against_server(self, tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+        input_path = tmp_path / "input.jsonl"
+        output_path = tmp_path / "output.jsonl"
+        _write_records(input_path, 6)
+
+        with FakeWebUI(output_tokens=2) as server:
+            main(
+                [
+                    str(input_path),
+                    str(output_path),
+                    "--url",
+                    server.url,
+                    "--template",
+                    "llama",
+                    "--system-prompt",
+                    "Be brief.",
+                    "--param",
+                    "max_new_tokens=2",
+                ]
+            )
+
+        assert "6 succeeded, 0 failed, 0 skipped" in capsys.readouterr().out
+        assert all("text" in result for result in _results(output_path))
+
+    def test_rejects_option_for_other_template(
+        self, tmp_path: Path, capsys: pytest.CaptureFixture
+    ) -> None:
+        with pytest.raises(SystemExit):
+            main([str(tmp_path / "in"), str(tmp_path / "out"), "--system-prompt", "Be brief."])
+
+        assert (
+            "--system-prompt does not apply to the instruct template" in capsys.readouterr().err
+        )
+
+    def test_rejects_unknown_parameter(self, tmp_path: Path) -> None:
+        with pytest.raises(SystemExit):
+            main([str(tmp_path / "in"), str(tmp_path / "out"), "--param", "max_tokens=2"])
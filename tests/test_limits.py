@@ -0,0 +1,347 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from ooba_api.limits import (
+    AdaptiveLimit,
+    AsyncConcurrencyLimiter,
+    ConcurrencyLimiter,
+    ConcurrencyLimitTimeout,
+    Lane,
+    QueueFull,
+    shared_limiter,
+)
+
+# admitted from 8 waiting in each lane, 4 interactive for each batch while both wait
+FAIR_ORDER = (
+    ["interactive", "batch"]
+    + ["interactive"] * 4
+    + ["batch"]
+    + ["interactive"] * 3
+    + ["batch"] * 6
+)
+
+
+def _wait_for_waiting(limiter: ConcurrencyLimiter, priority: str, count: int) -> None:
+    while limiter.lane_stats()[priority].waiting < count:
+        time.sleep(0.001)
+
+
+class TestConcurrencyLimiter:
+    def test_allows_up_to_limit_in_flight(self) -> None:
+        limiter = ConcurrencyLimiter(2)
+        peak = 0
+        peak_lock = threading.Lock()
+
+        def work() -> None:
+            nonlocal peak
+            with limiter.slot():
+                with peak_lock:
+                    peak = max(peak, limiter.in_flight)
+                time.sleep(0.01)
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert peak == 2
+        assert limiter.in_flight == 0
+
+    def test_unlimited(self) -> None:
+        limiter = ConcurrencyLimiter(None)
+        for _ in range(100):
+            limiter.acquire(timeout=0)
+
+        assert limiter.in_flight == 100
+
+    def test_acquire_timeout(self) -> None:
+        limiter = ConcurrencyLimiter(1)
+        limiter.acquire()
+
+        with pytest.raises(ConcurrencyLimitTimeout):
+            limiter.acquire(timeout=0.01)
+
+    def test_slot_released_on_error(self) -> None:
+        limiter = ConcurrencyLimiter(1)
+
+        with pytest.raises(ValueError):
+            with limiter.slot():
+                raise ValueError()
+
+        assert limiter.in_flight == 0
+
+
+class TestPriorityLanes:
+    def test_weighted_fairness(self) -> None:
+        limiter = ConcurrencyLimiter(1)
+        limiter.acquire()
+        admitted: list[str] = []
+
+        def work(priority: str) -> None:
+            with limiter.slot(priority=priority):
+                admitted.append(priority)
+
+        threads = []
+        for priority in ("batch", "interactive"):
+            for count in range(1, 9):
+                thread = threading.Thread(target=work, args=(priority,))
+                thread.start()
+                threads.append(thread)
+                _wait_for_waiting(limiter, priority, count)
+        limiter.release()
+        for thread in threads:
+            thread.join()
+
+        assert admitted == FAIR_ORDER
+
+    def test_full_lane_rejects_at_once(self) -> None:
+        limiter = ConcurrencyLimiter(1, {"interactive": Lane(max_queue=1)})
+        limiter.acquire()
+        waiter = threading.Thread(target=limiter.acquire)
+        waiter.start()
+        _wait_for_waiting(limiter, "interactive", 1)
+
+        with pytest.raises(QueueFull):
+            limiter.acquire()
+
+        limiter.release()
+        waiter.join()
+        stats = limiter.lane_stats()["interactive"]
+        assert (stats.admitted, stats.rejected, stats.waiting) == (2, 1, 0)
+        assert stats.queue_wait is not None and stats.queue_wait.max > 0
+
+    def test_timed_out_waiter_leaves_the_lane(self) -> None:
+        limiter = ConcurrencyLimiter(1)
+        limiter.acquire()
+
+        with pytest.raises(ConcurrencyLimitTimeout):
+            limiter.acquire(timeout=0.01, priority="batch")
+        limiter.release()
+
+        assert limiter.in_flight == 0
+        assert limiter.lane_stats()["batch"].timed_out == 1
+        assert limiter.lane_stats()["batch"].waiting == 0
+
+    def test_unknown_priority(self) -> None:
+        with pytest.raises(ValueError, match="Unknown priority"):
+            ConcurrencyLimiter(1).acquire(priority="urgent")
+
+
+class TestAdaptiveLimit:
+    def test_grows_while_latency_is_flat(self) -> None:
+        limiter = ConcurrencyLimiter(adaptive=AdaptiveLimit(window=2))
+        limiter.acquire()
+
+        limiter.record_latency(1.0)
+        limiter.record_latency(1.0)
+
+        assert limiter.limit == 2
+
+    def test_unused_limit_does_not_grow(self) -> None:
+        limiter = ConcurrencyLimiter(adaptive=AdaptiveLimit(window=2))
+
+        for _ in range(4):
+            limiter.record_latency(1.0)
+
+        assert limiter.limit == 1
+
+    def test_backs_off_when_latency_rises(self) -> None:
+        limiter = ConcurrencyLimiter(adaptive=AdaptiveLimit(initial=10, window=2))
+        limiter.record_latency(1.0)
+        limiter.record_latency(1.0)
+
+        limiter.record_latency(2.0)
+        limiter.record_latency(2.0)
+
+        assert limiter.limit == 7
+
+    def test_settles_near_capacity(self) -> None:
+        # a server generating 4 requests at once, more wait and take proportionally longer
+        limiter = ConcurrencyLimiter(adaptive=AdaptiveLimit(window=4, max_limit=16))
+        limits: list[int] = []
+        for _ in range(50):
+            in_flight = limiter.limit or 0
+            for _ in range(in_flight):
+                limiter.acquire()
+            for _ in range(in_flight):
+                limiter.record_latency(max(1.0, in_flight / 4))
+                limiter.release()
+            limits.append(limiter.limit or 0)
+
+        assert max(limits) > 4
+        # queueing past the capacity raised latency, so the limit backed off
+        assert all(4 <= limit < 8 for limit in limits[-10:])
+
+    def test_one_overload_backs_off_once(self) -> None:
+        limiter = ConcurrencyLimiter(None, adaptive=AdaptiveLimit(initial=10))
+        for _ in range(3):
+            limiter.acquire()
+
+        # the other two in flight were sent at the old limit
+        for _ in range(3):
+            limiter.record_overload()
+        assert limiter.limit == 7
+
+        limiter.record_overload()
+        limiter.record_overload()
+        assert limiter.limit == 4
+
+    def test_growing_admits_waiters(self) -> None:
+        limiter = ConcurrencyLimiter(adaptive=AdaptiveLimit(window=1))
+        limiter.acquire()
+        waiter = threading.Thread(target=limiter.acquire)
+        waiter.start()
+        _wait_for_waiting(limiter, "interactive", 1)
+
+        limiter.record_latency(1.0)
+        waiter.join()
+
+        assert limiter.in_flight == 2
+
+    def test_ignored_without_settings(self) -> None:
+        limiter = ConcurrencyLimiter(4)
+
+        limiter.record_latency(1.0)
+        limiter.record_overload()
+
+        assert limiter.limit == 4
+        assert limiter.adaptive is None
+
+    def test_rejects_bad_settings(self) -> None:
+        with pytest.raises(ValueError):
+            ConcurrencyLimiter(adaptive=AdaptiveLimit(initial=0))
+        with pytest.raises(ValueError):
+            ConcurrencyLimiter(adaptive=AdaptiveLimit(backoff=1))
+
+
+class TestAsyncConcurrencyLimiter:
+    def test_allows_up_to_limit_in_flight(self) -> None:
+        limiter = AsyncConcurrencyLimiter(3)
+        peak = 0
+
+        async def work() -> None:
+            nonlocal peak
+            async with limiter.slot():
+                peak = max(peak, limiter.in_flight)
+                await asyncio.sleep(0.01)
+
+        async def run() -> None:
+            await asyncio.gather(*(work() for _ in range(10)))
+
+        asyncio.run(run())
+
+        assert peak == 3
+        assert limiter.in_flight == 0
+
+    def test_acquire_timeout(self) -> None:
+        limiter = AsyncConcurrencyLimiter(1)
+
+        async def run() -> None:
+            await limiter.acquire()
+            await limiter.acquire(timeout=0.01)
+
+        with pytest.raises(ConcurrencyLimitTimeout):
+            asyncio.run(run())
+
+    def test_weighted_fairness(self) -> None:
+        limiter = AsyncConcurrencyLimiter(1)
+        admitted: list[str] = []
+
+        async def work(priority: str) -> None:
+            async with limiter.slot(priority=priority):
+                admitted.append(priority)
+
+        async def run() -> None:
+            await limiter.acquire()
+            tasks = []
+            for priority in ("batch", "interactive"):
+                for _ in range(8):
+                    tasks.append(asyncio.create_task(work(priority)))
+                    await asyncio.sleep(0)
+            await limiter.release()
+            await asyncio.gather(*tasks)
+
+        asyncio.run(run())
+
+        assert admitted == FAIR_ORDER
+
+    def test_full_lane_rejects_at_once(self) -> None:
+        limiter = AsyncConcurrencyLimiter(1, {"batch": Lane(max_queue=0)})
+
+        async def run() -> None:
+            await limiter.acquire(priority="batch")
+            await limiter.acquire(priority="batch")
+
+        with pytest.raises(QueueFull):
+            asyncio.run(run())
+        assert limiter.lane_stats()["batch"].rejected == 1
+
+    def test_adaptive_limit(self) -> None:
+        limiter = AsyncConcurrencyLimiter(adaptive=AdaptiveLimit(window=1))
+
+        async def run() -> None:
+            await limiter.acquire()
+            limiter.record_latency(1.0)
+            await limiter.acquire(timeout=0)
+            limiter.record_overload()
+
+        asyncio.run(run())
+
+        assert limiter.in_flight == 2
+        assert limiter.limit == 1
+
+    def test_timed_out_waiter_leaves_the_lane(self) -> None:
+        limiter = AsyncConcurrencyLimiter(1)
+
+        async def run() -> None:
+            await limiter.acquire()
+            with pytest.raises(ConcurrencyLimitTimeout):
+                await limiter.acquire(timeout=0.01, priority="batch")
+            await limiter.release()
+
+        asyncio.run(run())
+
+        assert limiter.in_flight == 0
+        assert limiter.lane_stats()["batch"].waiting == 0
+
+
+class TestSharedLimiter:
+    def test_same_url_and_kind_share(self) -> None:
+        limiter = shared_limiter("http://limit-host", "generate", 2)
+
+        assert shared_limiter("http://limit-host", "generate", 2) is limiter
+        assert shared_limiter("http://limit-host", "model", 2) is not limiter
+
+    def test_default_limit_keeps_existing(self) -> None:
+        shared_limiter("http://first-host", "generate", 2)
+
+        limiter = shared_limiter("http://first-host", "generate", 5)
+
+        assert limiter.limit == 2
+
+    def test_explicit_limit_replaces_existing(self) -> None:
+        limiter = shared_limiter("http://override-host", "generate", 1)
+        limiter.acquire()
+        waiter = threading.Thread(target=limiter.acquire)
+        waiter.start()
+        _wait_for_waiting(limiter, "interactive", 1)
+
+        assert shared_limiter("http://override-host", "generate", 8, override=True) is limiter
+        waiter.join()
+
+        assert limiter.limit == 8
+        assert limiter.in_flight == 2
+
+    def test_explicit_adaptive_replaces_existing(self) -> None:
+        shared_limiter("http://adaptive-host", "generate", 4)
+
+        limiter = shared_limiter(
+            "http://adaptive-host", "generate", None, adaptive=AdaptiveLimit(), override=True
+        )
+
+        assert limiter.adaptive == AdaptiveLimit()
+        assert limiter.limit == 1
@@ -0,0 +1,84 @@
+import pydantic
+import pytest
+
+from ooba_api.clients import _instruct_body
+from ooba_api.codecs import StdlibJsonCodec
+from ooba_api.parameters import DEFAULT_PARAMETERS, FrozenParameters, Parameters, _dump
+from ooba_api.prompts import Prompt
+
+
+class TestFrozenParameters:
+    def test_default_parameters_are_frozen(self) -> None:
+        assert isinstance(DEFAULT_PARAMETERS, FrozenParameters)
+
+        with pytest.raises((pydantic.ValidationError, TypeError)):
+            DEFAULT_PARAMETERS.seed = 1
+
+    def test_frozen_copies_values(self) -> None:
+        parameters = Parameters(seed=1, temperature=0.5)
+
+        frozen = parameters.frozen()
+
+        assert _dump(frozen) == _dump(parameters)
+        assert frozen.frozen() is frozen
+
+
+class TestBulk:
+    def test_builds_parameter_sets(self) -> None:
+        parameter_sets = list(
+            FrozenParameters.bulk([{"seed": 1}, {"seed": 2}], max_new_tokens=50)
+        )
+
+        assert [parameters.seed for parameters in parameter_sets] == [1, 2]
+        assert all(parameters.max_new_tokens == 50 for parameters in parameter_sets)
+        assert all(isinstance(parameters, FrozenParameters) for parameters in parameter_sets)
+        assert parameter_sets[0]._encoded is not parameter_sets[1]._encoded
+
+    def test_matches_validated_parameters(self) -> None:
+        parameter_sets = Parameters.bulk([{"seed": 1}, {"seed": 2}], max_new_tokens=50)
+
+        assert [_dump(parameters) for parameters in parameter_sets] == [
+            _dump(Parameters(seed=1, max_new_tokens=50)),
+            _dump(Parameters(seed=2, max_new_tokens=50)),
+        ]
+
+    def test_encodes_like_validated_parameters(self) -> None:
+        codec = StdlibJsonCodec()
+        parameter_sets = Parameters.bulk([{"seed": 1}], max_new_tokens=50)
+
+        assert [codec.dumps(_dump(parameters)) for parameters in parameter_sets] == [
+            codec.dumps(_dump(Parameters(seed=1, max_new_tokens=50)))
+        ]
+
+    def test_validates_shared_fields(self) -> None:
+        with pytest.raises(pydantic.ValidationError):
+            list(Parameters.bulk([{"seed": 1}], temperature=5))
+
+    def test_rejects_unknown_fields(self) -> None:
+        with pytest.raises(ValueError, match="temprature"):
+            list(Parameters.bulk([{"temprature": 0.5}]))
+
+
+class TestInstructBody:
+    def test_matches_merged_dict(self) -> None:
+        codec = StdlibJsonCodec()
+        prompt = Prompt(prompt="a prompt", negative_prompt="not this")
+        parameters = Parameters(seed=1)
+
+        prompt_to_use, body = _instruct_body(prompt, parameters, False, codec)
+
+        assert prompt_to_use == "a prompt"
+        assert codec.loads(body) == {
+            "prompt": "a prompt",
+            "negative_prompt": "not this",
+        } | _dump(parameters)
+
+    def test_caches_frozen_fragment(self) -> None:
+        codec = StdlibJsonCodec()
+        parameters = FrozenParameters(seed=1)
+
+        first = _instruct_body(Prompt(prompt="a"), parameters, False, codec)[1]
+        second = _instruct_body(Prompt(prompt="b"), parameters, False, codec)[1]
+
+        assert parameters._encoded[StdlibJsonCodec] == first[first.index(b'"add_bos') :]
+        assert codec.loads(second)["prompt"] == "b"
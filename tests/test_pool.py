@@ -0,0 +1,206 @@
+import threading
+import time
+from typing import Iterator
+
+import pytest
+import requests
+from megamock import MegaMock
+
+from ooba_api.clients import OobaApiClient
+from ooba_api.model_info import OobaModelInfo, OobaModelNotLoaded
+from ooba_api.pool import NoHealthyBackends, OobaClientPool
+from ooba_api.prompts import InstructPrompt
+from ooba_api.retry import HedgePolicy
+
+LOADED = OobaModelInfo(model_name="model", lora_names=[], shared_settings={}, shared_args={})
+
+
+class TestOobaClientPool:
+    @pytest.fixture(autouse=True)
+    def setup(self) -> None:
+        self.pool = OobaClientPool(
+            ["http://pool-a", "http://pool-b", "http://pool-c"], health_check_interval=None
+        )
+        self.clients = [MegaMock.it(OobaApiClient, spec_set=False) for _ in self.pool.backends]
+        for backend, client in zip(self.pool.backends, self.clients):
+            client.url = "http://mock"
+            client.instruct.return_value = "output text"
+            client.model_info.return_value = LOADED
+            backend.client = client
+
+    def test_requires_a_backend(self) -> None:
+        with pytest.raises(ValueError):
+            OobaClientPool([], health_check_interval=None)
+
+    def test_routes_to_least_in_flight(self) -> None:
+        a, b, c = self.pool.backends
+        a.in_flight = 2
+        b.in_flight = 0
+        c.in_flight = 1
+
+        self.pool.instruct(InstructPrompt(prompt="a prompt"))
+
+        self.clients[1].instruct.assert_called_once()
+        self.clients[0].instruct.assert_not_called()
+        self.clients[2].instruct.assert_not_called()
+        assert b.in_flight == 0
+
+    def test_spreads_idle_load(self) -> None:
+        for _ in range(3):
+            self.pool.instruct(InstructPrompt(prompt="a prompt"))
+
+        for client in self.clients:
+            client.instruct.assert_called_once()
+
+    def test_counts_in_flight_requests(self) -> None:
+        started = threading.Event()
+        finish = threading.Event()
+        a = self.pool.backends[0]
+
+        def slow_instruct(*args, **kwargs) -> str:
+            started.set()
+            finish.wait()
+            return ""
+
+        self.clients[0].instruct.side_effect = slow_instruct
+        thread = threading.Thread(target=self.pool.instruct, args=(InstructPrompt(prompt=""),))
+        thread.start()
+        started.wait()
+
+        assert a.in_flight == 1
+        finish.set()
+        thread.join()
+        assert a.in_flight == 0
+
+    def test_instruct_stream_passes_priority(self) -> None:
+        self.clients[0].instruct_stream.return_value = iter([])
+
+        list(self.pool.instruct_stream(InstructPrompt(prompt="a prompt"), priority="batch"))
+
+        assert self.clients[0].instruct_stream.call_args.args[-1] == "batch"
+
+    def test_ejects_not_loaded(self) -> None:
+        a = self.pool.backends[0]
+        self.clients[0].model_info.return_value = OobaModelNotLoaded(
+            shared_settings={}, shared_args={}
+        )
+
+        self.pool.check_health()
+
+        assert not a.healthy
+        assert a.last_error == "no model loaded"
+        for _ in range(4):
+            self.pool.instruct(InstructPrompt(prompt="a prompt"))
+        self.clients[0].instruct.assert_not_called()
+
+    def test_ejects_timeouts_and_restores(self) -> None:
+        a = self.pool.backends[0]
+        self.clients[0].model_info.side_effect = requests.Timeout()
+
+        self.pool.check_health()
+        assert not a.healthy
+
+        self.clients[0].model_info.side_effect = None
+        self.pool.check_health()
+        assert a.healthy
+        assert a.last_error is None
+
+    def test_ejects_on_unexpected_error(self) -> None:
+        a, b = self.pool.backends[:2]
+        b.healthy = False
+        self.clients[0].model_info.side_effect = KeyError("model_name")
+
+        self.pool.check_health()
+
+        assert not a.healthy
+        assert a.last_error == "KeyError('model_name')"
+        # the rest were still checked
+        assert b.healthy
+
+    def test_ejects_on_connection_error(self) -> None:
+        for client in self.clients:
+            client.instruct.side_effect = requests.ConnectionError()
+        for _ in self.clients:
+            with pytest.raises(requests.ConnectionError):
+                self.pool.instruct(InstructPrompt(prompt="a prompt"))
+
+        with pytest.raises(NoHealthyBackends):
+            self.pool.instruct(InstructPrompt(prompt="a prompt"))
+
+    def test_instruct_many(self) -> None:
+        results = self.pool.instruct_many(
+            [InstructPrompt(prompt=str(i)) for i in range(9)], max_concurrency=3
+        )
+
+        assert [result.text for result in results] == ["output text"] * 9
+
+    def test_background_health_checks(self) -> None:
+        a = self.pool.backends[0]
+        self.clients[0].model_info.return_value = OobaModelNotLoaded(
+            shared_settings={}, shared_args={}
+        )
+        self.pool.health_check_interval = 0.01
+
+        self.pool.start_health_checks()
+        self.pool.close()
+
+        assert not a.healthy
+
+
+class TestHedging:
+    @pytest.fixture(autouse=True)
+    def setup(self) -> Iterator[None]:
+        self.pool = OobaClientPool(
+            ["http://pool-a", "http://pool-b"],
+            health_check_interval=None,
+            hedge=HedgePolicy(min_samples=0, min_delay=0.05),
+        )
+        self.clients = [MegaMock.it(OobaApiClient, spec_set=False) for _ in self.pool.backends]
+        for backend, client, text in zip(self.pool.backends, self.clients, ["slow", "fast"]):
+            client.url = "http://mock"
+            client.instruct.return_value = text
+            backend.client = client
+        self.release = threading.Event()
+
+        def slow_instruct(*args, **kwargs) -> str:
+            self.release.wait()
+            return "slow"
+
+        self.clients[0].instruct.side_effect = slow_instruct
+        yield
+        self.release.set()
+        self.pool.close()
+
+    def test_second_backend_answers_slow_request(self) -> None:
+        start = time.perf_counter()
+
+        assert self.pool.instruct(InstructPrompt(prompt="a prompt")) == "fast"
+        assert time.perf_counter() - start < 1
+        self.clients[1].instruct.assert_called_once()
+        assert self.pool.backends[0].in_flight == 1
+
+        self.release.set()
+        for _ in range(100):
+            if self.pool.backends[0].in_flight == 0:
+                break
+            time.sleep(0.01)
+        assert self.pool.backends[0].in_flight == 0
+
+    def test_no_hedge_for_fast_request(self) -> None:
+        self.release.set()
+
+        assert self.pool.instruct(InstructPrompt(prompt="a prompt")) == "slow"
+        self.clients[1].instruct.assert_not_called()
+
+    def test_hedge_delay_follows_latencies(self) -> None:
+        self.pool.hedge = HedgePolicy(min_samples=3, percentile=0.5)
+        assert self.pool._hedge_delay() is None
+
+        self.pool._latencies.extend([0.1, 0.2, 0.3])
+        assert self.pool._hedge_delay() == 0.2
+
+    def test_waits_for_other_attempt_after_error(self) -> None:
+        self.clients[1].instruct.side_effect = requests.HTTPError()
+        threading.Timer(0.2, self.release.set).start()
+
+        assert self.pool.instruct(InstructPrompt(prompt="a prompt")) == "slow"
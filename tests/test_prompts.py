@@ -1,7 +1,13 @@
 import pydantic
 import pytest
 
-from ooba_api.prompts import ChatPrompt, InstructPrompt, LlamaInstructPrompt, Prompt
+from ooba_api.prompts import (
+    ChatPrompt,
+    CompiledTemplate,
+    InstructPrompt,
+    LlamaInstructPrompt,
+    Prompt,
+)
 
 
 class TestPrompt:
@@ -19,9 +25,92 @@ class TestInstructPrompt:
 
 
 class TestChatPrompt:
-    def test_requires_at_least_one_message(self) -> None:
+    def test_starts_with_empty_history(self) -> None:
+        prompt = ChatPrompt(prompt="prompt")
+
+        assert prompt.messages == []
+        assert prompt.history() == []
+
+    def test_history_pairs_messages(self) -> None:
+        prompt = ChatPrompt(
+            prompt="prompt",
+            messages=[
+                {"role": "assistant", "content": "greeting"},
+                {"role": "user", "content": "question"},
+                {"role": "assistant", "content": "answer"},
+                {"role": "user", "content": "unanswered"},
+                {"role": "user", "content": "again"},
+            ],
+        )
+
+        assert prompt.history() == [
+            ["", "greeting"],
+            ["question", "answer"],
+            ["unanswered", ""],
+            ["again", ""],
+        ]
+
+    def test_chat_settings_leave_out_defaults(self) -> None:
+        prompt = ChatPrompt(
+            prompt="prompt", messages=[{"role": "user", "content": "hi"}], character="Bot"
+        )
+
+        assert prompt.chat_settings() == {"mode": "chat", "character": "Bot", "your_name": "You"}
+
+
+class TestBulk:
+    def test_builds_prompts(self) -> None:
+        prompts = list(
+            InstructPrompt.bulk(
+                ["first", {"prompt": "second", "negative_prompt": "not this"}],
+                instruct_template="<DO> {prompt} </DO>",
+            )
+        )
+
+        assert prompts == [
+            InstructPrompt(prompt="first", instruct_template="<DO> {prompt} </DO>"),
+            InstructPrompt(
+                prompt="second",
+                negative_prompt="not this",
+                instruct_template="<DO> {prompt} </DO>",
+            ),
+        ]
+
+    def test_from_columns(self) -> None:
+        prompts = LlamaInstructPrompt.from_columns(
+            {"prompt": ["first", "second"], "negative_prompt": [None, "not this"]},
+            system_prompt="system",
+        )
+
+        assert [(prompt.prompt, prompt.negative_prompt) for prompt in prompts] == [
+            ("first", None),
+            ("second", "not this"),
+        ]
+
+    def test_columns_must_match(self) -> None:
+        with pytest.raises(ValueError):
+            list(Prompt.from_columns({"prompt": ["a", "b"], "negative_prompt": ["c"]}))
+
+    def test_validates_shared_fields_once(self) -> None:
         with pytest.raises(pydantic.ValidationError):
-            ChatPrompt(prompt="prompt", negative_prompt="negative_prompt", messages=[])
+            InstructPrompt.bulk(["first"], instruct_template=None)
+
+    def test_rejects_bad_rows(self) -> None:
+        with pytest.raises(ValueError, match="no prompt"):
+            list(Prompt.bulk([{"negative_prompt": "x"}]))
+        with pytest.raises(ValueError, match="instruct_template"):
+            list(Prompt.bulk([{"prompt": "x", "instruct_template": "{prompt}"}]))
+
+    def test_compiled_template(self) -> None:
+        template = LlamaInstructPrompt.compile(system_prompt="system")
+
+        prompts = list(template.prompts(["first", "second"]))
+
+        assert [prompt.full_prompt() for prompt in prompts] == [
+            template.render("first"),
+            template.render("second"),
+        ]
+        assert all(prompt.template is template for prompt in prompts)
 
 
 class TestLlamaInstructPrompt:
@@ -35,3 +124,55 @@ class TestLlamaInstructPrompt:
             "[INST] <<SYS>> You are a talented, experienced software engineer. <</SYS>> "
             "Generate a library for ooba booga. Don't laugh at the name. [/INST]"
         )
+
+
+class TestCompiledTemplate:
+    def test_renders_like_instruct_prompt(self) -> None:
+        template = "### Instruction: {prompt}\n### Response: {{json}}"
+        compiled = InstructPrompt.compile(template)
+
+        prompt = compiled.prompt("prompt", negative_prompt="negative_prompt")
+
+        assert compiled.prefix == "### Instruction: "
+        assert (
+            prompt.full_prompt()
+            == InstructPrompt(prompt="prompt", instruct_template=template).full_prompt()
+        )
+        assert prompt.negative_prompt == "negative_prompt"
+
+    def test_renders_like_llama_prompt(self) -> None:
+        system_prompt = "You are a {careful} engineer. " * 100
+        compiled = LlamaInstructPrompt.compile(system_prompt=system_prompt)
+
+        prompt = compiled.prompt("Write a library.")
+
+        assert (
+            prompt.full_prompt()
+            == LlamaInstructPrompt(
+                prompt="Write a library.", system_prompt=system_prompt
+            ).full_prompt()
+        )
+        assert compiled.prefix == f"[INST] <<SYS>> {system_prompt} <</SYS>> "
+
+    def test_prompts_share_the_prefix(self) -> None:
+        compiled = LlamaInstructPrompt.compile(system_prompt="system")
+
+        first = compiled.prompt("first")
+        second = compiled.prompt("second")
+
+        assert first.shared_prefix() is second.shared_prefix() is compiled.prefix
+        assert first.full_prompt().startswith(compiled.prefix)
+        assert Prompt(prompt="prompt").shared_prefix() is None
+
+    def test_prompt_field_with_format_spec(self) -> None:
+        compiled = CompiledTemplate("{a}{prompt!r:>8}|{prompt}", a="A")
+
+        assert compiled.render("x") == "A     'x'|x"
+
+    def test_rejects_missing_fields(self) -> None:
+        with pytest.raises(ValueError, match="system_prompt"):
+            CompiledTemplate("{system_prompt} {prompt}")
+        with pytest.raises(ValueError, match="no {prompt} field"):
+            CompiledTemplate("{system_prompt}", system_prompt="system")
+        with pytest.raises(ValueError, match="Positional"):
+            CompiledTemplate("{} {prompt}")
@@ -0,0 +1,19 @@
+from ooba_api.results import InstructResult, RequestTimings
+
+
+class TestInstructResult:
+    def test_tokens_per_second_excludes_queue_and_decode(self) -> None:
+        result = InstructResult(
+            text="output text",
+            url="http://host",
+            prompt_length=8,
+            output_tokens=20,
+            timings=RequestTimings(queue_wait=1.0, decode=0.5, total=3.5),
+        )
+
+        assert result.tokens_per_second == 10
+
+    def test_tokens_per_second_unknown_without_token_count(self) -> None:
+        result = InstructResult(text="", url="http://host", prompt_length=0)
+
+        assert result.tokens_per_second is None
@@ -0,0 +1,78 @@
+import time
+
+import httpx
+import pytest
+import requests
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from ooba_api.retry import Deadline, DeadlineExceeded, RetryPolicy
+
+
+def _refused() -> requests.ConnectionError:
+    reason = NewConnectionError(HTTPConnection("localhost"), "Connection refused")
+    return requests.ConnectionError(
+        MaxRetryError(HTTPConnectionPool("localhost"), "/api/v1/model", reason)
+    )
+
+
+class TestRetryPolicy:
+    def test_backoff_grows_to_max(self) -> None:
+        policy = RetryPolicy(backoff=1, backoff_multiplier=2, max_backoff=5, jitter=False)
+
+        assert [policy.backoff_for(attempt) for attempt in range(1, 5)] == [1, 2, 4, 5]
+
+    def test_jitter_stays_within_backoff(self) -> None:
+        policy = RetryPolicy(backoff=1)
+
+        assert all(0 <= policy.backoff_for(1) <= 1 for _ in range(20))
+
+    def test_stops_after_max_attempts(self) -> None:
+        policy = RetryPolicy(max_attempts=2, jitter=False)
+
+        assert policy.retry_delay(1, status=503) == 0.5
+        assert policy.retry_delay(2, status=503) is None
+
+    def test_retries_idempotent_requests(self) -> None:
+        policy = RetryPolicy(jitter=False)
+
+        assert policy.retry_delay(1, error=requests.ReadTimeout()) is not None
+        assert policy.retry_delay(1, error=httpx.ReadError("reset")) is not None
+        assert policy.retry_delay(1, status=500) is not None
+        assert policy.retry_delay(1, status=400) is None
+        assert policy.retry_delay(1, error=ValueError()) is None
+
+    def test_retries_non_idempotent_requests_only_if_never_sent(self) -> None:
+        policy = RetryPolicy(jitter=False)
+
+        assert policy.retry_delay(1, error=requests.ReadTimeout(), idempotent=False) is None
+        assert policy.retry_delay(1, error=requests.ConnectionError(), idempotent=False) is None
+        assert policy.retry_delay(1, status=503, idempotent=False) is None
+        assert policy.retry_delay(1, error=_refused(), idempotent=False) is not None
+        assert policy.retry_delay(1, error=requests.ConnectTimeout(), idempotent=False) == 0.5
+        assert policy.retry_delay(1, error=httpx.ConnectError("refused"), idempotent=False)
+
+
+class TestDeadline:
+    def test_after(self) -> None:
+        deadline = Deadline.after(5)
+
+        assert deadline is not None
+        assert deadline.remaining() == pytest.approx(5, abs=0.1)
+        assert Deadline.after(None) is None
+
+    def test_cap(self) -> None:
+        deadline = Deadline(5)
+
+        assert deadline.cap(1) == 1
+        assert deadline.cap(None) == pytest.approx(5, abs=0.1)
+        assert deadline.cap(500) == pytest.approx(5, abs=0.1)
+
+    def test_cap_raises_once_expired(self) -> None:
+        deadline = Deadline(0.01)
+        time.sleep(0.02)
+
+        assert deadline.expired
+        with pytest.raises(DeadlineExceeded):
+            deadline.cap(1)
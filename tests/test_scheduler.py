@@ -0,0 +1,160 @@
+import threading
+from typing import Iterator
+
+import pytest
+import requests
+from megamock import Mega, MegaMock
+from pytest_mock import MockerFixture
+
+from ooba_api.clients import OobaApiClient
+from ooba_api.model_info import OobaModelInfo, OobaModelNotLoaded
+from ooba_api.prompts import InstructPrompt
+from ooba_api.scheduler import ModelKey, ModelScheduler
+
+
+def _info(model_name: str, lora_names: list[str] | None = None) -> OobaModelInfo:
+    return OobaModelInfo(
+        model_name=model_name, lora_names=lora_names or [], shared_settings={}, shared_args={}
+    )
+
+
+class TestModelKey:
+    def test_of(self) -> None:
+        assert ModelKey.of(_info("a", ["y", "x"])) == ModelKey("a", ("x", "y"))
+        assert ModelKey.of(OobaModelNotLoaded(shared_settings={}, shared_args={})) is None
+
+
+class TestModelScheduler:
+    @pytest.fixture(autouse=True)
+    def setup(self) -> Iterator[None]:
+        self.scheduler = ModelScheduler(["http://sched-a"], max_consecutive=2)
+        self.client = self._mock_client(self.scheduler.backends[0].client, "a")
+        self.scheduler.backends[0].client = self.client
+        # order prompts were generated in, with the model loaded at the time
+        self.served: list[tuple[str, str]] = []
+        self.release = threading.Event()
+        self.release.set()
+        self.load_error: Exception | None = None
+        yield
+        self.release.set()
+        self.scheduler.close()
+
+    def _mock_client(self, client: OobaApiClient, model_name: str) -> OobaApiClient:
+        mock = MegaMock.it(OobaApiClient, spec_set=False)
+        mock.url = client.url
+        mock.model_info.return_value = _info(model_name)
+        loaded = [model_name]
+
+        def load_model(model_name: str, **kwargs) -> OobaModelInfo:
+            if self.load_error is not None:
+                raise self.load_error
+            loaded[0] = model_name
+            return _info(model_name)
+
+        def instruct(prompt: InstructPrompt, *args) -> str:
+            self.release.wait()
+            self.served.append((loaded[0], prompt.prompt))
+            return prompt.prompt
+
+        mock.load_model.side_effect = load_model
+        mock.instruct.side_effect = instruct
+        return mock
+
+    def _submit_while_busy(self, models: list[str]) -> list:
+        # the first request holds the backend until every request is queued
+        self.release.clear()
+        futures = [
+            self.scheduler.submit(InstructPrompt(prompt=f"{model}{i}"), model)
+            for i, model in enumerate(models)
+        ]
+        while not Mega(self.client.instruct).called():
+            threading.Event().wait(0.01)
+        self.release.set()
+        return futures
+
+    def test_instruct(self) -> None:
+        assert self.scheduler.instruct(InstructPrompt(prompt="hi"), "a") == "hi"
+        assert Mega(self.client.load_model).not_called()
+
+    def test_drains_loaded_model_before_switching(self) -> None:
+        self.scheduler.max_consecutive = 32
+
+        futures = self._submit_while_busy(["a", "b", "a", "b", "a"])
+
+        assert [future.result() for future in futures] == ["a0", "b1", "a2", "b3", "a4"]
+        assert self.served == [("a", "a0"), ("a", "a2"), ("a", "a4"), ("b", "b1"), ("b", "b3")]
+        assert self.scheduler.backends[0].switches == 1
+
+    def test_fairness_cap(self) -> None:
+        futures = self._submit_while_busy(["a", "a", "a", "a", "b"])
+
+        for future in futures:
+            future.result()
+        assert [prompt for _, prompt in self.served] == ["a0", "a1", "b4", "a2", "a3"]
+        assert self.scheduler.backends[0].switches == 2
+
+    def test_passes_load_arguments(self) -> None:
+        self.scheduler.instruct(
+            InstructPrompt(prompt="hi"), "b", args_dict={"loader": "llama.cpp"}
+        )
+
+        assert Mega(self.client.load_model).called_once_with(
+            "b", args_dict={"loader": "llama.cpp"}, timeout=5000
+        )
+
+    def test_failed_load_fails_request(self) -> None:
+        self.load_error = requests.HTTPError()
+
+        with pytest.raises(requests.HTTPError):
+            self.scheduler.instruct(InstructPrompt(prompt="hi"), "b")
+        assert self.scheduler.backends[0].model is None
+
+    def test_unexpected_model_info_error(self, mocker: MockerFixture) -> None:
+        mocker.patch.object(self.client, "model_info", side_effect=KeyError("model_name"))
+
+        assert self.scheduler.instruct(InstructPrompt(prompt="hi"), "a") == "hi"
+        # the loaded model was unknown, so it was loaded again
+        assert Mega(self.client.load_model).called_once()
+
+    def test_unexpected_error_fails_request(self, mocker: MockerFixture) -> None:
+        serve = self.scheduler._serve
+        calls = 0
+
+        def fail_once(*args) -> ModelKey | None:
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                raise RuntimeError("bug")
+            return serve(*args)
+
+        mocker.patch.object(self.scheduler, "_serve", side_effect=fail_once)
+
+        with pytest.raises(RuntimeError, match="bug"):
+            self.scheduler.instruct(InstructPrompt(prompt="hi"), "a")
+        # the worker is still running
+        assert self.scheduler.instruct(InstructPrompt(prompt="again"), "a") == "again"
+
+    def test_routes_to_backend_with_model(self) -> None:
+        scheduler = ModelScheduler(["http://sched-a", "http://sched-b"])
+        clients = [
+            self._mock_client(backend.client, model)
+            for backend, model in zip(scheduler.backends, ["a", "b"])
+        ]
+        for backend, client in zip(scheduler.backends, clients):
+            backend.client = client
+
+        with scheduler:
+            futures = [
+                scheduler.submit(InstructPrompt(prompt=model), model) for model in ["a", "b"] * 4
+            ]
+            assert [future.result() for future in futures] == ["a", "b"] * 4
+
+        assert [backend.switches for backend in scheduler.backends] == [0, 0]
+        assert Mega(clients[0].instruct).call_count == 4
+        assert Mega(clients[1].instruct).call_count == 4
+
+    def test_submit_after_close(self) -> None:
+        self.scheduler.close()
+
+        with pytest.raises(RuntimeError):
+            self.scheduler.submit(InstructPrompt(prompt="hi"), "a")
@@ -0,0 +1,24 @@
+import pytest
+
+from ooba_api.stats import percentile, summarize
+
+
+def test_percentile_nearest_rank() -> None:
+    values = [float(value) for value in range(1, 101)]
+
+    assert percentile(values, 0.5) == 50
+    assert percentile(values, 0.95) == 95
+    assert percentile(values, 0.99) == 99
+    assert percentile([3.0], 0.99) == 3
+
+
+def test_summarize() -> None:
+    summary = summarize([0.3, 0.1, 0.2])
+
+    assert summary.count == 3
+    assert summary.mean == pytest.approx(0.2)
+    assert summary.p50 == 0.2
+    assert summary.max == 0.3
+
+    with pytest.raises(ValueError):
+        summarize([])
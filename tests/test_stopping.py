@@ -0,0 +1,51 @@
+import re
+
+from ooba_api.stopping import CodeFenceStop, JsonObjectStop, RegexStop, StopResult, find_stop
+
+
+class TestRegexStop:
+    def test_keeps_match(self) -> None:
+        assert RegexStop(r"\d+\.")("answer: 42. more") == len("answer: 42.")
+        assert RegexStop(r"\d+\.")("answer: 42") is None
+
+    def test_cuts_before_match(self) -> None:
+        stop = RegexStop(re.compile("^Question:", re.MULTILINE), keep_match=False)
+
+        assert stop("an answer\nQuestion: next") == len("an answer\n")
+
+
+class TestJsonObjectStop:
+    def test_stops_after_balanced_object(self) -> None:
+        text = 'Sure: {"a": {"b": [1, 2]}} and more'
+
+        assert JsonObjectStop()(text) == len('Sure: {"a": {"b": [1, 2]}}')
+
+    def test_skips_braces_in_strings(self) -> None:
+        text = '{"a": "} \\" {"}'
+
+        assert JsonObjectStop()(text[:-1]) is None
+        assert JsonObjectStop()(text) == len(text)
+
+    def test_waits_for_object(self) -> None:
+        assert JsonObjectStop()("no object yet") is None
+        assert JsonObjectStop()('{"a": {') is None
+
+
+class TestCodeFenceStop:
+    def test_stops_at_closing_fence(self) -> None:
+        text = "Here:\n```python\nprint(1)\n```\nDone"
+
+        assert CodeFenceStop()(text) == text.index("Done") - 1
+        assert CodeFenceStop()("Here:\n```python\nprint(1)\n") is None
+
+    def test_prompt_opened_fence(self) -> None:
+        assert CodeFenceStop(opened=True)("print(1)\n```\nDone") == len("print(1)\n```")
+
+
+def test_find_stop_uses_first_predicate_that_fires() -> None:
+    first = RegexStop("never")
+    second = RegexStop("b")
+    third = RegexStop("a")
+
+    assert find_stop("abc", [first, second, third]) == StopResult("ab", second)
+    assert find_stop("xyz", [first, second]) is None
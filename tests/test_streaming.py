@@ -0,0 +1,69 @@
+import asyncio
+import json
+import threading
+from typing import Iterator
+
+import pytest
+from websockets.sync.server import ServerConnection, serve
+
+from ooba_api.async_clients import AsyncOobaApiClient
+from ooba_api.clients import OobaApiClient, _default_stream_url
+from ooba_api.prompts import InstructPrompt
+from ooba_api.streaming import StreamChunk
+
+received: list[dict] = []
+
+
+def _handler(websocket: ServerConnection) -> None:
+    received.append(json.loads(websocket.recv()))
+    for message_num, text in enumerate(["output", " text"]):
+        websocket.send(
+            json.dumps({"event": "text_stream", "message_num": message_num, "text": text})
+        )
+    websocket.send(json.dumps({"event": "stream_end", "message_num": 2}))
+
+
+@pytest.fixture()
+def stream_url() -> Iterator[str]:
+    received.clear()
+    with serve(_handler, "localhost", 0) as server:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield f"ws://localhost:{server.socket.getsockname()[1]}"
+        server.shutdown()
+    thread.join()
+
+
+def _assert_chunks(chunks: list[StreamChunk]) -> None:
+    assert [chunk.text for chunk in chunks] == ["output", " text"]
+    assert [chunk.index for chunk in chunks] == [0, 1]
+    assert 0 <= chunks[0].elapsed <= chunks[1].elapsed
+    assert chunks[0].arrival_time <= chunks[1].arrival_time
+    assert received[0]["prompt"] == "a prompt"
+    assert received[0]["max_new_tokens"] == 128
+
+
+def test_default_stream_url() -> None:
+    assert _default_stream_url("http://localhost:5000") == "ws://localhost:5005"
+    assert _default_stream_url("https://example.com") == "wss://example.com:5005"
+
+
+def test_instruct_stream(stream_url: str) -> None:
+    client = OobaApiClient("http://unused", stream_url=stream_url)
+
+    chunks = list(client.instruct_stream(InstructPrompt(prompt="a prompt")))
+
+    _assert_chunks(chunks)
+
+
+def test_async_instruct_stream(stream_url: str) -> None:
+    client = AsyncOobaApiClient("http://unused", stream_url=stream_url)
+
+    async def run() -> list[StreamChunk]:
+        return [
+            chunk async for chunk in client.instruct_stream(InstructPrompt(prompt="a prompt"))
+        ]
+
+    chunks = asyncio.run(run())
+
+    _assert_chunks(chunks)
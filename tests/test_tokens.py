@@ -0,0 +1,64 @@
+import pytest
+
+from ooba_api.parameters import FrozenParameters, Parameters
+from ooba_api.tokens import PromptTooLong, TokenCountCache, fit_parameters, max_new_tokens_for
+
+
+class TestTokenCountCache:
+    def test_keyed_by_model_and_text(self) -> None:
+        cache = TokenCountCache()
+        cache.set("model", "text", 3)
+
+        assert cache.get("model", "text") == 3
+        assert cache.get("other model", "text") is None
+        assert cache.get("model", "other text") is None
+
+    def test_evicts_least_recently_used(self) -> None:
+        cache = TokenCountCache(maxsize=2)
+        cache.set("model", "a", 1)
+        cache.set("model", "b", 2)
+        cache.get("model", "a")
+
+        cache.set("model", "c", 3)
+
+        assert len(cache) == 2
+        assert cache.get("model", "a") == 1
+        assert cache.get("model", "b") is None
+
+
+class TestMaxNewTokensFor:
+    def test_keeps_max_new_tokens_when_it_fits(self) -> None:
+        assert max_new_tokens_for(100, Parameters(max_new_tokens=200)) == 200
+
+    def test_lowers_to_remaining_room(self) -> None:
+        parameters = Parameters(max_new_tokens=200, truncation_length=1000)
+
+        assert max_new_tokens_for(900, parameters) == 100
+
+    def test_rejects_prompt_without_room(self) -> None:
+        parameters = Parameters(truncation_length=1000)
+
+        with pytest.raises(PromptTooLong) as exc_info:
+            max_new_tokens_for(990, parameters, min_new_tokens=50)
+
+        assert exc_info.value.prompt_tokens == 990
+        assert exc_info.value.truncation_length == 1000
+
+
+class TestFitParameters:
+    def test_returns_same_parameters_when_they_fit(self) -> None:
+        parameters = Parameters()
+
+        assert fit_parameters(10, parameters) is parameters
+
+    def test_copy_does_not_share_encoding(self) -> None:
+        parameters = FrozenParameters(max_new_tokens=200, truncation_length=1000)
+        parameters._encoded[object] = b"stale"
+
+        fitted = fit_parameters(900, parameters)
+
+        assert isinstance(fitted, FrozenParameters)
+        assert fitted.max_new_tokens == 100
+        assert fitted.truncation_length == 1000
+        assert fitted._encoded == {}
+        assert parameters.max_new_tokens == 200
@@ -0,0 +1,145 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+
+import pytest
+import requests
+from megamock import MegaMock
+from requests.adapters import HTTPAdapter
+
+from ooba_api.results import RequestTimings
+from ooba_api.transport import JSON_HEADERS, RequestsTransport, TransportAborted
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path == "/slow":
+            time.sleep(1)
+        body = json.dumps({"results": [{"text": "output text"}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Set-Cookie", "session=abc; Path=/")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+@pytest.fixture()
+def server_url() -> Iterator[str]:
+    server = ThreadingHTTPServer(("localhost", 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://localhost:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+class TestRequestsTransport:
+    def test_session_is_reused(self) -> None:
+        transport = RequestsTransport()
+
+        assert transport.session is transport.session
+
+    def test_session_is_shared_across_threads(self) -> None:
+        transport = RequestsTransport()
+        sessions: list[requests.Session] = []
+        threads = [
+            threading.Thread(target=lambda: sessions.append(transport.session)) for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len({id(session) for session in sessions}) == 1
+
+    def test_pool_settings_are_applied(self) -> None:
+        transport = RequestsTransport(pool_connections=2, pool_maxsize=32)
+
+        adapter = transport.session.get_adapter("http://localhost:5000")
+
+        assert isinstance(adapter, HTTPAdapter)
+        assert adapter._pool_connections == 2
+        assert adapter._pool_maxsize == 32
+        assert adapter._pool_block is True
+
+    def test_keep_alive_header(self) -> None:
+        assert RequestsTransport().session.headers["Connection"] == "keep-alive"
+        assert RequestsTransport(keep_alive=False).session.headers["Connection"] == "close"
+
+    def test_post_uses_separate_connect_and_read_timeouts(self) -> None:
+        transport = RequestsTransport(connect_timeout=3)
+        session = MegaMock.it(requests.Session)
+        transport._session = session
+
+        transport.post("http://host/api/v1/generate", timeout=60, content=b'{"prompt":"a"}')
+
+        session.post.assert_called_once_with(
+            "http://host/api/v1/generate",
+            timeout=(3, 60),
+            data=b'{"prompt":"a"}',
+            headers=JSON_HEADERS,
+        )
+
+    def test_close_discards_session(self) -> None:
+        transport = RequestsTransport()
+        session = transport.session
+
+        transport.close()
+
+        assert transport.session is not session
+
+    def test_records_connect_time_and_reuses_connection(self, server_url: str) -> None:
+        transport = RequestsTransport()
+        first = RequestTimings()
+        second = RequestTimings()
+
+        transport.post(server_url, timeout=5, content=b"{}", timings=first)
+        response = transport.post(server_url, timeout=5, content=b"{}", timings=second)
+
+        assert response.json() == {"results": [{"text": "output text"}]}
+        assert first.connect is not None and first.connect > 0
+        assert second.connect == 0
+        assert first.time_to_first_byte is not None and first.time_to_first_byte > 0
+        transport.close()
+
+    def test_cookies_are_not_stored(self, server_url: str) -> None:
+        transport = RequestsTransport()
+
+        response = transport.post(server_url, timeout=5, content=b"{}")
+
+        assert response.headers["Set-Cookie"] == "session=abc; Path=/"
+        assert not transport.session.cookies
+        transport.close()
+
+    def test_abort_fails_requests_in_flight(self, server_url: str) -> None:
+        transport = RequestsTransport()
+        errors: list[Exception] = []
+
+        def post() -> None:
+            try:
+                transport.post(f"{server_url}/slow", timeout=5, content=b"{}")
+            except Exception as exc:
+                errors.append(exc)
+
+        thread = threading.Thread(target=post)
+        thread.start()
+        while not transport._sockets:
+            time.sleep(0.01)
+        start = time.monotonic()
+        transport.abort()
+        thread.join()
+
+        # did not wait for the server's answer
+        assert time.monotonic() - start < 0.5
+        assert isinstance(errors[0], requests.ConnectionError)
+        with pytest.raises(TransportAborted):
+            transport.post(server_url, timeout=5, content=b"{}")